@@ -0,0 +1,237 @@
+#app/admission.py
+import asyncio
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from observability import ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+# Solicitudes que pueden estar a la vez en el modelo (en cola del planificador o generando)
+ADMISSION_MODEL_CONCURRENCY = int(os.getenv("ADMISSION_MODEL_CONCURRENCY", "8"))
+# Consultas que solo llaman a una herramienta: no usan el modelo y tienen su propio cupo
+ADMISSION_TOOL_CONCURRENCY = int(os.getenv("ADMISSION_TOOL_CONCURRENCY", "16"))
+# Solicitudes esperando turno para el modelo; las imágenes tienen un tope propio porque ocupan memoria
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+ADMISSION_IMAGE_QUEUE_SIZE = int(os.getenv("ADMISSION_IMAGE_QUEUE_SIZE", "8"))
+# Solicitudes simultáneas (en espera o en curso) por cliente
+ADMISSION_PER_CLIENT = int(os.getenv("ADMISSION_PER_CLIENT", "2"))
+# Si la espera estimada supera este límite se rechaza de entrada con 429 y Retry-After
+ADMISSION_MAX_WAIT_S = float(os.getenv("ADMISSION_MAX_WAIT_S", "60"))
+
+# Clases en orden de prioridad: el cupo libre se entrega primero a la de menor índice
+PRIORITY_CLASSES = ("tool", "text", "image")
+POOLS = {"tool": "tool", "text": "model", "image": "model"}
+# Duración inicial estimada de cada clase, antes de tener mediciones
+INITIAL_SERVICE_S = {"tool": 0.05, "text": 8.0, "image": 15.0}
+SERVICE_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """La solicitud no entra: cola llena, demasiadas del mismo cliente o espera estimada muy larga"""
+
+    def __init__(self, reason: str, message: str, retry_after_s: float):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after_s = max(1, math.ceil(retry_after_s))
+
+
+@dataclass(eq=False)
+class Ticket:
+    kind: str
+    client: str
+    seq: int
+    granted: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+
+    @property
+    def priority(self) -> int:
+        return PRIORITY_CLASSES.index(self.kind)
+
+
+class Pool:
+    """Cupos de ejecución compartidos por una o más clases, con su cola de espera"""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self.active: List[Ticket] = []
+        self.waiting: List[Ticket] = []
+
+    def ahead_of(self, kind: str) -> List[Ticket]:
+        """Tickets en espera que pasarían antes que uno nuevo de esta clase"""
+        priority = PRIORITY_CLASSES.index(kind)
+        return [ticket for ticket in self.waiting if ticket.priority <= priority]
+
+
+class AdmissionController:
+    """Admite solicitudes por clase de prioridad con cupos y colas acotadas, y rechaza temprano si no hay espacio.
+
+    Todo corre en el event loop, así que no necesita locks.
+    """
+
+    def __init__(
+        self,
+        model_concurrency: int = ADMISSION_MODEL_CONCURRENCY,
+        tool_concurrency: int = ADMISSION_TOOL_CONCURRENCY,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        image_queue_size: int = ADMISSION_IMAGE_QUEUE_SIZE,
+        per_client: int = ADMISSION_PER_CLIENT,
+        max_wait_s: float = ADMISSION_MAX_WAIT_S,
+    ):
+        self.pools = {"model": Pool(model_concurrency), "tool": Pool(tool_concurrency)}
+        self.queue_size = max(0, queue_size)
+        self.image_queue_size = max(0, image_queue_size)
+        self.per_client = max(1, per_client)
+        self.max_wait_s = max_wait_s
+        self.service_s = dict(INITIAL_SERVICE_S)
+        self._seq = itertools.count()
+        self._clients: Dict[str, List[Ticket]] = {}
+
+        self.admitted = {kind: 0 for kind in PRIORITY_CLASSES}
+        self.rejected = {kind: 0 for kind in PRIORITY_CLASSES}
+
+    def pool_for(self, kind: str) -> Pool:
+        return self.pools[POOLS[kind]]
+
+    def estimated_wait_s(self, kind: str, ahead: Optional[List[Ticket]] = None) -> float:
+        """Espera hasta tener cupo: lo que falta de las activas más las que van adelante, repartido en los cupos"""
+        pool = self.pool_for(kind)
+        ahead = pool.ahead_of(kind) if ahead is None else ahead
+        if len(pool.active) + len(ahead) < pool.concurrency:
+            return 0.0
+        now = time.monotonic()
+        remaining = sum(
+            max(self.service_s[ticket.kind] - (now - ticket.started_at), 0.0) for ticket in pool.active
+        )
+        queued = sum(self.service_s[ticket.kind] for ticket in ahead)
+        return (remaining + queued) / pool.concurrency
+
+    def _reject(self, kind: str, reason: str, message: str, retry_after_s: float):
+        self.rejected[kind] += 1
+        ADMISSION_REJECTED.labels(kind, reason).inc()
+        raise AdmissionRejected(reason, message, retry_after_s)
+
+    def check(self, kind: str, client: str):
+        """Lanza AdmissionRejected si una solicitud de esta clase no entraría ahora"""
+        pool = self.pool_for(kind)
+        if len(self._clients.get(client, ())) >= self.per_client:
+            self._reject(
+                kind, "client_limit",
+                "Ya tienes preguntas en curso; espera a que terminen.",
+                min(self.service_s[ticket.kind] for ticket in self._clients[client])
+            )
+
+        free = len(pool.active) < pool.concurrency and not pool.waiting
+        if not free:
+            waiting_images = sum(1 for ticket in pool.waiting if ticket.kind == "image")
+            if len(pool.waiting) >= self.queue_size:
+                self._reject(kind, "queue_full", "Hay demasiadas preguntas en espera.", self.estimated_wait_s(kind))
+            if kind == "image" and waiting_images >= self.image_queue_size:
+                self._reject(kind, "queue_full", "Hay demasiadas imágenes en espera.", self.estimated_wait_s(kind))
+            wait = self.estimated_wait_s(kind)
+            if wait > self.max_wait_s:
+                self._reject(kind, "deadline", "El servidor está muy ocupado en este momento.", wait)
+
+    def _enqueue(self, kind: str, client: str) -> Ticket:
+        self.check(kind, client)
+        pool = self.pool_for(kind)
+        ticket = Ticket(kind, client, next(self._seq), asyncio.get_running_loop().create_future())
+        pool.waiting.append(ticket)
+        self._clients.setdefault(client, []).append(ticket)
+        self._dispatch(pool)
+        return ticket
+
+    def _dispatch(self, pool: Pool):
+        while pool.waiting and len(pool.active) < pool.concurrency:
+            ticket = min(pool.waiting, key=lambda waiting: (waiting.priority, waiting.seq))
+            pool.waiting.remove(ticket)
+            ticket.started_at = time.monotonic()
+            pool.active.append(ticket)
+            ticket.granted.set_result(None)
+
+    def _release(self, ticket: Ticket):
+        pool = self.pool_for(ticket.kind)
+        if ticket in pool.waiting:
+            pool.waiting.remove(ticket)
+        elif ticket in pool.active:
+            pool.active.remove(ticket)
+            elapsed = time.monotonic() - ticket.started_at
+            self.service_s[ticket.kind] += SERVICE_EWMA_ALPHA * (elapsed - self.service_s[ticket.kind])
+        client_tickets = self._clients.get(ticket.client, [])
+        if ticket in client_tickets:
+            client_tickets.remove(ticket)
+        if not client_tickets:
+            self._clients.pop(ticket.client, None)
+        self._dispatch(pool)
+
+    @asynccontextmanager
+    async def admit(self, kind: str, client: str):
+        """Espera cupo para una solicitud de la clase dada; lanza AdmissionRejected si no puede entrar"""
+        ticket = self._enqueue(kind, client)
+        try:
+            if not ticket.granted.done():
+                # La estimación puede fallar: nadie espera más que el límite
+                try:
+                    await asyncio.wait_for(asyncio.shield(ticket.granted), timeout=self.max_wait_s)
+                except asyncio.TimeoutError:
+                    self._reject(kind, "deadline", "El servidor está muy ocupado en este momento.", self.estimated_wait_s(kind))
+            self.admitted[kind] += 1
+            ADMISSION_WAIT_SECONDS.labels(kind).observe(ticket.started_at - ticket.enqueued_at)
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    def position(self, ticket: Ticket) -> int:
+        """1 para el siguiente en recibir cupo; 0 si ya está en ejecución"""
+        pool = self.pool_for(ticket.kind)
+        if ticket not in pool.waiting:
+            return 0
+        return 1 + sum(1 for waiting in pool.waiting if (waiting.priority, waiting.seq) < (ticket.priority, ticket.seq))
+
+    def client_status(self, client: str) -> List[Dict[str, Any]]:
+        status = []
+        for ticket in self._clients.get(client, ()):
+            pool = self.pool_for(ticket.kind)
+            position = self.position(ticket)
+            ahead = [
+                waiting for waiting in pool.waiting
+                if (waiting.priority, waiting.seq) < (ticket.priority, ticket.seq)
+            ]
+            status.append({
+                "kind": ticket.kind,
+                "position": position,
+                "estimated_wait_s": round(self.estimated_wait_s(ticket.kind, ahead), 1) if position else 0.0,
+                "waited_s": round(time.monotonic() - ticket.enqueued_at, 1),
+            })
+        return status
+
+    def queue_depth(self, kind: Optional[str] = None) -> int:
+        if kind is None:
+            return sum(len(pool.waiting) for pool in self.pools.values())
+        return sum(1 for ticket in self.pool_for(kind).waiting if ticket.kind == kind)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "classes": {
+                kind: {
+                    "waiting": self.queue_depth(kind),
+                    "active": sum(1 for ticket in self.pool_for(kind).active if ticket.kind == kind),
+                    "estimated_wait_s": round(self.estimated_wait_s(kind), 1),
+                    "service_s": round(self.service_s[kind], 2),
+                    "admitted": self.admitted[kind],
+                    "rejected": self.rejected[kind],
+                }
+                for kind in PRIORITY_CLASSES
+            },
+            "pools": {name: {"concurrency": pool.concurrency, "active": len(pool.active)} for name, pool in self.pools.items()},
+            "queue_size": self.queue_size,
+            "image_queue_size": self.image_queue_size,
+            "per_client": self.per_client,
+            "max_wait_s": self.max_wait_s,
+        }
@@ -0,0 +1,293 @@
+#app/answer_cache.py
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", str(7 * 24 * 3600)))
+# Vacío = solo en memoria
+ANSWER_CACHE_DB = os.getenv("ANSWER_CACHE_DB", "")
+# Filas que se conservan en disco; las que no caben en memoria se siguen encontrando ahí
+ANSWER_CACHE_DB_ROWS = int(os.getenv("ANSWER_CACHE_DB_ROWS", "10000"))
+
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "1") == "1"
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "256"))
+IMAGE_CACHE_TTL_S = float(os.getenv("IMAGE_CACHE_TTL_S", str(24 * 3600)))
+# Bits distintos (de 64) para considerar que dos fotos son la misma; 0 = solo idénticas
+IMAGE_CACHE_MAX_DISTANCE = int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", "6"))
+IMAGE_CACHE_DB = os.getenv("IMAGE_CACHE_DB", "")
+
+# Cada cuántas escrituras se borran de disco las filas vencidas o sobrantes (y siempre al arrancar)
+CACHE_PRUNE_EVERY = int(os.getenv("CACHE_PRUNE_EVERY", "100"))
+
+
+def normalize_question(question: str) -> str:
+    """Normaliza mayúsculas, tildes, puntuación y espacios: '¿Cómo controlar la Roya?' -> 'como controlar la roya'"""
+    text = unicodedata.normalize("NFKD", question.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def cache_key(question: str, **settings) -> str:
+    params = "|".join(f"{name}={settings[name]}" for name in sorted(settings))
+    return f"{normalize_question(question)}|{params}"
+
+
+def prune_table(db: sqlite3.Connection, table: str, ttl_s: float, max_rows: int) -> int:
+    """Borra las filas vencidas y, si aún sobran, las más viejas; devuelve cuántas se eliminaron"""
+    deleted = 0
+    if ttl_s > 0:
+        deleted += db.execute(f"DELETE FROM {table} WHERE creado < ?", (time.time() - ttl_s,)).rowcount
+    deleted += db.execute(
+        f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY creado DESC LIMIT -1 OFFSET ?)",
+        (max(0, max_rows),)
+    ).rowcount
+    db.commit()
+    return deleted
+
+
+class AnswerCache:
+    """Caché LRU con vencimiento (TTL) y respaldo opcional en SQLite"""
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        ttl_s: float = ANSWER_CACHE_TTL_S,
+        db_path: str = ANSWER_CACHE_DB,
+        db_rows: int = ANSWER_CACHE_DB_ROWS,
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self.db_rows = max(self.max_entries, db_rows)
+        self.pruned = 0
+        self._writes = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS respuestas ("
+                "clave TEXT PRIMARY KEY, respuesta TEXT NOT NULL, creado REAL NOT NULL)"
+            )
+            self._db.commit()
+            self.pruned += prune_table(self._db, "respuestas", self.ttl_s, self.db_rows)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_s > 0 and time.time() - created > self.ttl_s
+
+    def _remember(self, key: str, answer: str, created: float):
+        self._entries[key] = (answer, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT respuesta, creado FROM respuestas WHERE clave = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = (row[0], row[1])
+                    self._remember(key, *entry)
+
+            if entry is None or self._expired(entry[1]):
+                if entry is not None:
+                    self._forget(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, answer: str):
+        created = time.time()
+        with self._lock:
+            self._remember(key, answer, created)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO respuestas (clave, respuesta, creado) VALUES (?, ?, ?)",
+                    (key, answer, created)
+                )
+                self._db.commit()
+                self._writes += 1
+                if self._writes % CACHE_PRUNE_EVERY == 0:
+                    self.pruned += prune_table(self._db, "respuestas", self.ttl_s, self.db_rows)
+
+    def _forget(self, key: str):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM respuestas WHERE clave = ?", (key,))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM respuestas")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "persistent": self._db is not None,
+            "pruned": self.pruned,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ImageAnswerCache:
+    """Caché de diagnósticos por imagen: misma pregunta y hash perceptual a pocos bits de distancia"""
+
+    def __init__(
+        self,
+        max_entries: int = IMAGE_CACHE_SIZE,
+        ttl_s: float = IMAGE_CACHE_TTL_S,
+        max_distance: int = IMAGE_CACHE_MAX_DISTANCE,
+        db_path: str = IMAGE_CACHE_DB,
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self.max_distance = max(0, max_distance)
+        self.pruned = 0
+        self._writes = 0
+        # (clave de pregunta, hash) -> (respuesta, creado); el orden es el de uso (LRU)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._by_question: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS respuestas_imagen ("
+                "clave TEXT NOT NULL, hash TEXT NOT NULL, respuesta TEXT NOT NULL, creado REAL NOT NULL, "
+                "PRIMARY KEY (clave, hash))"
+            )
+            self._db.commit()
+            # Solo se cargan max_entries filas: las demás nunca se leerían
+            self.pruned += prune_table(self._db, "respuestas_imagen", self.ttl_s, self.max_entries)
+            # La búsqueda por distancia es en memoria: se cargan las entradas más recientes
+            rows = self._db.execute(
+                "SELECT clave, hash, respuesta, creado FROM respuestas_imagen ORDER BY creado DESC LIMIT ?",
+                (self.max_entries,)
+            ).fetchall()
+            for key, image_hash, answer, created in reversed(rows):
+                if not self._expired(created):
+                    self._remember((key, int(image_hash, 16)), answer, created)
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_s > 0 and time.time() - created > self.ttl_s
+
+    def _remember(self, entry_key: tuple, answer: str, created: float):
+        self._entries[entry_key] = (answer, created)
+        self._entries.move_to_end(entry_key)
+        self._by_question.setdefault(entry_key[0], set()).add(entry_key[1])
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._drop_index(evicted)
+            self.evictions += 1
+
+    def _drop_index(self, entry_key: tuple):
+        hashes = self._by_question.get(entry_key[0])
+        if hashes is not None:
+            hashes.discard(entry_key[1])
+            if not hashes:
+                del self._by_question[entry_key[0]]
+
+    def _forget(self, entry_key: tuple):
+        if self._entries.pop(entry_key, None) is not None:
+            self._drop_index(entry_key)
+        if self._db is not None:
+            self._db.execute(
+                "DELETE FROM respuestas_imagen WHERE clave = ? AND hash = ?", (entry_key[0], f"{entry_key[1]:016x}")
+            )
+            self._db.commit()
+
+    def get(self, key: str, image_hash: int) -> Optional[str]:
+        with self._lock:
+            best = None
+            for candidate in self._by_question.get(key, ()):
+                distance = bin(candidate ^ image_hash).count("1")
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, candidate)
+
+            if best is not None:
+                entry_key = (key, best[1])
+                answer, created = self._entries[entry_key]
+                if not self._expired(created):
+                    self._entries.move_to_end(entry_key)
+                    self.hits += 1
+                    if best[0] > 0:
+                        self.near_hits += 1
+                    return answer
+                self._forget(entry_key)
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, image_hash: int, answer: str):
+        created = time.time()
+        with self._lock:
+            self._remember((key, image_hash), answer, created)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO respuestas_imagen (clave, hash, respuesta, creado) VALUES (?, ?, ?, ?)",
+                    (key, f"{image_hash:016x}", answer, created)
+                )
+                self._db.commit()
+                self._writes += 1
+                if self._writes % CACHE_PRUNE_EVERY == 0:
+                    self.pruned += prune_table(self._db, "respuestas_imagen", self.ttl_s, self.max_entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_question.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM respuestas_imagen")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "max_distance": self.max_distance,
+            "persistent": self._db is not None,
+            "pruned": self.pruned,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
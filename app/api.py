@@ -1,298 +1,589 @@
 #app/api.py
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse
-from transformers import pipeline
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import torch
 import uvicorn
 from typing import Optional, Dict, Any, Union, List
 from PIL import Image
 import io
-import requests
 import json
 import os
+import queue
+import asyncio
+import threading
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from admission import ADMISSION_ENABLED, AdmissionController, AdmissionRejected
+from inference import MODEL_PATH, InferenceEngine, LoadProfile, peak_rss_mb
+from image_preprocessing import IMAGE_TARGET_SIZE, ImagePreprocessor, ImageRejected
+from answer_cache import ANSWER_CACHE_ENABLED, IMAGE_CACHE_ENABLED, AnswerCache, ImageAnswerCache, cache_key
+from intent_router import INTENT_PRODUCTS_REFRESH_S, INTENT_ROUTER_ENABLED, IntentRouter
+from prompts import (
+    EMPTY_ANSWERS, GENERATION_PARAMS, SYSTEM_PROMPT, build_messages, extract_content_from_response, extract_response_content,
+    image_question
+)
+from observability import ADMISSION_QUEUE_DEPTH, MODEL_MEMORY_BYTES, QUEUE_DEPTH, REQUEST_SECONDS, configure_logging, get_logger
+from scheduler import BatchScheduler, InferenceRequest
+from sessions import SESSIONS_ENABLED, SessionStore
+from tool_calls import ToolCallParser
+from tool_client import ToolClient
+from tool_registry import TOOLS_MODE, build_inprocess_client
+from transcription import (
+    AUDIO_MAX_BYTES, TRANSCRIPTION_ENABLED, WHISPER_BEAM_SIZE, WHISPER_LANGUAGE, Transcriber, TranscriptionError
+)
+from worker import InferenceWorker, ClientDisconnected, REQUEST_TIMEOUT_S, await_inference
+
+configure_logging()
+logger = get_logger("api")
 
 app = FastAPI(title="Coffee Expert API", version="1.0.0")
 
-pipe = None
+engine = None
+scheduler = None
+model_loading = None
+products_refresh = None
+load_profile = LoadProfile()
+worker = InferenceWorker()
+image_preprocessor = ImagePreprocessor()
+transcriber = Transcriber() if TRANSCRIPTION_ENABLED else None
+answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
+image_cache = ImageAnswerCache() if IMAGE_CACHE_ENABLED else None
+intent_router = IntentRouter.from_env() if INTENT_ROUTER_ENABLED else None
+session_store = SessionStore() if SESSIONS_ENABLED else None
+admission = AdmissionController() if ADMISSION_ENABLED else None
+
+INVENTORY_API_BASE_URL = os.getenv("INVENTORY_API_BASE_URL", "http://localhost:8001")
+EXPENSES_API_BASE_URL = os.getenv("EXPENSES_API_BASE_URL", "http://localhost:8002")
+PRODUCTION_API_BASE_URL = os.getenv("PRODUCTION_API_BASE_URL", "http://localhost:8003")
+INCOME_API_BASE_URL = os.getenv("INCOME_API_BASE_URL", "http://localhost:8004")
+
+# Generaciones sintéticas (texto e imagen) antes de marcar el modelo como listo
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+WARMUP_TOKENS = int(os.getenv("WARMUP_TOKENS", "8"))
+
+if TOOLS_MODE == "inprocess":
+    # Instalaciones de una sola finca: sin procesos ni saltos HTTP para las herramientas
+    tool_client = build_inprocess_client(app)
+else:
+    tool_client = ToolClient({
+        "inventario": INVENTORY_API_BASE_URL,
+        "gastos": EXPENSES_API_BASE_URL,
+        "cosecha": PRODUCTION_API_BASE_URL,
+        "ingresos": INCOME_API_BASE_URL,
+    })
+
+
+# Llamada a herramienta cortada o sin argumentos: mejor preguntar que consultar con datos incompletos
+INCOMPLETE_TOOL_CALL_ANSWER = "No pude completar la consulta. ¿Puedes indicarme el producto, o el mes y el año?"
+
+
+def warmup_runs():
+    """Una solicitud de texto y una de imagen por los mismos caminos que usan las reales"""
+    image = Image.new("RGB", (IMAGE_TARGET_SIZE, IMAGE_TARGET_SIZE), (96, 128, 64))
+    runs = []
+    for modality, question in (("text", "Hola"), ("image", "¿Qué ves?")):
+        request = InferenceRequest(
+            modality=modality,
+            messages=build_messages(question, modality == "image"),
+            max_tokens=WARMUP_TOKENS,
+            image=image if modality == "image" else None
+        )
+        runs.append(([request], {"prefix": modality, **GENERATION_PARAMS[modality]}))
+    return runs
+
+
+async def load_model():
+    global engine, scheduler
 
-INVENTORY_API_BASE_URL = "http://localhost:8001"
-EXPENSES_API_BASE_URL = "http://localhost:8002"
-PRODUCTION_API_BASE_URL = "http://localhost:8003"
-INCOME_API_BASE_URL = "http://localhost:8004"
+    try:
+        if not os.path.exists(MODEL_PATH):
+            raise ValueError(f"El modelo no se encuentra en {MODEL_PATH}")
+
+        # El modelo se crea en el hilo del worker, que es el único que lo usa;
+        # dispositivo, dtype y cuantización salen de INFERENCE_DEVICE / INFERENCE_DTYPE / CPU_QUANTIZATION
+        loaded_engine = await worker.run(InferenceEngine, MODEL_PATH, profile=load_profile)
+        # Solo el prompt de texto se reutiliza: en las imágenes los pixel_values
+        # se consumen en el primer paso, que el prefijo en caché se saltaría
+        with load_profile.step("prefix"):
+            await worker.run(loaded_engine.build_prefix_cache, "text", SYSTEM_PROMPT)
+
+        if MODEL_WARMUP:
+            with load_profile.step("warmup"):
+                await worker.run(loaded_engine.warmup, warmup_runs())
+
+        scheduler = BatchScheduler(generate_batch, executor=worker.executor)
+        scheduler.start()
+        engine = loaded_engine
+        load_profile.ready()
+        logger.info("Modelo listo", extra={"load": load_profile.snapshot()})
+    except Exception as e:
+        load_profile.fail(e)
+        logger.error("No se pudo cargar el modelo", extra={"error": load_profile.error})
 
 
-#For the MVP we will use only two tools: inventory and expenses
-SYSTEM_PROMPT = """Eres un experto en café de Colombia con amplio conocimiento sobre cultivo, procesamiento, variedades, manejo de plagas y enfermedades.
-Vas a responder preguntas sobre café de manera natural y directa, sin usar formato JSON, a menos que se indique lo contrario.
+@app.on_event("startup")
+async def start_model_loading():
+    global model_loading, load_profile
+    load_profile = LoadProfile()
+    # En segundo plano: la API responde (y /health informa la fase) mientras el modelo carga
+    model_loading = asyncio.create_task(load_model())
+
 
-INSTRUCCIONES CRÍTICAS:
-- Por defecto, SIEMPRE responde en lenguaje natural, NO en formato JSON
-- SOLO usa herramientas en estos casos específicos:
-  * Si preguntan "¿cuánto hay de X?" o "¿qué cantidad tenemos de X?" → usa inventario_consulta
-  * Si preguntan "¿cuánto gastamos en mes/año?" → usa gastos_consulta
-- Para TODAS las demás preguntas (saludos, enfermedades, plagas, consejos, análisis de imágenes, etc.) responde DIRECTAMENTE sin usar herramientas
+@app.on_event("startup")
+async def register_gauges():
+    QUEUE_DEPTH.set_function(lambda: scheduler.queue_depth if scheduler is not None else 0)
+    if admission is not None:
+        for kind in ("tool", "text", "image"):
+            ADMISSION_QUEUE_DEPTH.labels(kind).set_function(lambda kind=kind: admission.queue_depth(kind))
+    MODEL_MEMORY_BYTES.labels("peak_rss").set_function(lambda: (peak_rss_mb() or 0) * 1024 * 1024)
+    if torch.cuda.is_available():
+        MODEL_MEMORY_BYTES.labels("cuda_allocated").set_function(torch.cuda.memory_allocated)
+    if session_store is not None:
+        MODEL_MEMORY_BYTES.labels("session_kv").set_function(session_store.kv_bytes)
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    started = time.monotonic()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # La plantilla de la ruta, no la URL: /sessions/{session_id} es una sola serie
+        route = request.scope.get("route")
+        REQUEST_SECONDS.labels(
+            request.method, getattr(route, "path", "unmatched"), str(status)
+        ).observe(time.monotonic() - started)
 
-Ejemplos de cuando NO usar herramientas:
-- Cuando te saluden
-- "¿Cómo tratar la roya?" → Responde directamente
 
-Ejemplos de cuando SÍ usar herramientas:
-- "¿Cuánto fertilizante tenemos?" → {"tool": "inventario_consulta", "argumentos": "producto=fertilizante"}
-- "¿Cuánto gastamos en enero 2024?" → {"tool": "gastos_consulta", "argumentos": "mes=1,año=2024"}
-"""
+@app.on_event("startup")
+async def start_tool_client():
+    await tool_client.start()
 
-SYSTEM_PROMPT_IMAGE = """Eres un experto en café de Colombia con amplio conocimiento sobre cultivo, procesamiento, variedades, 
-manejo de plagas y enfermedades, y todas las prácticas agrícolas relacionadas con el café colombiano.
 
-Analiza la imagen proporcionada y responde de manera natural y directa en español. NO uses formato JSON ni herramientas.
-Proporciona un análisis detallado de lo que observas en la imagen, identificando posibles problemas, enfermedades, 
-estado de la planta o cualquier aspecto relevante relacionado con el café."""
+async def refresh_router_products():
+    """Mantiene en el router la lista de productos registrados: solo esos (y los conocidos) se responden sin el modelo"""
+    while True:
+        try:
+            filas = await tool_client.get_json("inventario", "/inventarioconsultar/productos/")
+            intent_router.update_products(fila["producto"] for fila in filas)
+        except Exception as e:
+            logger.debug("No se pudo leer la lista de productos", extra={"error": str(e)})
+        await asyncio.sleep(INTENT_PRODUCTS_REFRESH_S)
 
 
 @app.on_event("startup")
-async def load_model():
-    global pipe
-    
-    local_model_path = "./models"
-    
-    if not os.path.exists(local_model_path):
-        raise ValueError(f"El modelo no se encuentra en {local_model_path}")
-    
-    pipe = pipeline(
-        "image-text-to-text",
-        model=local_model_path,
-        device="cuda",
-        torch_dtype=torch.bfloat16,
-        truncation=True,
-        local_files_only=True
-    )
+async def start_products_refresh():
+    global products_refresh
+    if intent_router is not None:
+        products_refresh = asyncio.create_task(refresh_router_products())
+
 
-def consultar_inventario_api(producto: str) -> Dict[str, Any]:
+@app.on_event("startup")
+async def load_transcriber():
+    if transcriber is not None:
+        # En segundo plano: la API responde mientras Whisper carga
+        asyncio.get_running_loop().run_in_executor(transcriber.executor, transcriber.load)
+
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    if model_loading is not None:
+        model_loading.cancel()
+    if products_refresh is not None:
+        products_refresh.cancel()
+    if scheduler is not None:
+        await scheduler.stop()
+    worker.shutdown()
+    image_preprocessor.shutdown()
+    if transcriber is not None:
+        transcriber.shutdown()
+    await tool_client.close()
+
+
+def generate_batch(batch: List[InferenceRequest]) -> List[str]:
+    """Ejecuta una sola generación para un lote de solicitudes de la misma modalidad, un turno de conversación o un stream"""
+    modality = batch[0].modality
+    if batch[0].job is not None:
+        batch[0].job()
+        return [None]
+    if batch[0].session is not None:
+        request = batch[0]
+        return [engine.generate_session(request.session, request, **GENERATION_PARAMS[modality]) or EMPTY_ANSWERS[modality]]
+    answers = engine.generate_batch(batch, prefix=modality, **GENERATION_PARAMS[modality])
+    return [answer or EMPTY_ANSWERS[modality] for answer in answers]
+
+
+async def consultar_inventario_api(producto: str) -> Dict[str, Any]:
     try:
-        response = requests.get(f"{INVENTORY_API_BASE_URL}/inventarioconsultar/", params={"producto": producto})
-        return response.json()
+        return await tool_client.get_json("inventario", "/inventarioconsultar/", {"producto": producto})
     except Exception as e:
         return {"error": f"Error al consultar inventario: {str(e)}"}
 
 
-def consultar_gastos_api(mes: int, año: int) -> Dict[str, Any]:
+async def consultar_gastos_api(mes: int, año: int, categoria: Optional[str] = None) -> Dict[str, Any]:
+    params = {"mes": mes, "año": año}
+    if categoria:
+        params["categoria"] = categoria
     try:
-        response = requests.get(f"{EXPENSES_API_BASE_URL}/gastosconsultar/", params={"mes": mes, "año": año})
-        return response.json()
+        return await tool_client.get_json("gastos", "/gastosconsultar/", params)
     except Exception as e:
         return {"error": f"Error al consultar gastos: {str(e)}"}
 
 
-def parse_tool_call(response):
+async def consultar_cosecha_api(mes: int, año: int) -> Dict[str, Any]:
     try:
-        response_json = json.loads(response.strip())
-        tool_name = response_json.get("tool")
-        
-        argumentos_raw = response_json.get("argumentos")
-        
-        if argumentos_raw is None:
-            return None, None
-            
-        if isinstance(argumentos_raw, str):
-            argumentos = {}
-            for arg in argumentos_raw.split(","):
-                if "=" in arg:
-                    key, value = arg.strip().split("=", 1)
-                    argumentos[key.strip()] = value.strip()
-                else:
-                    argumentos["producto"] = arg.strip()
-                    
-        elif isinstance(argumentos_raw, dict):
-            argumentos = argumentos_raw
-        else:
-            argumentos = {"producto": str(argumentos_raw)}
-            
-        return tool_name, argumentos
-        
+        return await tool_client.get_json("cosecha", "/cosechaconsultar/", {"mes": mes, "año": año})
     except Exception as e:
-        print(f"Error parsing tool call: {e}")
-        print(f"Response was: {response}")
-        return None, None
-
-
-def extract_content_from_response(raw_response: Union[str, List, Dict]) -> str:
-    """Extract text content from various response formats"""
-    
-    if isinstance(raw_response, str):
-        return raw_response
-    
-    if isinstance(raw_response, list):
-        for item in raw_response:
-            if isinstance(item, str):
-                return item
-            elif isinstance(item, dict) and "text" in item:
-                return item["text"]
-        return str(raw_response)
-    
-    if isinstance(raw_response, dict):
-        for key in ["text", "content", "response", "answer"]:
-            if key in raw_response:
-                return extract_content_from_response(raw_response[key])
-        return str(raw_response)
-    
-    return str(raw_response)
-
-
-def extract_response_content(answer: Union[str, List, Dict]) -> str:
-    """Extrae el contenido de respuesta si viene en formato JSON o estructurado"""
-    
-    text_content = extract_content_from_response(answer)
-    
+        return {"error": f"Error al consultar cosecha: {str(e)}"}
+
+
+async def consultar_ingresos_api(mes: int, año: int) -> Dict[str, Any]:
     try:
-        response_json = json.loads(text_content.strip())
-        if isinstance(response_json, dict) and "respuesta" in response_json:
-            return response_json["respuesta"]
-        return text_content
-    except (json.JSONDecodeError, ValueError, AttributeError):
-        return text_content
+        return await tool_client.get_json("ingresos", "/ingresosconsultar/", {"mes": mes, "año": año})
+    except Exception as e:
+        return {"error": f"Error al consultar ingresos: {str(e)}"}
+
+
+def get_session(session_id: Optional[str]):
+    if session_store is None or not session_id:
+        return None
+    try:
+        return session_store.get(session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def record_turn(session, question: str, answer: str):
+    """Guarda el turno en el historial; las fotos quedan como texto porque la caché KV no puede incluir píxeles"""
+    if session is None:
+        return
+    session.add_turn(question, answer)
+    session_store.enforce_budget()
+
+
+def session_summary(session) -> Optional[Dict[str, Any]]:
+    return session_store.describe(session.session_id) if session is not None else None
+
+
+async def run_tool(tool_name: Optional[str], argumentos: Optional[Dict[str, Any]], answer: str = ""):
+    """Ejecuta una herramienta conocida y arma la respuesta final; si no aplica devuelve answer"""
+    tools_used = None
+    final_answer = answer
+
+    if tool_name == "inventario_consulta" and argumentos and "producto" in argumentos:
+        resultado = await consultar_inventario_api(argumentos["producto"])
+        tools_used = {"inventario_consulta": resultado}
+        if isinstance(resultado, (int, float)):
+            final_answer = f"Quedan disponibles: {resultado} unidades de {argumentos['producto']}."
+        elif isinstance(resultado, dict):
+            if "error" in resultado:
+                final_answer = resultado["error"]
+            else:
+                cantidad = resultado.get("cantidad", resultado.get("unidades", resultado))
+                final_answer = f"Quedan disponibles: {cantidad} unidades de {argumentos['producto']}."
+        else:
+            final_answer = f"Quedan disponibles: {resultado}"
+
+    elif tool_name == "gastos_consulta" and argumentos and "mes" in argumentos and "año" in argumentos:
+        categoria = argumentos.get("categoria")
+        resultado = await consultar_gastos_api(int(argumentos["mes"]), int(argumentos["año"]), categoria)
+        tools_used = {"gastos_consulta": resultado}
+        periodo = f"{argumentos['mes']}/{argumentos['año']}"
+        gasto = f"El gasto en {categoria} en {periodo}" if categoria else f"El gasto total en {periodo}"
+        if isinstance(resultado, (int, float)):
+            final_answer = f"{gasto} fue de: ${resultado}."
+        elif isinstance(resultado, dict):
+            if "error" in resultado:
+                final_answer = resultado["error"]
+            else:
+                total_gasto = resultado.get("total", resultado.get("gasto", 0))
+                final_answer = f"{gasto} fue de: ${total_gasto}."
+        else:
+            final_answer = f"{gasto} fue de: ${resultado}"
+
+    return final_answer, tools_used
+
+
+async def resolve_tool_call(raw_answer: Union[str, List, Dict]):
+    """Ejecuta la herramienta solicitada por el modelo, si la hay, y arma la respuesta final"""
+    answer = extract_response_content(raw_answer)
+    parser = ToolCallParser().feed(extract_content_from_response(raw_answer))
+    tool_name, argumentos = parser.result()
+    if parser.rejected:
+        return INCOMPLETE_TOOL_CALL_ANSWER, None
+    return await run_tool(tool_name, argumentos, answer)
+
+
+def text_cache_key(question: str, max_tokens: int) -> str:
+    return cache_key(question, max_tokens=max_tokens, **GENERATION_PARAMS["text"])
+
+
+def image_cache_key(question: str, max_tokens: int) -> str:
+    return cache_key(question, max_tokens=max_tokens, **GENERATION_PARAMS["image"])
+
+
+def is_cacheable(raw_answer: str, tools_used) -> bool:
+    """Las respuestas con herramientas dependen de datos en vivo y nunca se guardan"""
+    return tools_used is None and not extract_content_from_response(raw_answer).strip().startswith("{")
+
+
+def request_kind(match, is_image_request: bool) -> str:
+    """Clase de prioridad: consultas de herramienta sin modelo, texto o imagen"""
+    if match is not None:
+        return "tool"
+    return "image" if is_image_request else "text"
+
+
+def client_key(request: Request, session_id: Optional[str]) -> str:
+    """La conversación de la UI si la hay; si no, el encabezado X-Client-Id o la IP"""
+    if session_id:
+        return f"session:{session_id}"
+    client_id = request.headers.get("X-Client-Id")
+    if client_id:
+        return f"client:{client_id}"
+    return f"ip:{request.client.host if request.client else 'desconocido'}"
+
+
+@asynccontextmanager
+async def admitted(kind: str, client: str):
+    if admission is None:
+        yield None
+        return
+    async with admission.admit(kind, client) as ticket:
+        yield ticket
+
+
+def overloaded_response(question: str, is_image_request: bool, e: AdmissionRejected) -> JSONResponse:
+    logger.warning("Solicitud rechazada por sobrecarga", extra={"reason": e.reason, "retry_after_s": e.retry_after_s})
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(e.retry_after_s)},
+        content={
+            "question": question,
+            "answer": f"{e} Intenta de nuevo en {e.retry_after_s} s.",
+            "has_image": is_image_request,
+            "tools_used": None,
+            "error": True,
+            "reason": e.reason,
+            "retry_after_s": e.retry_after_s
+        }
+    )
+
+
+def timeout_content(question: str, is_image_request: bool) -> Dict[str, Any]:
+    """Cuerpo de la respuesta cuando se agota REQUEST_TIMEOUT_S; /ask lo devuelve con 504 y /ask/stream como evento error"""
+    logger.error("Tiempo de espera agotado", extra={"question": question, "timeout_s": REQUEST_TIMEOUT_S})
+    return {
+        "question": question,
+        "answer": "La respuesta tardó demasiado. Por favor, intenta de nuevo.",
+        "has_image": is_image_request,
+        "tools_used": None,
+        "error": True
+    }
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 
 @app.post("/ask")
 async def ask_question(
+    request: Request,
     question: str = Form(...),
     max_tokens: int = Form(200),
+    no_cache: bool = Form(False),
+    session_id: Optional[str] = Form(None),
     image: Optional[UploadFile] = File(None)
 ):
-    if pipe is None:
+    session = get_session(session_id)
+    # Las consultas de datos se resuelven sin el modelo, incluso mientras carga
+    match = intent_router.route(question) if intent_router is not None and image is None else None
+
+    if engine is None and match is None:
         raise HTTPException(status_code=503, detail="Modelo aún cargando")
 
+    # La imagen no se decodifica ni se preprocesa hasta que la solicitud tenga cupo
+    try:
+        async with admitted(request_kind(match, image is not None), client_key(request, session_id)):
+            return await answer_question(request, question, max_tokens, no_cache, image, session, match)
+    except AdmissionRejected as e:
+        return overloaded_response(question, image is not None, e)
+
+
+async def answer_question(
+    request: Request,
+    question: str,
+    max_tokens: int,
+    no_cache: bool,
+    image: Optional[UploadFile],
+    session,
+    match
+):
+    cancel_event = threading.Event()
+
     try:
         is_image_request = image is not None
         
         if is_image_request:
-            print(f"[DEBUG] Procesando imagen con pregunta: {question}")
+            logger.debug("Procesando imagen", extra={"question": question})
             
-            image_bytes = await image.read()
-            pil_image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            preprocessed = await image_preprocessor.process_upload(image)
+            logger.debug("Imagen preprocesada", extra={
+                "original_size": preprocessed.original_size,
+                "size": preprocessed.image.size,
+                "ms": round(preprocessed.timings_ms["total"], 1)
+            })
             
-            modified_question = f"Sobre esta imagen de café: {question}"
+            # Fotos casi idénticas de la misma hoja con la misma pregunta reutilizan el diagnóstico
+            use_cache = image_cache is not None and not no_cache
+            key = image_cache_key(question, max_tokens)
+            cached_answer = image_cache.get(key, preprocessed.dhash) if use_cache else None
+            if cached_answer is not None:
+                logger.info("Respuesta de imagen desde caché", extra={"question": question})
+                record_turn(session, image_question(question), cached_answer)
+                return JSONResponse(content={
+                    "question": question,
+                    "answer": cached_answer,
+                    "has_image": True,
+                    "tools_used": None,
+                    "cached": True,
+                    "image": preprocessed.summary(),
+                    "session": session_summary(session)
+                })
             
-            messages = [
-                {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT_IMAGE}]},
-                {"role": "user", "content": [{"type": "image"}, {"type": "text", "text": modified_question}]}
-            ]
+            messages = build_messages(question, is_image_request)
             
-            output = pipe(
-                text=messages, 
-                images=pil_image, 
-                max_new_tokens=max_tokens, 
-                temperature=0.8,
-                repetition_penalty=1.2,
-                top_p=0.95, 
-                use_cache=False,
-                truncation=True
+            raw_answer = await await_inference(
+                request,
+                scheduler.submit("image", messages, max_tokens, image=preprocessed.image, cancel_event=cancel_event),
+                cancel_event
             )
             
-            if output and len(output) > 0:
-                generated_text = output[0].get("generated_text", [])
-                if generated_text and len(generated_text) > 0:
-                    last_message = generated_text[-1]
-                    if isinstance(last_message, dict) and "content" in last_message:
-                        raw_answer = last_message["content"]
-                    else:
-                        raw_answer = str(last_message)
-                else:
-                    raw_answer = "No pude generar una respuesta para la imagen."
-            else:
-                raw_answer = "No se generó respuesta del modelo."
-            
             final_answer = extract_response_content(raw_answer)
+            if use_cache and final_answer != EMPTY_ANSWERS["image"]:
+                image_cache.put(key, preprocessed.dhash, final_answer)
+            record_turn(session, image_question(question), final_answer)
             
-            print(f"[DEBUG] Respuesta para imagen: {final_answer[:100]}...")
+            logger.info("Respuesta para imagen", extra={"question": question, "answer": final_answer[:100]})
             
             return JSONResponse(content={
                 "question": question,
                 "answer": final_answer,
                 "has_image": True,
-                "tools_used": None
+                "tools_used": None,
+                "cached": False,
+                "image": preprocessed.summary(),
+                "session": session_summary(session)
             })
 
         else:
-            print(f"[DEBUG] Procesando texto: {question}")
+            logger.debug("Procesando texto", extra={"question": question})
             
-            messages = [
-                {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT}]},
-                {"role": "user", "content": [{"type": "text", "text": question}]}
-            ]
+            if match is not None:
+                final_answer, tools_used = await run_tool(match.tool, match.argumentos)
+                logger.info("Ruta rápida", extra={
+                    "question": question,
+                    "tool": match.tool,
+                    "argumentos": match.argumentos,
+                    "source": match.source,
+                    "confidence": round(match.confidence, 2)
+                })
+                record_turn(session, question, final_answer)
+                return JSONResponse(content={
+                    "question": question,
+                    "answer": final_answer,
+                    "has_image": False,
+                    "tools_used": tools_used,
+                    "cached": False,
+                    "fast_path": True,
+                    "session": session_summary(session)
+                })
             
-            output = pipe(
-                text=messages, 
-                max_new_tokens=max_tokens,
-                temperature=0.7, 
-                repetition_penalty=1.1, 
-                top_p=0.95, 
-                use_cache=False,
-                truncation=True
-            )
+            # Una pregunta de seguimiento depende del historial: solo el primer turno usa la caché
+            use_cache = answer_cache is not None and not no_cache and (session is None or not session.turns)
+            key = text_cache_key(question, max_tokens)
+            cached_answer = answer_cache.get(key) if use_cache else None
+            if cached_answer is not None:
+                logger.info("Respuesta desde caché", extra={"question": question})
+                record_turn(session, question, cached_answer)
+                return JSONResponse(content={
+                    "question": question,
+                    "answer": cached_answer,
+                    "has_image": False,
+                    "tools_used": None,
+                    "cached": True,
+                    "session": session_summary(session)
+                })
             
-            if output and len(output) > 0:
-                generated_text = output[0].get("generated_text", [])
-                if generated_text and len(generated_text) > 0:
-                    last_message = generated_text[-1]
-                    if isinstance(last_message, dict) and "content" in last_message:
-                        raw_answer = last_message["content"]
-                    else:
-                        raw_answer = str(last_message)
-                else:
-                    raw_answer = "No pude generar una respuesta."
+            if session is not None:
+                # Un turno a la vez por conversación: cada uno extiende la caché KV del anterior
+                # Pasa por el planificador como lote de uno: cuenta en la cola, las estadísticas y la admisión
+                async with session.lock:
+                    raw_answer = await await_inference(
+                        request,
+                        scheduler.submit(
+                            "text", build_messages(question, False, session.history()), max_tokens,
+                            cancel_event=cancel_event, session=session
+                        ),
+                        cancel_event
+                    )
+                    final_answer, tools_used = await resolve_tool_call(raw_answer)
+                    record_turn(session, question, final_answer)
             else:
-                raw_answer = "No se generó respuesta del modelo."
+                messages = build_messages(question, is_image_request)
+                
+                raw_answer = await await_inference(
+                    request,
+                    scheduler.submit("text", messages, max_tokens, cancel_event=cancel_event),
+                    cancel_event
+                )
+                
+                final_answer, tools_used = await resolve_tool_call(raw_answer)
             
-            answer = extract_response_content(raw_answer)
-
-            tool_name, argumentos = parse_tool_call(extract_content_from_response(raw_answer))
-            tools_used = None
-            final_answer = answer
-
-            if tool_name == "inventario_consulta" and argumentos and "producto" in argumentos:
-                resultado = consultar_inventario_api(argumentos["producto"])
-                tools_used = {"inventario_consulta": resultado}
-                if isinstance(resultado, (int, float)):
-                    final_answer = f"Quedan disponibles: {resultado} unidades de {argumentos['producto']}."
-                elif isinstance(resultado, dict):
-                    if "error" in resultado:
-                        final_answer = resultado["error"]
-                    else:
-                        cantidad = resultado.get("cantidad", resultado.get("unidades", resultado))
-                        final_answer = f"Quedan disponibles: {cantidad} unidades de {argumentos['producto']}."
-                else:
-                    final_answer = f"Quedan disponibles: {resultado}"
-                    
-
-            elif tool_name == "gastos_consulta" and argumentos and "mes" in argumentos and "año" in argumentos:
-                resultado = consultar_gastos_api(int(argumentos["mes"]), int(argumentos["año"]))
-                tools_used = {"gastos_consulta": resultado}
-                if isinstance(resultado, (int, float)):
-                    final_answer = f"El gasto total en {argumentos['mes']}/{argumentos['año']} fue de: ${resultado}."
-                elif isinstance(resultado, dict):
-                    if "error" in resultado:
-                        final_answer = resultado["error"]
-                    else:
-                        total_gasto = resultado.get("total", resultado.get("gasto", 0))
-                        final_answer = f"El gasto total en {argumentos['mes']}/{argumentos['año']} fue de: ${total_gasto}."
-                else:
-                    final_answer = f"El gasto total en {argumentos['mes']}/{argumentos['año']} fue de: ${resultado}"
-            else:
-                final_answer = answer
+            if use_cache and is_cacheable(raw_answer, tools_used):
+                answer_cache.put(key, final_answer)
             
-            print(f"[DEBUG] Respuesta para texto: {final_answer[:100]}...")
+            logger.info("Respuesta para texto", extra={
+                "question": question, "answer": final_answer[:100], "tools_used": tools_used is not None
+            })
 
             return JSONResponse(content={
                 "question": question,
                 "answer": final_answer,
                 "has_image": False,
-                "tools_used": tools_used
+                "tools_used": tools_used,
+                "cached": False,
+                "session": session_summary(session)
             })
             
+    except ClientDisconnected:
+        logger.info("Cliente desconectado, generación cancelada", extra={"question": question})
+        return Response(status_code=499)
+
+    except ImageRejected as e:
+        logger.warning("Imagen rechazada", extra={"error": str(e), "status": e.status_code})
+        return JSONResponse(
+            status_code=e.status_code,
+            content={
+                "question": question,
+                "answer": str(e),
+                "has_image": True,
+                "tools_used": None,
+                "error": True
+            }
+        )
+
+    except asyncio.TimeoutError:
+        return JSONResponse(status_code=504, content=timeout_content(question, is_image_request))
+
     except Exception as e:
-        print(f"[ERROR] Error procesando pregunta: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error procesando pregunta", extra={"question": question})
         
         return JSONResponse(
             status_code=500,
@@ -306,9 +597,334 @@ async def ask_question(
         )
 
 
+@app.post("/ask/stream")
+async def ask_question_stream(
+    http_request: Request,
+    question: str = Form(...),
+    max_tokens: int = Form(200),
+    no_cache: bool = Form(False),
+    session_id: Optional[str] = Form(None),
+    image: Optional[UploadFile] = File(None)
+):
+    """Igual que /ask, pero envía los tokens como Server-Sent Events a medida que se generan"""
+    session = get_session(session_id)
+    match = intent_router.route(question) if intent_router is not None and image is None else None
+
+    if engine is None and match is None:
+        raise HTTPException(status_code=503, detail="Modelo aún cargando")
+
+    is_image_request = image is not None
+    kind = request_kind(match, is_image_request)
+    client = client_key(http_request, session_id)
+    # El cupo se toma dentro del stream; aquí solo se rechaza temprano. La imagen se lee ya con cupo, como en /ask
+    if admission is not None:
+        try:
+            admission.check(kind, client)
+        except AdmissionRejected as e:
+            return overloaded_response(question, is_image_request, e)
+
+    modality = "image" if is_image_request else "text"
+
+    if match is not None:
+        async def routed_stream():
+            try:
+                async with admitted(kind, client):
+                    final_answer, tools_used = await run_tool(match.tool, match.argumentos)
+            except AdmissionRejected as e:
+                yield sse_event("error", {"answer": str(e), "error": True, "retry_after_s": e.retry_after_s})
+                return
+            record_turn(session, question, final_answer)
+            yield sse_event("tool", {"tools_used": tools_used, "answer": final_answer})
+            yield sse_event("done", {
+                "question": question,
+                "answer": final_answer,
+                "has_image": False,
+                "tools_used": tools_used,
+                "cached": False,
+                "fast_path": True,
+                "session": session_summary(session)
+            })
+        return StreamingResponse(routed_stream(), media_type="text/event-stream")
+
+    # La caché de imágenes necesita el dHash de la foto: se consulta dentro del stream, tras preprocesarla
+    if is_image_request:
+        use_cache = image_cache is not None and not no_cache
+        key = image_cache_key(question, max_tokens)
+    else:
+        use_cache = answer_cache is not None and not no_cache and (session is None or not session.turns)
+        key = text_cache_key(question, max_tokens)
+        cached_answer = answer_cache.get(key) if use_cache else None
+        if cached_answer is not None:
+            async def cached_stream():
+                record_turn(session, question, cached_answer)
+                yield sse_event("done", {
+                    "question": question,
+                    "answer": cached_answer,
+                    "has_image": False,
+                    "tools_used": None,
+                    "cached": True,
+                    "session": session_summary(session)
+                })
+            return StreamingResponse(cached_stream(), media_type="text/event-stream")
+
+    request = InferenceRequest(
+        modality=modality,
+        messages=build_messages(question, is_image_request),
+        max_tokens=max_tokens
+    )
+    # Las fotos no extienden la caché de la conversación: solo se guardan en el historial
+    text_session = session if not is_image_request else None
+
+    async def event_stream():
+        text = ""
+        sent = 0
+        parser = ToolCallParser()
+        generation = None
+        deadline = time.monotonic() + REQUEST_TIMEOUT_S
+        # Cupo de admisión y, en una conversación, su turno; se sueltan al revés al terminar
+        held = AsyncExitStack()
+        try:
+            await held.enter_async_context(admitted(kind, client))
+        except AdmissionRejected as e:
+            yield sse_event("error", {"answer": str(e), "error": True, "retry_after_s": e.retry_after_s})
+            return
+        try:
+            if is_image_request:
+                try:
+                    preprocessed = await image_preprocessor.process_upload(image)
+                except ImageRejected as e:
+                    logger.warning("Imagen rechazada", extra={"error": str(e), "status": e.status_code})
+                    yield sse_event("error", {
+                        "question": question,
+                        "answer": str(e),
+                        "has_image": True,
+                        "tools_used": None,
+                        "error": True,
+                        "status": e.status_code
+                    })
+                    return
+                cached_answer = image_cache.get(key, preprocessed.dhash) if use_cache else None
+                if cached_answer is not None:
+                    logger.info("Respuesta de imagen desde caché", extra={"question": question})
+                    record_turn(session, image_question(question), cached_answer)
+                    yield sse_event("done", {
+                        "question": question,
+                        "answer": cached_answer,
+                        "has_image": True,
+                        "tools_used": None,
+                        "cached": True,
+                        "session": session_summary(session)
+                    })
+                    return
+                request.image = preprocessed.image
+            if text_session is not None:
+                await held.enter_async_context(text_session.lock)
+                request.messages = build_messages(question, False, text_session.history())
+            streamer, job = engine.prepare_stream(
+                request, prefix=modality, session=text_session, deadline=deadline, **GENERATION_PARAMS[modality]
+            )
+            # Pasa por el planificador como un lote de uno: cuenta en la profundidad de cola y en /scheduler/stats
+            generation = asyncio.ensure_future(scheduler.submit(
+                modality, request.messages, max_tokens, cancel_event=request.cancel_event, job=job
+            ))
+            tokens = iter(streamer)
+            while True:
+                try:
+                    chunk = await asyncio.to_thread(next, tokens, None)
+                except queue.Empty:
+                    # El streamer solo espera hasta el plazo: el modelo no produjo la siguiente pieza a tiempo
+                    request.cancel_event.set()
+                    raise asyncio.TimeoutError()
+                if chunk is None:
+                    break
+                if time.monotonic() > deadline:
+                    request.cancel_event.set()
+                    raise asyncio.TimeoutError()
+                text += chunk
+
+                # Una respuesta que empieza con "{" es una llamada a herramienta:
+                # se retiene hasta el final en vez de mostrarle JSON al usuario
+                parser.feed(chunk)
+                if parser.is_tool_call is False and len(text) > sent:
+                    yield sse_event("token", {"text": text[sent:]})
+                    sent = len(text)
+
+            await generation
+
+            raw_answer = text.strip() or EMPTY_ANSWERS[modality]
+            if is_image_request:
+                final_answer, tools_used = extract_response_content(raw_answer), None
+                if use_cache and text.strip():
+                    image_cache.put(key, preprocessed.dhash, final_answer)
+            else:
+                final_answer, tools_used = await resolve_tool_call(raw_answer)
+                if tools_used:
+                    yield sse_event("tool", {"tools_used": tools_used, "answer": final_answer})
+                if use_cache and is_cacheable(raw_answer, tools_used):
+                    answer_cache.put(key, final_answer)
+            record_turn(session, image_question(question) if is_image_request else question, final_answer)
+
+            logger.info("Respuesta en streaming", extra={"question": question, "answer": final_answer[:100]})
+
+            yield sse_event("done", {
+                "question": question,
+                "answer": final_answer,
+                "has_image": is_image_request,
+                "tools_used": tools_used,
+                "cached": False,
+                "session": session_summary(session)
+            })
+
+        except asyncio.TimeoutError:
+            yield sse_event("error", timeout_content(question, is_image_request))
+
+        except Exception as e:
+            logger.exception("Error en streaming", extra={"question": question})
+            yield sse_event("error", {"answer": f"Error al procesar la pregunta: {str(e)}", "error": True})
+
+        finally:
+            # Si el cliente se desconecta, Starlette cierra este generador y se detiene la generación
+            request.cancel_event.set()
+            if generation is not None and not generation.done():
+                # En cola, el planificador la descarta; en curso, la detiene cancel_event
+                generation.cancel()
+            await held.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/ask/queue")
+async def ask_queue(request: Request, session_id: Optional[str] = None):
+    """Posición en la cola y espera estimada de las preguntas del cliente, y la espera para una nueva por clase"""
+    if admission is None:
+        return {"enabled": False, "pending": [], "estimated_wait_s": {}}
+    classes = admission.stats()["classes"]
+    return {
+        "enabled": True,
+        "pending": admission.client_status(client_key(request, session_id)),
+        "estimated_wait_s": {kind: info["estimated_wait_s"] for kind, info in classes.items()},
+        "waiting": {kind: info["waiting"] for kind, info in classes.items()},
+    }
+
+
+@app.get("/admission/stats")
+async def admission_stats():
+    if admission is None:
+        return {"enabled": False}
+    return {"enabled": True, **admission.stats()}
+
+
+@app.post("/transcribe")
+async def transcribe_audio(
+    audio: UploadFile = File(...),
+    language: str = Form(WHISPER_LANGUAGE),
+    beam_size: int = Form(WHISPER_BEAM_SIZE)
+):
+    """Transcribe audio con el modelo Whisper compartido, sin archivos temporales"""
+    if transcriber is None:
+        raise HTTPException(status_code=503, detail="Transcripción deshabilitada")
+
+    data = await audio.read(AUDIO_MAX_BYTES + 1)
+    try:
+        result = await transcriber.transcribe(data, language=language, beam_size=beam_size)
+    except TranscriptionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    logger.info("Audio transcrito", extra={"speech_s": result["speech_s"], "text": result["text"]})
+    return result
+
+
+@app.get("/transcribe/stats")
+async def transcription_stats():
+    if transcriber is None:
+        return {"enabled": False}
+    return {"enabled": True, **transcriber.stats()}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy" if pipe else "loading", "model_loaded": pipe is not None}
+    if engine is not None:
+        status = "healthy"
+    else:
+        status = "failed" if load_profile.error else "loading"
+    return {
+        "status": status,
+        "model_loaded": engine is not None,
+        "model_load": load_profile.snapshot(),
+        "queue_depth": scheduler.queue_depth if scheduler else 0,
+        "tools_mode": TOOLS_MODE,
+    }
+
+
+@app.get("/sessions/stats")
+async def sessions_stats():
+    if session_store is None:
+        return {"enabled": False}
+    return {"enabled": True, **session_store.stats()}
+
+
+@app.get("/sessions/{session_id}")
+async def session_info(session_id: str):
+    summary = session_store.describe(session_id) if session_store is not None else None
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    return summary
+
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str):
+    """Descarta el historial y la caché KV de una conversación (p. ej. al limpiar el chat)"""
+    if session_store is None or not session_store.drop(session_id):
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    return {"session_id": session_id, "deleted": True}
+
+
+@app.get("/images/stats")
+async def image_stats():
+    return image_preprocessor.stats()
+
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    if scheduler is None:
+        raise HTTPException(status_code=503, detail="Modelo aún cargando")
+    return {**scheduler.stats(), "engine": engine.stats()}
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    if answer_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **answer_cache.stats()}
+
+
+@app.get("/cache/images/stats")
+async def image_cache_stats():
+    if image_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **image_cache.stats()}
+
+
+@app.get("/tools/stats")
+async def tools_stats():
+    return tool_client.stats()
+
+
+@app.get("/router/stats")
+async def router_stats():
+    if intent_router is None:
+        return {"enabled": False}
+    return {"enabled": True, **intent_router.stats()}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,373 @@
+#app/batch_eval.py
+"""Inferencia por lotes y evaluación, sin servidor, sobre datasets de preguntas.
+
+Usa el mismo prompt de sistema, parámetros de generación y lectura de llamadas a herramienta que
+/ask, pero llama al InferenceEngine directamente con lotes grandes ordenados por longitud. Escribe
+una línea JSONL por pregunta y configuración (respuesta, herramienta, latencia) y un resumen con la
+precisión de las llamadas a herramienta de cada configuración. Los JSONL hacen de checkpoint: al
+repetir el comando se saltan las preguntas ya respondidas.
+
+Uso (desde app/):
+    python batch_eval.py preguntas.csv functioncalling.csv --output-dir eval
+    python batch_eval.py functioncalling.jsonl --temperature 0,0.7 --max-tokens 128,256 --quantization int8,none
+"""
+import argparse
+import ast
+import gc
+import itertools
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import torch
+
+from answer_cache import normalize_question
+from inference import CPU_QUANTIZATION, MODEL_PATH, InferenceEngine, peak_rss_mb
+from intent_router import FUNCTION_NAME, MONTHS, NO_TOOL, first_value, read_rows
+from observability import get_logger
+from prompts import EMPTY_ANSWERS, GENERATION_PARAMS, SYSTEM_PROMPT, build_messages, extract_response_content
+from scheduler import InferenceRequest
+from tool_calls import TOOL_SCHEMAS, parse_argumentos, parse_tool_call
+
+
+QUESTION_COLUMNS = ("query", "question", "pregunta", "preguntas", "Query")
+# Sin esta columna se espera que la pregunta se responda sin herramientas (p. ej. preguntas.csv)
+FUNCTION_COLUMNS = ("function", "tool", "Function", "label")
+ID_COLUMNS = ("id", "ID")
+
+DEFAULT_OUTPUT_DIR = "batch_eval"
+# Preguntas que se leen y ordenan por longitud a la vez; el archivo nunca se carga completo
+DEFAULT_CHUNK_SIZE = 1024
+DEFAULT_BATCH_SIZE = 16
+
+logger = get_logger("batch_eval")
+
+
+@dataclass
+class EvalItem:
+    id: str
+    question: str
+    expected_tool: str
+    expected_argumentos: Optional[Dict[str, Any]] = None
+
+
+@dataclass(frozen=True)
+class Setting:
+    """Una combinación de parámetros a evaluar; cada una escribe su propio JSONL"""
+    quantization: str
+    temperature: float
+    max_tokens: int
+
+    @property
+    def name(self) -> str:
+        return f"q-{self.quantization}_t-{self.temperature:g}_max-{self.max_tokens}"
+
+    def generation_kwargs(self) -> Dict[str, Any]:
+        params = dict(GENERATION_PARAMS["text"])
+        if self.temperature <= 0:
+            # Temperatura 0: decodificación sin muestreo, reproducible entre corridas
+            params.pop("temperature")
+            params.pop("top_p")
+            return {**params, "do_sample": False}
+        return {**params, "temperature": self.temperature}
+
+
+def parse_expected(function: Optional[str]) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Herramienta y argumentos esperados de la columna function: "{'name': ..., 'arguments': '{...}'}" o solo el nombre"""
+    if not function:
+        return NO_TOOL, None
+    value: Any = function
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            value = parse(function)
+            break
+        except (ValueError, SyntaxError):
+            continue
+
+    if isinstance(value, dict):
+        tool = value.get("name") or value.get("tool")
+        argumentos = value.get("arguments", value.get("argumentos"))
+        if isinstance(argumentos, str):
+            try:
+                argumentos = json.loads(argumentos)
+            except ValueError:
+                argumentos = parse_argumentos(argumentos)
+        return str(tool or NO_TOOL), argumentos if isinstance(argumentos, dict) else None
+
+    name = FUNCTION_NAME.search(function)
+    return (name.group(1) if name else function.strip()), None
+
+
+def read_items(paths: Sequence[str]) -> Iterator[EvalItem]:
+    """Recorre los CSV/JSONL en orden, una fila a la vez"""
+    for path in paths:
+        source = os.path.basename(path)
+        for index, row in enumerate(read_rows(path)):
+            question = first_value(row, QUESTION_COLUMNS)
+            if not question:
+                continue
+            expected_tool, expected_argumentos = parse_expected(first_value(row, FUNCTION_COLUMNS))
+            yield EvalItem(
+                id=first_value(row, ID_COLUMNS) or f"{source}:{index}",
+                question=question,
+                expected_tool=expected_tool,
+                expected_argumentos=expected_argumentos,
+            )
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """Ids ya respondidos; una última línea a medio escribir (corte abrupto) se descarta del archivo"""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    valid = 0
+    with open(path, "rb+") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                break
+            valid += len(line)
+        f.truncate(valid)
+    return done
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def length_sorted_batches(engine: InferenceEngine, items: List[EvalItem], batch_size: int) -> Iterator[List[Tuple[EvalItem, int]]]:
+    """Lotes de preguntas de longitud parecida (menos relleno), las más largas primero para fallar pronto si no caben"""
+    lengths = [len(ids) for ids in engine.processor.tokenizer([item.question for item in items], add_special_tokens=False)["input_ids"]]
+    ordered = sorted(zip(items, lengths), key=lambda pair: pair[1], reverse=True)
+    return chunked(ordered, batch_size)
+
+
+def normalize_argument(value: Any) -> Optional[str]:
+    """'Enero' -> '1', '2024.0' -> '2024', texto sin tildes ni mayúsculas"""
+    if value is None:
+        return None
+    text = str(value).strip()
+    try:
+        number = float(text)
+        return str(int(number)) if number.is_integer() else str(number)
+    except ValueError:
+        pass
+    text = normalize_question(text)
+    return str(MONTHS.get(text, text))
+
+
+def arguments_match(tool: str, argumentos: Optional[Dict[str, Any]], expected: Optional[Dict[str, Any]]) -> Optional[bool]:
+    """Compara solo los argumentos que la herramienta servida acepta; None si el dataset no los trae"""
+    if not expected:
+        return None
+    keys = [key for key, _ in TOOL_SCHEMAS[tool]] if tool in TOOL_SCHEMAS else list(expected)
+    keys = [key for key in keys if key in expected]
+    if not keys:
+        return None
+    argumentos = argumentos or {}
+    return all(normalize_argument(argumentos.get(key)) == normalize_argument(expected[key]) for key in keys)
+
+
+def answer_batch(engine: InferenceEngine, setting: Setting, batch: List[Tuple[EvalItem, int]]) -> List[Dict[str, Any]]:
+    requests = [
+        InferenceRequest(modality="text", messages=build_messages(item.question, False), max_tokens=setting.max_tokens)
+        for item, _ in batch
+    ]
+    started = time.monotonic()
+    raw_answers = engine.generate_batch(requests, prefix="text", **setting.generation_kwargs())
+    # Todas las respuestas del lote salen juntas: la latencia de cada pregunta es la del lote
+    latency = time.monotonic() - started
+    answer_tokens = engine.processor.tokenizer(raw_answers, add_special_tokens=False)["input_ids"]
+
+    records = []
+    for (item, prompt_tokens), raw_answer, tokens in zip(batch, raw_answers, answer_tokens):
+        tool, argumentos = parse_tool_call(raw_answer)
+        predicted = tool or NO_TOOL
+        tool_correct = predicted == item.expected_tool
+        records.append({
+            "id": item.id,
+            "question": item.question,
+            "setting": setting.name,
+            "raw_answer": raw_answer,
+            "answer": None if tool else extract_response_content(raw_answer or EMPTY_ANSWERS["text"]),
+            "tool": tool,
+            "argumentos": argumentos,
+            "expected_tool": item.expected_tool,
+            "expected_argumentos": item.expected_argumentos,
+            "tool_correct": tool_correct,
+            "arguments_correct": arguments_match(predicted, argumentos, item.expected_argumentos) if tool and tool_correct else None,
+            "latency_s": round(latency, 4),
+            "batch_size": len(batch),
+            "prompt_tokens": prompt_tokens,
+            "answer_tokens": len(tokens),
+        })
+    return records
+
+
+def run_setting(
+    engine: InferenceEngine,
+    setting: Setting,
+    items: Callable[[], Iterable[EvalItem]],
+    output_path: str,
+    chunk_size: int,
+    batch_size: int
+) -> int:
+    """Responde las preguntas que faltan en output_path; cada lote queda en disco antes de empezar el siguiente"""
+    done = load_checkpoint(output_path)
+    if done:
+        logger.info("Reanudando", extra={"setting": setting.name, "done": len(done)})
+    answered = 0
+    pending = (item for item in items() if item.id not in done)
+    with open(output_path, "a", encoding="utf-8") as out:
+        for chunk in chunked(pending, chunk_size):
+            for batch in length_sorted_batches(engine, chunk, batch_size):
+                records = answer_batch(engine, setting, batch)
+                out.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                out.flush()
+                os.fsync(out.fileno())
+                answered += len(records)
+            logger.info("Progreso", extra={"setting": setting.name, "answered": answered, "done": len(done) + answered})
+    return answered
+
+
+def percentile(ordered: Sequence[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def ratio(hits: int, total: int) -> Optional[float]:
+    return round(hits / total, 4) if total else None
+
+
+def summarize(output_path: str) -> Dict[str, Any]:
+    """Métricas de una configuración a partir de su JSONL completo, incluidas las preguntas de corridas anteriores"""
+    count = tool_hits = argument_total = argument_hits = false_calls = missed_calls = tokens = 0
+    batch_seconds = 0.0
+    latencies: List[float] = []
+    by_tool: Dict[str, Dict[str, int]] = {}
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            count += 1
+            tool_hits += record["tool_correct"]
+            if record["arguments_correct"] is not None:
+                argument_total += 1
+                argument_hits += record["arguments_correct"]
+            expected, predicted = record["expected_tool"], record["tool"] or NO_TOOL
+            false_calls += expected == NO_TOOL and predicted != NO_TOOL
+            missed_calls += expected != NO_TOOL and predicted == NO_TOOL
+            per_tool = by_tool.setdefault(expected, {"count": 0, "correct": 0})
+            per_tool["count"] += 1
+            per_tool["correct"] += record["tool_correct"]
+            latencies.append(record["latency_s"])
+            batch_seconds += record["latency_s"] / record["batch_size"]
+            tokens += record["answer_tokens"]
+
+    latencies.sort()
+    return {
+        "questions": count,
+        "tool_accuracy": ratio(tool_hits, count),
+        "arguments_accuracy": ratio(argument_hits, argument_total),
+        "false_tool_calls": false_calls,
+        "missed_tool_calls": missed_calls,
+        "by_expected_tool": {
+            tool: {**counts, "accuracy": ratio(counts["correct"], counts["count"])}
+            for tool, counts in sorted(by_tool.items())
+        },
+        "latency_s": {"p50": percentile(latencies, 0.50), "p95": percentile(latencies, 0.95)},
+        "questions_per_second": round(count / batch_seconds, 2) if batch_seconds else None,
+        "tokens_per_second": round(tokens / batch_seconds, 2) if batch_seconds else None,
+    }
+
+
+def format_table(settings: Dict[str, Dict[str, Any]]) -> str:
+    def cell(value: Any) -> str:
+        return "-" if value is None else str(value)
+
+    rows = [("configuración", "preguntas", "herramienta", "argumentos", "p50 s", "p95 s", "preg/s", "tok/s")]
+    for name, summary in settings.items():
+        rows.append((
+            name, summary["questions"], summary["tool_accuracy"], summary["arguments_accuracy"],
+            summary["latency_s"]["p50"], summary["latency_s"]["p95"],
+            summary["questions_per_second"], summary["tokens_per_second"],
+        ))
+    widths = [max(len(cell(row[i])) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(cell(value).ljust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+def parse_list(cast: Callable[[str], Any]) -> Callable[[str], List[Any]]:
+    def parse(value: str) -> List[Any]:
+        return [cast(part) for part in value.split(",") if part.strip()]
+    return parse
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Inferencia por lotes y evaluación de CaficulBot sobre datasets de preguntas")
+    parser.add_argument("inputs", nargs="+", help="CSV o JSONL con columna pregunta/query y opcionalmente function/tool")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Un JSONL por configuración más summary.json; también es el checkpoint")
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    parser.add_argument("--temperature", type=parse_list(float), default=[GENERATION_PARAMS["text"]["temperature"]], help="p. ej. 0,0.7 (0 = sin muestreo)")
+    parser.add_argument("--max-tokens", type=parse_list(int), default=[256])
+    parser.add_argument("--quantization", type=parse_list(str), default=[CPU_QUANTIZATION], help="int8,none; solo aplica en CPU")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Preguntas ordenadas por longitud a la vez")
+    parser.add_argument("--limit", type=int, help="Solo las primeras N preguntas")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = build_parser().parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    def items() -> Iterable[EvalItem]:
+        return itertools.islice(read_items(args.inputs), args.limit)
+
+    settings = [
+        Setting(quantization, temperature, max_tokens)
+        for quantization in args.quantization
+        for temperature in args.temperature
+        for max_tokens in args.max_tokens
+    ]
+    report: Dict[str, Any] = {"inputs": args.inputs, "settings": {}}
+    # El modelo se carga una vez por cuantización; temperatura y max_tokens son solo parámetros de generación
+    for quantization, group in itertools.groupby(settings, key=lambda setting: setting.quantization):
+        engine = InferenceEngine(args.model_path, quantization=quantization)
+        engine.build_prefix_cache("text", SYSTEM_PROMPT)
+        for setting in group:
+            output_path = os.path.join(args.output_dir, f"{setting.name}.jsonl")
+            started = time.monotonic()
+            answered = run_setting(engine, setting, items, output_path, args.chunk_size, args.batch_size)
+            report["settings"][setting.name] = {
+                "quantization": setting.quantization,
+                "temperature": setting.temperature,
+                "max_tokens": setting.max_tokens,
+                "device": engine.device,
+                "quantized_layers": engine.quantized_layers,
+                "answered_this_run": answered,
+                "wall_s": round(time.monotonic() - started, 2),
+                **summarize(output_path),
+            }
+        report["peak_rss_mb"] = peak_rss_mb()
+        del engine
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    with open(os.path.join(args.output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(format_table(report["settings"]))
+
+
+if __name__ == "__main__":
+    main()
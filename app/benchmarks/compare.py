@@ -0,0 +1,73 @@
+#app/benchmarks/compare.py
+"""Compara dos reportes de benchmarks.run y falla si alguna latencia o el rendimiento empeoran.
+
+Uso (desde app/):
+    python -m benchmarks.compare base.json nuevo.json --threshold 0.10
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, Iterator, List, Tuple
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def metrics(report: Dict[str, Any]) -> Iterator[Tuple[str, float, bool]]:
+    """(nombre, valor, mayor_es_mejor) para cada métrica comparable del reporte"""
+    for result in report["results"]:
+        rows = result["rows"]
+        for query, summary in result["ledgers"].items():
+            for key in LATENCY_KEYS:
+                if summary.get(key) is not None:
+                    yield f"rows={rows} ledger {query} {key}", summary[key], False
+        for run in result["runs"]:
+            prefix = f"rows={rows} c={run['concurrency']}"
+            if run.get("throughput_rps") is not None:
+                yield f"{prefix} throughput_rps", run["throughput_rps"], True
+            for workload, summary in run["workloads"].items():
+                for key in LATENCY_KEYS:
+                    if summary.get(key) is not None:
+                        yield f"{prefix} {workload} {key}", summary[key], False
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    base_metrics = {name: value for name, value, _ in metrics(base)}
+    rows = []
+    for name, value, higher_is_better in metrics(new):
+        before = base_metrics.get(name)
+        if not before:
+            continue
+        change = (value - before) / before
+        regressed = -change > threshold if higher_is_better else change > threshold
+        rows.append({"metric": name, "base": before, "new": value, "change": change, "regressed": regressed})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara dos reportes de benchmark")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Empeoramiento relativo tolerado (0.10 = 10%%)")
+    parser.add_argument("--all", action="store_true", help="Mostrar también las métricas sin regresión")
+    args = parser.parse_args()
+
+    base, new = load(args.base), load(args.new)
+    rows = compare(base, new, args.threshold)
+    print(f"Base {base.get('revision')} -> nuevo {new.get('revision')}, umbral {args.threshold:.0%}")
+    for row in rows:
+        if args.all or row["regressed"]:
+            mark = "REGRESIÓN" if row["regressed"] else "ok"
+            print(f"{mark:>9}  {row['metric']}: {row['base']} -> {row['new']} ({row['change']:+.1%})")
+
+    regressions = sum(1 for row in rows if row["regressed"])
+    print(f"{len(rows)} métricas comparadas, {regressions} regresiones")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+#app/benchmarks/run.py
+"""Benchmark de carga de toda la pila, sin modelo ni red.
+
+Levanta la API real con un StubEngine (tokens/s y costo de imagen configurables), los cuatro
+servicios de registros reales sobre SQLite sembrado, y mide latencias y rendimiento con una mezcla
+de preguntas de texto, imagen y herramientas a concurrencia controlada. Resultado en JSON.
+
+Uso (desde app/):
+    python -m benchmarks.run --rows 10000 --concurrency 1,4,16 --requests 200 --output bench.json
+    python -m benchmarks.run --rows 10000,1000000 --tools-mode http
+"""
+import argparse
+import asyncio
+import functools
+import importlib
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "caficulbot-bench")
+
+WORKLOADS = ("text", "image", "tool")
+
+TEXT_QUESTIONS = (
+    "¿Cómo controlo la roya en mi cafetal?",
+    "¿Cada cuánto debo fertilizar un lote de variedad Castillo?",
+    "¿Qué hago contra la broca del café?",
+    "¿Cuál es la mejor época para sembrar café?",
+    "¿Cómo sé si el grano está listo para cosechar?",
+    "¿Qué sombra necesita el café joven?",
+)
+IMAGE_QUESTIONS = (
+    "¿Qué enfermedad tiene esta hoja?",
+    "¿Esta planta tiene deficiencia de nutrientes?",
+    "¿Estos granos tienen broca?",
+)
+# Preguntas de datos: las resuelve el router de intenciones con una sola llamada al servicio
+TOOL_QUESTIONS = (
+    "¿Cuánto fertilizante tenemos?",
+    "¿Cuánto gastamos en enero 2024?",
+    "¿Cuántos sacos quedan?",
+    "¿Cuánto gastamos en marzo de 2023?",
+    "¿Qué cantidad de abono hay?",
+)
+
+LEDGER_QUERIES = {
+    "inventario": (
+        ("/inventarioconsultar/", {"producto": "fertilizantes"}),
+        ("/inventarioconsultar/buscar/", {"producto": "abono organico"}),
+        ("/inventarioconsultar/productos/", {}),
+    ),
+    "gastos": (
+        ("/gastosconsultar/", {"año": 2024, "mes": 1}),
+        ("/gastosconsultar/", {"año": 2023, "categoria": "transporte"}),
+        ("/gastosconsultar/mensual/", {"año": 2022}),
+    ),
+    "cosecha": (
+        ("/cosechaconsultar/", {"año": 2024, "mes": 3}),
+        ("/cosechaconsultar/mensual/", {"año": 2021}),
+    ),
+    "ingresos": (
+        ("/ingresosconsultar/", {"año": 2024, "mes": 6}),
+        ("/ingresosconsultar/mensual/", {"año": 2020}),
+    ),
+}
+
+SERVICE_URL_ENV = {
+    "inventario": "INVENTORY_API_BASE_URL",
+    "gastos": "EXPENSES_API_BASE_URL",
+    "cosecha": "PRODUCTION_API_BASE_URL",
+    "ingresos": "INCOME_API_BASE_URL",
+}
+
+
+def parse_list(value: str, cast=int) -> List[Any]:
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """'text=0.5,image=0.2,tool=0.3' -> pesos por tipo de solicitud"""
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        if name.strip() not in WORKLOADS:
+            raise argparse.ArgumentTypeError(f"Tipo de solicitud desconocido: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(ordered: Sequence[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies_s: List[float], errors: int) -> Dict[str, Any]:
+    ordered = sorted(latency * 1000.0 for latency in latencies_s)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "mean_ms": round(sum(ordered) / len(ordered), 2) if ordered else None,
+        "p50_ms": round(percentile(ordered, 0.50), 2) if ordered else None,
+        "p95_ms": round(percentile(ordered, 0.95), 2) if ordered else None,
+        "p99_ms": round(percentile(ordered, 0.99), 2) if ordered else None,
+        "max_ms": round(ordered[-1], 2) if ordered else None,
+    }
+
+
+def memory_mb() -> Dict[str, Optional[float]]:
+    peak = current = None
+    try:
+        import resource
+        peak = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:
+        pass
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as statm:
+            current = round(int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    return {"rss_mb": current, "peak_rss_mb": peak}
+
+
+def git_revision() -> Optional[str]:
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout
+        return f"{revision}-dirty" if dirty.strip() else revision
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def synthetic_photo(width: int = 1600, height: int = 1200) -> bytes:
+    """JPEG con ruido y degradados: se decodifica y reduce como una foto real, sin depender de archivos"""
+    from PIL import Image
+
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 48)
+    photo = Image.merge("RGB", (noise, gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    photo.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread:
+    """Una app ASGI servida por uvicorn en un hilo, en un puerto libre"""
+
+    def __init__(self, app):
+        import uvicorn
+
+        self.port = free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout_s: float = 30.0) -> "ServerThread":
+        self.thread.start()
+        deadline = time.monotonic() + timeout_s
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError(f"El servidor en el puerto {self.port} no arrancó")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+async def wait_until_ready(client, api_url: str, timeout_s: float = 60.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        health = (await client.get(f"{api_url}/health")).json()
+        if health["status"] == "healthy":
+            return
+        if health["status"] == "failed":
+            raise RuntimeError(f"La API no cargó el motor: {health['model_load']['error']}")
+        await asyncio.sleep(0.1)
+    raise RuntimeError("La API no quedó lista a tiempo")
+
+
+async def drive(
+    requests_: List[Any],
+    concurrency: int,
+    send,
+) -> Dict[str, Any]:
+    """Lazo cerrado: `concurrency` clientes toman la siguiente solicitud apenas terminan la anterior.
+
+    send(kind, payload, client) recibe el número de cliente, para que la API aplique sus límites por cliente.
+    """
+    pending = iter(requests_)
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+
+    async def client_loop(client: int):
+        for kind, payload in pending:
+            latencies.setdefault(kind, [])
+            errors.setdefault(kind, 0)
+            started = time.perf_counter()
+            try:
+                ok = await send(kind, payload, client)
+            except Exception:
+                ok = False
+            if ok:
+                latencies[kind].append(time.perf_counter() - started)
+            else:
+                errors[kind] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(client) for client in range(max(1, concurrency))))
+    duration = time.perf_counter() - started
+
+    completed = sum(len(values) for values in latencies.values())
+    return {
+        "concurrency": concurrency,
+        "requests": len(requests_),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(completed / duration, 2) if duration else None,
+        "errors": sum(errors.values()),
+        "workloads": {kind: summarize(latencies[kind], errors[kind]) for kind in sorted(latencies)},
+        "all": summarize([value for values in latencies.values() for value in values], sum(errors.values())),
+    }
+
+
+async def bench_ledgers(client, service_urls: Dict[str, str], requests_per_query: int, concurrency: int) -> Dict[str, Any]:
+    """Consultas directas a los servicios: aíslan el costo de la base de datos del de la API"""
+    results = {}
+    for service, queries in LEDGER_QUERIES.items():
+        for path, params in queries:
+            async def send(kind, payload, client_number, url=f"{service_urls[service]}{path}", params=params):
+                response = await client.get(url, params=params)
+                return response.status_code == 200
+
+            plan = [(path, None)] * requests_per_query
+            name = f"{service} {path}" + (f" {','.join(params)}" if params else "")
+            results[name] = (await drive(plan, concurrency, send))["all"]
+    return results
+
+
+async def bench_api(client, api_url: str, args, photo: bytes) -> List[Dict[str, Any]]:
+    rng = random.Random(args.seed)
+    kinds = list(args.mix)
+    plan_kinds = rng.choices(kinds, weights=[args.mix[kind] for kind in kinds], k=args.requests)
+    questions = {"text": TEXT_QUESTIONS, "image": IMAGE_QUESTIONS, "tool": TOOL_QUESTIONS}
+    plan = [(kind, questions[kind][i % len(questions[kind])]) for i, kind in enumerate(plan_kinds)]
+
+    async def send(kind, question, client_number):
+        # Sin caché de respuestas: se mide el camino del modelo, no la memoria de preguntas repetidas
+        data = {"question": question, "max_tokens": args.max_tokens, "no_cache": "true"}
+        files = {"image": ("hoja.jpg", photo, "image/jpeg")} if kind == "image" else None
+        headers = {"X-Client-Id": f"bench-{client_number}"}
+        response = await client.post(f"{api_url}/ask", data=data, files=files, headers=headers)
+        return response.status_code == 200
+
+    runs = []
+    for concurrency in args.concurrency:
+        result = await drive(plan, concurrency, send)
+        scheduler = (await client.get(f"{api_url}/scheduler/stats")).json()
+        result["scheduler"] = {key: scheduler[key] for key in ("batches_run", "requests_served")}
+        result["engine"] = scheduler["engine"]
+        result["admission"] = (await client.get(f"{api_url}/admission/stats")).json()
+        result["memory"] = memory_mb()
+        runs.append(result)
+        print(
+            f"concurrencia {concurrency}: {result['throughput_rps']} req/s, "
+            f"p95 {result['all']['p95_ms']} ms, errores {result['errors']}",
+            file=sys.stderr
+        )
+    return runs
+
+
+def run_size(args, rows: int) -> Dict[str, Any]:
+    """Mide un tamaño de tabla en este proceso; los servicios leen su URL de base al importarse"""
+    from benchmarks.seed import configure_databases, seed_databases
+    from benchmarks.stub_engine import StubEngine
+
+    os.environ["TOOLS_MODE"] = args.tools_mode
+    os.environ["MODEL_PATH"] = args.data_dir
+    os.environ["MODEL_WARMUP"] = "0"
+    os.environ["TRANSCRIPTION_ENABLED"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    configure_databases(args.data_dir, rows)
+
+    print(f"Sembrando {rows} filas por servicio en {args.data_dir}...", file=sys.stderr)
+    seeding = seed_databases(rows, args.seed)
+
+    servers: List[ServerThread] = []
+    service_urls: Dict[str, str] = {}
+    if args.tools_mode == "http":
+        for service, env_name in SERVICE_URL_ENV.items():
+            server = ServerThread(importlib.import_module(f"databases.{service}.main").app).start()
+            servers.append(server)
+            service_urls[service] = server.url
+            os.environ[env_name] = server.url
+
+    import api
+    api.InferenceEngine = functools.partial(
+        StubEngine,
+        tokens_per_second=args.tokens_per_second,
+        prefill_tokens_per_second=args.prefill_tokens_per_second,
+        image_encode_ms=args.image_encode_ms,
+        answer_tokens=args.answer_tokens,
+    )
+    api_server = ServerThread(api.app).start()
+    servers.append(api_server)
+    if args.tools_mode == "inprocess":
+        # Los servicios quedan montados en la API bajo /<servicio>
+        service_urls = {service: f"{api_server.url}/{service}" for service in LEDGER_QUERIES}
+
+    async def measure():
+        import httpx
+
+        limits = httpx.Limits(max_connections=max(args.concurrency) + 8)
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            await wait_until_ready(client, api_server.url)
+            ledgers = await bench_ledgers(client, service_urls, args.ledger_requests, args.ledger_concurrency)
+            runs = await bench_api(client, api_server.url, args, synthetic_photo())
+            return ledgers, runs
+
+    try:
+        ledgers, runs = asyncio.run(measure())
+    finally:
+        for server in reversed(servers):
+            server.stop()
+
+    return {"rows": rows, "seeding": seeding, "ledgers": ledgers, "runs": runs, "memory": memory_mb()}
+
+
+def run_sizes_in_subprocesses(args) -> List[Dict[str, Any]]:
+    """Cada tamaño en su propio proceso: los engines de los servicios quedan fijados al importarse"""
+    results = []
+    for rows in args.rows:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as output:
+            path = output.name
+        command = [sys.executable, "-m", "benchmarks.run", *args.argv_without_rows, "--rows", str(rows), "--output", path]
+        subprocess.run(command, check=True)
+        with open(path, encoding="utf-8") as handle:
+            results.extend(json.load(handle)["results"])
+        os.unlink(path)
+    return results
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark de latencia y rendimiento de CaficulBot sin modelo")
+    parser.add_argument("--rows", type=parse_list, default=[10000], help="Filas por servicio, p. ej. 10000,1000000")
+    parser.add_argument("--concurrency", type=parse_list, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200, help="Solicitudes a /ask por nivel de concurrencia")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("text=0.5,image=0.2,tool=0.3"))
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=20.0)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--image-encode-ms", type=float, default=150.0)
+    parser.add_argument("--answer-tokens", type=int, default=48)
+    parser.add_argument("--ledger-requests", type=int, default=200, help="Solicitudes por consulta directa a los servicios")
+    parser.add_argument("--ledger-concurrency", type=int, default=8)
+    parser.add_argument("--tools-mode", choices=("inprocess", "http"), default="inprocess")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Bases sembradas; se reutilizan entre corridas")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="Archivo JSON de salida; por defecto stdout")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser().parse_args(argv)
+
+    if len(args.rows) > 1:
+        # Se reenvían los demás argumentos tal cual a cada subproceso
+        args.argv_without_rows = [
+            arg for i, arg in enumerate(argv)
+            if arg != "--rows" and (i == 0 or argv[i - 1] != "--rows") and not arg.startswith("--rows=")
+            and arg != "--output" and (i == 0 or argv[i - 1] != "--output") and not arg.startswith("--output=")
+        ]
+        results = run_sizes_in_subprocesses(args)
+    else:
+        results = [run_size(args, args.rows[0])]
+
+    report = {
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "argv_without_rows", "data_dir", "rows")
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#app/benchmarks/seed.py
+import importlib
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+SEED_BATCH_ROWS = 10000
+
+SERVICES = ("inventario", "gastos", "cosecha", "ingresos")
+YEARS = range(2018, 2026)
+EXPENSE_CATEGORIES = ("fertilizantes", "mano de obra", "transporte", "herramientas", "combustible", "servicios")
+# Nombres como los escriben los usuarios: plurales, mayúsculas y variantes del mismo producto
+PRODUCTS = (
+    "fertilizante", "Fertilizantes", "fertilizante NPK", "semillas", "Semilla castillo", "pesticidas",
+    "abono", "abono orgánico", "combustible", "sacos", "cajas", "herbicidas", "fungicidas", "cal",
+    "azufre", "alambre", "postes", "mangueras", "aspersores", "guantes", "botas",
+)
+# Productos adicionales para que el índice tenga un tamaño realista
+EXTRA_PRODUCTS = 2000
+
+
+def database_path(data_dir: str, service: str, rows: int) -> str:
+    return os.path.join(data_dir, f"{service}-{rows}.db")
+
+
+def configure_databases(data_dir: str, rows: int):
+    """Apunta cada servicio a su SQLite de benchmark; debe llamarse antes de importar los servicios"""
+    os.makedirs(data_dir, exist_ok=True)
+    for service in SERVICES:
+        os.environ[f"DATABASE_URL_{service.upper()}"] = f"sqlite:///{database_path(data_dir, service, rows)}"
+
+
+def expense_row(rng: random.Random, i: int) -> Dict[str, Any]:
+    return {
+        "año": rng.choice(YEARS),
+        "mes": rng.randint(1, 12),
+        "categoria": rng.choice(EXPENSE_CATEGORIES),
+        "monto": round(rng.uniform(10000, 2000000), 2),
+    }
+
+
+def income_row(rng: random.Random, i: int) -> Dict[str, Any]:
+    return {"año": rng.choice(YEARS), "mes": rng.randint(1, 12), "monto": round(rng.uniform(50000, 5000000), 2)}
+
+
+def harvest_row(rng: random.Random, i: int) -> Dict[str, Any]:
+    return {"año": rng.choice(YEARS), "mes": rng.randint(1, 12), "cantidad": rng.randint(10, 800)}
+
+
+def inventory_row(rng: random.Random, i: int) -> Dict[str, Any]:
+    if rng.random() < 0.5:
+        product = rng.choice(PRODUCTS)
+    else:
+        product = f"insumo {rng.randrange(EXTRA_PRODUCTS)}"
+    # Más entradas que salidas para que las existencias queden positivas
+    return {"producto": product, "cantidad": rng.randint(-20, 50)}
+
+
+ROW_FACTORIES: Dict[str, Callable[[random.Random, int], Dict[str, Any]]] = {
+    "inventario": inventory_row,
+    "gastos": expense_row,
+    "cosecha": harvest_row,
+    "ingresos": income_row,
+}
+
+BASE_MODELS = {"inventario": "Inventario", "gastos": "Gasto", "cosecha": "Cosecha", "ingresos": "Ingreso"}
+
+
+def seed_service(service: str, rows: int, seed: int = 0) -> Dict[str, Any]:
+    """Llena la tabla del servicio hasta `rows` filas con ingresar_lote (incluye resúmenes e índice); reutiliza lo ya sembrado"""
+    database = importlib.import_module(f"databases.{service}.database")
+    model = getattr(database, BASE_MODELS[service])
+
+    db = database.SessionLocal()
+    try:
+        existing = db.query(model).count()
+    finally:
+        db.close()
+    if existing >= rows:
+        return {"rows": existing, "inserted": 0, "seconds": 0.0}
+
+    rng = random.Random(f"{seed}-{service}")
+    make_row = ROW_FACTORIES[service]
+    started = time.perf_counter()
+    inserted = 0
+    while existing + inserted < rows:
+        size = min(SEED_BATCH_ROWS, rows - existing - inserted)
+        batch: List[Dict[str, Any]] = [make_row(rng, existing + inserted + i) for i in range(size)]
+        database.ingresar_lote(batch)
+        inserted += size
+    seconds = time.perf_counter() - started
+    return {
+        "rows": existing + inserted,
+        "inserted": inserted,
+        "seconds": round(seconds, 2),
+        "rows_per_second": round(inserted / seconds, 1) if seconds else None,
+    }
+
+
+def seed_databases(rows: int, seed: int = 0) -> Dict[str, Dict[str, Any]]:
+    return {service: seed_service(service, rows, seed) for service in SERVICES}
@@ -0,0 +1,165 @@
+#app/benchmarks/stub_engine.py
+import queue
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# Aproximación de tokens para el costo de prefill: ~4 caracteres por token en español
+CHARS_PER_TOKEN = 4
+
+TEXT_ANSWER = (
+    "La roya del café se controla con variedades resistentes, buena nutrición, "
+    "regulación de sombra y aplicaciones de fungicida en las épocas de mayor riesgo. "
+)
+IMAGE_ANSWER = "En la hoja se observan manchas amarillas con polvillo naranja en el envés, típicas de la roya. "
+TOOL_ANSWERS = {
+    "inventario": '{"tool": "inventario_consulta", "argumentos": "producto=fertilizante"}',
+    "gastos": '{"tool": "gastos_consulta", "argumentos": "mes=1,año=2024"}',
+}
+
+
+def prompt_text(request: Any) -> str:
+    parts = []
+    for message in request.messages:
+        for item in message["content"]:
+            if item.get("type") == "text":
+                parts.append(item["text"])
+    return " ".join(parts)
+
+
+def question_text(request: Any) -> str:
+    """Solo el último mensaje del usuario: el prompt de sistema menciona gastos e inventario"""
+    return " ".join(item["text"] for item in request.messages[-1]["content"] if item.get("type") == "text")
+
+
+def answer_for(request: Any, tokens: int) -> List[str]:
+    """Respuesta de `tokens` piezas; las preguntas de datos que no atrapa el router devuelven una llamada a herramienta"""
+    question = question_text(request).lower()
+    if request.image is None:
+        if re.search(r"\bgast", question):
+            return [TOOL_ANSWERS["gastos"]]
+        # "¿Cada cuánto debo fertilizar?" es una pregunta de texto: hace falta un verbo de existencias
+        if re.search(r"\b(?:tenemos|quedan?|hay)\b", question):
+            return [TOOL_ANSWERS["inventario"]]
+    words = (IMAGE_ANSWER if request.image is not None else TEXT_ANSWER).split()
+    return [words[i % len(words)] + " " for i in range(tokens)]
+
+
+class StubStreamer:
+    """Iterador de piezas de texto con la misma interfaz que TextIteratorStreamer"""
+
+    def __init__(self, deadline: Optional[float] = None):
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self.deadline = deadline
+
+    def put(self, text: str):
+        self._queue.put(text)
+
+    def end(self):
+        self._queue.put(None)
+
+    def __iter__(self):
+        while True:
+            timeout = None if self.deadline is None else max(self.deadline - time.monotonic(), 0.0)
+            text = self._queue.get(timeout=timeout)
+            if text is None:
+                return
+            yield text
+
+
+class StubEngine:
+    """Sustituto de InferenceEngine para benchmarks: no carga el modelo y simula sus tiempos con sleep.
+
+    Prefill a prefill_tokens_per_second, costo fijo por imagen y decodificación a tokens_per_second
+    (un lote decodifica sus filas en paralelo, como en la GPU).
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        tokens_per_second: float = 20.0,
+        prefill_tokens_per_second: float = 2000.0,
+        image_encode_ms: float = 150.0,
+        answer_tokens: int = 48,
+        profile: Any = None,
+        **kwargs
+    ):
+        self.model_path = model_path
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.image_encode_s = image_encode_ms / 1000.0
+        self.answer_tokens = answer_tokens
+        self.device = "stub"
+        self.generated_tokens = 0
+        self.generation_seconds = 0.0
+        self.batches = 0
+        self.max_batch = 0
+
+    def build_prefix_cache(self, name: str, system_prompt: str):
+        pass
+
+    def warmup(self, runs: List[Tuple[List[Any], Dict[str, Any]]]):
+        pass
+
+    def _prefill(self, batch: List[Any]):
+        tokens = sum(len(prompt_text(request)) // CHARS_PER_TOKEN for request in batch)
+        time.sleep(tokens / self.prefill_tokens_per_second)
+        time.sleep(self.image_encode_s * sum(1 for request in batch if request.image is not None))
+
+    def _record(self, batch: List[Any], tokens: int, started: float):
+        self.generated_tokens += tokens
+        self.generation_seconds += time.perf_counter() - started
+        self.batches += 1
+        self.max_batch = max(self.max_batch, len(batch))
+
+    def generate_batch(self, batch: List[Any], prefix: Optional[str] = None, **generation_kwargs) -> List[str]:
+        started = time.perf_counter()
+        self._prefill(batch)
+        answers = [answer_for(request, min(request.max_tokens, self.answer_tokens)) for request in batch]
+        steps = max(len(answer) for answer in answers)
+        for _ in range(steps):
+            if all(request.cancel_event.is_set() for request in batch):
+                break
+            time.sleep(1.0 / self.tokens_per_second)
+        self._record(batch, sum(len(answer) for answer in answers), started)
+        return ["".join(answer).strip() for answer in answers]
+
+    def generate_session(self, session: Any, request: Any, **generation_kwargs) -> str:
+        return self.generate_batch([request])[0]
+
+    def prepare_stream(
+        self,
+        request: Any,
+        prefix: Optional[str] = None,
+        session: Any = None,
+        deadline: Optional[float] = None,
+        **generation_kwargs
+    ) -> Tuple[StubStreamer, Callable[[], None]]:
+        streamer = StubStreamer(deadline)
+
+        def job():
+            started = time.perf_counter()
+            try:
+                self._prefill([request])
+                answer = answer_for(request, min(request.max_tokens, self.answer_tokens))
+                for piece in answer:
+                    if request.cancel_event.is_set():
+                        break
+                    time.sleep(1.0 / self.tokens_per_second)
+                    streamer.put(piece)
+                self._record([request], len(answer), started)
+            finally:
+                streamer.end()
+
+        return streamer, job
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "device": self.device,
+            "tokens_per_second_target": self.tokens_per_second,
+            "generated_tokens": self.generated_tokens,
+            "tokens_per_second": round(self.generated_tokens / self.generation_seconds, 2) if self.generation_seconds else None,
+            "batches": self.batches,
+            "max_batch": self.max_batch,
+        }
@@ -0,0 +1,86 @@
+#app/chat_history.py
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+# Historial completo de las conversaciones de la UI; en memoria solo quedan los últimos mensajes
+CHAT_HISTORY_DB = os.getenv(
+    "CHAT_HISTORY_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_history.db")
+)
+# Conversaciones sin mensajes nuevos durante este tiempo se borran del disco
+CHAT_HISTORY_TTL_S = float(os.getenv("CHAT_HISTORY_TTL_S", str(7 * 24 * 3600)))
+CHAT_RECENT_MESSAGES = int(os.getenv("CHAT_RECENT_MESSAGES", "20"))
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "20"))
+
+
+class ChatHistory:
+    """Mensajes de cada conversación en SQLite, leídos por páginas; compartido por todas las sesiones de Streamlit"""
+
+    def __init__(self, db_path: str = CHAT_HISTORY_DB, ttl_s: float = CHAT_HISTORY_TTL_S):
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS mensajes ("
+            "sesion TEXT NOT NULL, orden INTEGER NOT NULL, rol TEXT NOT NULL, tipo TEXT, "
+            "contenido TEXT, pregunta TEXT, miniatura BLOB, creado REAL NOT NULL, "
+            "PRIMARY KEY (sesion, orden))"
+        )
+        self._db.commit()
+        self.prune()
+
+    def append(self, session_id: str, message: Dict[str, Any]) -> int:
+        """Guarda un mensaje al final de la conversación y devuelve su número de orden"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COALESCE(MAX(orden), -1) + 1 FROM mensajes WHERE sesion = ?", (session_id,)
+            ).fetchone()
+            seq = row[0]
+            self._db.execute(
+                "INSERT INTO mensajes (sesion, orden, rol, tipo, contenido, pregunta, miniatura, creado) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    session_id, seq, message["role"], message.get("type"), message.get("content"),
+                    message.get("question"), message.get("thumbnail"), time.time()
+                )
+            )
+            self._db.commit()
+        return seq
+
+    def count(self, session_id: str) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM mensajes WHERE sesion = ?", (session_id,)).fetchone()[0]
+
+    def page(self, session_id: str, before: Optional[int] = None, limit: int = CHAT_PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Los `limit` mensajes anteriores a `before` (o los últimos), en orden cronológico"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT orden, rol, tipo, contenido, pregunta, miniatura FROM mensajes "
+                "WHERE sesion = ? AND orden < ? ORDER BY orden DESC LIMIT ?",
+                (session_id, before if before is not None else 2 ** 62, limit)
+            ).fetchall()
+        return [
+            {"seq": seq, "role": role, "type": kind, "content": content, "question": question, "thumbnail": thumbnail}
+            for seq, role, kind, content, question, thumbnail in reversed(rows)
+        ]
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM mensajes WHERE sesion = ?", (session_id,))
+            self._db.commit()
+
+    def prune(self) -> int:
+        """Borra las conversaciones vencidas; devuelve cuántos mensajes se eliminaron"""
+        if self.ttl_s <= 0:
+            return 0
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM mensajes WHERE sesion IN "
+                "(SELECT sesion FROM mensajes GROUP BY sesion HAVING MAX(creado) < ?)",
+                (time.time() - self.ttl_s,)
+            )
+            self._db.commit()
+            return cursor.rowcount
@@ -1,25 +1,108 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float
+from collections import defaultdict
+from sqlalchemy import Column, Integer, String, Float, Index, func, select, insert, delete, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./cosechas.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+from ..metricas import instrumentar_sesiones
+from ..motor import crear_motor, url_servicio
+
+SQLALCHEMY_DATABASE_URL = url_servicio("cosecha", "cosechas.db")
+engine = crear_motor(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrumentar_sesiones(SessionLocal, "cosecha")
 Base = declarative_base()
 
 class Cosecha(Base):
     __tablename__ = "cosechas"
+    __table_args__ = (
+        Index("ix_cosechas_anio_mes", "año", "mes"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     año = Column(Integer, nullable=False)
     mes = Column(Integer, nullable=False)
     cantidad = Column(Integer, nullable=False)
 
+class CosechaMensual(Base):
+    """Total de las cosechas por (año, mes), mantenido al ingresar cada cosecha"""
+    __tablename__ = "cosechas_mensuales"
+    
+    año = Column(Integer, primary_key=True)
+    mes = Column(Integer, primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+
 Base.metadata.create_all(bind=engine)
 
+# Bases creadas antes de existir la columna cantidad
+if "cantidad" not in {columna["name"] for columna in inspect(engine).get_columns("cosechas")}:
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE cosechas ADD COLUMN cantidad INTEGER NOT NULL DEFAULT 0"))
+
+# create_all no agrega índices a tablas que ya existen
+for index in Cosecha.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+def acumular_cosecha(db, año: int, mes: int, cantidad: int):
+    """Suma la cantidad al resumen mensual dentro de la transacción de la sesión"""
+    dialecto = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    tabla = CosechaMensual.__table__
+    stmt = dialecto.insert(tabla).values(año=año, mes=mes, total=cantidad)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tabla.c.año, tabla.c.mes],
+        set_={"total": tabla.c.total + stmt.excluded.total}
+    )
+    db.execute(stmt)
+
+def reconstruir_resumen(db):
+    """Recalcula el resumen mensual completo a partir de las cosechas"""
+    db.execute(delete(CosechaMensual))
+    db.execute(
+        insert(CosechaMensual).from_select(
+            ["año", "mes", "total"],
+            select(Cosecha.año, Cosecha.mes, func.sum(Cosecha.cantidad))
+            .group_by(Cosecha.año, Cosecha.mes)
+        )
+    )
+    db.commit()
+
+def inicializar_resumen():
+    """Construye el resumen si la base ya tenía registros de antes de existir la tabla"""
+    db = SessionLocal()
+    try:
+        if db.query(CosechaMensual).first() is None and db.query(Cosecha).first() is not None:
+            reconstruir_resumen(db)
+    finally:
+        db.close()
+
+inicializar_resumen()
+
+def ingresar_lote(filas):
+    """Inserta un lote de cosechas y actualiza el resumen mensual en una sola transacción"""
+    db = SessionLocal()
+    try:
+        db.execute(insert(Cosecha), filas)
+        totales = defaultdict(int)
+        for fila in filas:
+            totales[(fila["año"], fila["mes"])] += fila["cantidad"]
+        for (año, mes), cantidad in totales.items():
+            acumular_cosecha(db, año, mes, cantidad)
+        db.commit()
+    finally:
+        db.close()
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+if __name__ == "__main__":
+    # python -m databases.cosecha.database (desde app/): reconstruye el resumen mensual desde las cosechas
+    db = SessionLocal()
+    try:
+        reconstruir_resumen(db)
+        print(f"Resumen reconstruido: {db.query(CosechaMensual).count()} filas")
+    finally:
+        db.close()
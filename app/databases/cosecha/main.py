@@ -1,9 +1,17 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
 
-from database import get_db, Cosecha
+from observability import configure_logging
+
+# Antes de importar la base: el motor registra su URL al crearse
+configure_logging()
+
+from .database import get_db, Cosecha, CosechaMensual, acumular_cosecha, reconstruir_resumen, ingresar_lote
+from ..ingesta import ingestar
+from ..metricas import respuesta_metricas
 
 class CosechaCreate(BaseModel):
     año: int
@@ -16,6 +24,7 @@ def ingresar_cosecha(cosecha: CosechaCreate, db: Session = Depends(get_db)):
     """Ingresar un cosecha"""
     db_cosecha = Cosecha(**cosecha.dict())
     db.add(db_cosecha)
+    acumular_cosecha(db, cosecha.año, cosecha.mes, cosecha.cantidad)
     db.commit()
     return {"ok": "cosecha ingresado"}
 
@@ -26,12 +35,40 @@ def obtener_cosecha(
     db: Session = Depends(get_db)
 ):
     """Obtener cosecha"""
-    query = db.query(Cosecha.monto)
+    query = db.query(func.coalesce(func.sum(CosechaMensual.total), 0))
     
     if año:
-        query = query.filter(Cosecha.año == año)
+        query = query.filter(CosechaMensual.año == año)
     if mes:
-        query = query.filter(Cosecha.mes == mes)
+        query = query.filter(CosechaMensual.mes == mes)
     
-    montos = [monto[0] for monto in query.all()]
-    return sum(montos)
\ No newline at end of file
+    return query.scalar()
+
+@app.get("/cosechaconsultar/mensual/")
+def obtener_cosecha_mensual(
+    año: int,
+    db: Session = Depends(get_db)
+):
+    """Obtener la cosecha de un año mes a mes en una sola consulta"""
+    totales = dict(
+        db.query(CosechaMensual.mes, CosechaMensual.total)
+        .filter(CosechaMensual.año == año)
+        .all()
+    )
+    return [{"mes": mes, "total": totales.get(mes, 0)} for mes in range(1, 13)]
+
+@app.post("/cosecharesumen/reconstruir/")
+def reconstruir_cosecha(db: Session = Depends(get_db)):
+    """Recalcular el resumen mensual desde las cosechas registradas"""
+    reconstruir_resumen(db)
+    return {"ok": "resumen reconstruido"}
+
+@app.post("/cosechaingresar/lote/")
+async def ingresar_cosecha_lote(request: Request, formato: Optional[str] = None):
+    """Ingresar muchos cosechas desde un CSV o NDJSON, con reporte de errores por fila"""
+    return await ingestar(request, formato, CosechaCreate, ingresar_lote)
+
+@app.get("/metrics", include_in_schema=False)
+def metricas():
+    """Métricas en formato de texto de Prometheus (tiempos de consulta a la base de datos)"""
+    return respuesta_metricas()
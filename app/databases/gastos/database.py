@@ -1,14 +1,24 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float
+from collections import defaultdict
+from sqlalchemy import Column, Integer, String, Float, Index, func, select, insert, delete
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./gastos.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+from ..metricas import instrumentar_sesiones
+from ..motor import crear_motor, url_servicio
+
+SQLALCHEMY_DATABASE_URL = url_servicio("gastos", "gastos.db")
+engine = crear_motor(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrumentar_sesiones(SessionLocal, "gastos")
 Base = declarative_base()
 
 class Gasto(Base):
     __tablename__ = "gastos"
+    __table_args__ = (
+        Index("ix_gastos_anio_mes", "año", "mes"),
+        Index("ix_gastos_categoria", "categoria"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     año = Column(Integer, nullable=False)
@@ -16,11 +26,83 @@ class Gasto(Base):
     categoria = Column(String, nullable=True)
     monto = Column(Float, nullable=False)
 
+class GastoMensual(Base):
+    """Total de gastos por (año, mes, categoria), mantenido al ingresar cada gasto"""
+    __tablename__ = "gastos_mensuales"
+    
+    año = Column(Integer, primary_key=True)
+    mes = Column(Integer, primary_key=True)
+    # Los gastos sin categoría se acumulan bajo ""
+    categoria = Column(String, primary_key=True, default="")
+    total = Column(Float, nullable=False, default=0)
+
 Base.metadata.create_all(bind=engine)
 
+# create_all no agrega índices a tablas que ya existen
+for index in Gasto.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+def acumular_gasto(db, año: int, mes: int, categoria, monto: float):
+    """Suma el monto al resumen mensual dentro de la transacción de la sesión"""
+    dialecto = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    tabla = GastoMensual.__table__
+    stmt = dialecto.insert(tabla).values(año=año, mes=mes, categoria=categoria or "", total=monto)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tabla.c.año, tabla.c.mes, tabla.c.categoria],
+        set_={"total": tabla.c.total + stmt.excluded.total}
+    )
+    db.execute(stmt)
+
+def reconstruir_resumen(db):
+    """Recalcula el resumen mensual completo a partir de los gastos"""
+    categoria = func.coalesce(Gasto.categoria, "")
+    db.execute(delete(GastoMensual))
+    db.execute(
+        insert(GastoMensual).from_select(
+            ["año", "mes", "categoria", "total"],
+            select(Gasto.año, Gasto.mes, categoria, func.sum(Gasto.monto))
+            .group_by(Gasto.año, Gasto.mes, categoria)
+        )
+    )
+    db.commit()
+
+def inicializar_resumen():
+    """Construye el resumen si la base ya tenía gastos de antes de existir la tabla"""
+    db = SessionLocal()
+    try:
+        if db.query(GastoMensual).first() is None and db.query(Gasto).first() is not None:
+            reconstruir_resumen(db)
+    finally:
+        db.close()
+
+inicializar_resumen()
+
+def ingresar_lote(filas):
+    """Inserta un lote de gastos y actualiza el resumen mensual en una sola transacción"""
+    db = SessionLocal()
+    try:
+        db.execute(insert(Gasto), filas)
+        totales = defaultdict(float)
+        for fila in filas:
+            totales[(fila["año"], fila["mes"], fila.get("categoria") or "")] += fila["monto"]
+        for (año, mes, categoria), monto in totales.items():
+            acumular_gasto(db, año, mes, categoria, monto)
+        db.commit()
+    finally:
+        db.close()
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+if __name__ == "__main__":
+    # python -m databases.gastos.database (desde app/): reconstruye el resumen mensual desde los gastos
+    db = SessionLocal()
+    try:
+        reconstruir_resumen(db)
+        print(f"Resumen reconstruido: {db.query(GastoMensual).count()} filas")
+    finally:
+        db.close()
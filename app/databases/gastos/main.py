@@ -1,9 +1,17 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
 
-from database import get_db, Gasto
+from observability import configure_logging
+
+# Antes de importar la base: el motor registra su URL al crearse
+configure_logging()
+
+from .database import get_db, Gasto, GastoMensual, acumular_gasto, reconstruir_resumen, ingresar_lote
+from ..ingesta import ingestar
+from ..metricas import respuesta_metricas
 
 # Modelo para crear gasto
 class GastoCreate(BaseModel):
@@ -20,6 +28,7 @@ def ingresar_gasto(gasto: GastoCreate, db: Session = Depends(get_db)):
     """Ingresar un gasto"""
     db_gasto = Gasto(**gasto.dict())
     db.add(db_gasto)
+    acumular_gasto(db, gasto.año, gasto.mes, gasto.categoria, gasto.monto)
     db.commit()
     return {"ok": "gasto ingresado"}
 
@@ -31,14 +40,44 @@ def obtener_gastos(
     db: Session = Depends(get_db)
 ):
     """Obtener gastos"""
-    query = db.query(Gasto.monto)
+    query = db.query(func.coalesce(func.sum(GastoMensual.total), 0))
     
     if año:
-        query = query.filter(Gasto.año == año)
+        query = query.filter(GastoMensual.año == año)
     if mes:
-        query = query.filter(Gasto.mes == mes)
+        query = query.filter(GastoMensual.mes == mes)
+    if categoria:
+        query = query.filter(GastoMensual.categoria.ilike(f"%{categoria}%"))
+    
+    return query.scalar()
+
+@app.get("/gastosconsultar/mensual/")
+def obtener_gastos_mensuales(
+    año: int,
+    categoria: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Obtener los gastos de un año mes a mes en una sola consulta"""
+    query = db.query(GastoMensual.mes, func.sum(GastoMensual.total)).filter(GastoMensual.año == año)
+    
     if categoria:
-        query = query.filter(Gasto.categoria.ilike(f"%{categoria}%"))
+        query = query.filter(GastoMensual.categoria.ilike(f"%{categoria}%"))
     
-    montos = [monto[0] for monto in query.all()]
-    return sum(montos)
\ No newline at end of file
+    totales = dict(query.group_by(GastoMensual.mes).all())
+    return [{"mes": mes, "total": totales.get(mes, 0)} for mes in range(1, 13)]
+
+@app.post("/gastosresumen/reconstruir/")
+def reconstruir_gastos(db: Session = Depends(get_db)):
+    """Recalcular el resumen mensual desde los gastos registrados"""
+    reconstruir_resumen(db)
+    return {"ok": "resumen reconstruido"}
+
+@app.post("/gastosingresar/lote/")
+async def ingresar_gastos_lote(request: Request, formato: Optional[str] = None):
+    """Ingresar muchos gastos desde un CSV o NDJSON, con reporte de errores por fila"""
+    return await ingestar(request, formato, GastoCreate, ingresar_lote)
+
+@app.get("/metrics", include_in_schema=False)
+def metricas():
+    """Métricas en formato de texto de Prometheus (tiempos de consulta a la base de datos)"""
+    return respuesta_metricas()
@@ -0,0 +1,181 @@
+#app/databases/ingesta.py
+import asyncio
+import codecs
+import csv
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from observability import get_logger
+
+
+LOTE_INGESTA = int(os.getenv("LOTE_INGESTA", "5000"))
+# Evita respuestas gigantes si todo el archivo viene mal
+MAX_ERRORES_REPORTADOS = int(os.getenv("MAX_ERRORES_REPORTADOS", "1000"))
+
+FORMATOS = ("csv", "ndjson")
+
+logger = get_logger("ingesta")
+
+
+def detectar_formato(request: Request, formato: Optional[str]) -> str:
+    """Usa ?formato= o el Content-Type para decidir entre CSV y NDJSON"""
+    if formato:
+        formato = formato.lower()
+        if formato not in FORMATOS:
+            raise HTTPException(status_code=415, detail=f"Formato no soportado: {formato}")
+        return formato
+
+    content_type = request.headers.get("content-type", "").lower()
+    if "csv" in content_type:
+        return "csv"
+    if "ndjson" in content_type or "jsonl" in content_type or "json-lines" in content_type:
+        return "ndjson"
+    raise HTTPException(status_code=415, detail="Use Content-Type text/csv o application/x-ndjson, o ?formato=csv|ndjson")
+
+
+async def leer_lineas(request: Request) -> AsyncIterator[str]:
+    """Entrega el cuerpo línea por línea a medida que llega, sin cargarlo completo en memoria"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    resto = ""
+    async for chunk in request.stream():
+        resto += decoder.decode(chunk)
+        *lineas, resto = resto.split("\n")
+        for linea in lineas:
+            yield linea.rstrip("\r")
+    resto += decoder.decode(b"", final=True)
+    if resto:
+        yield resto.rstrip("\r")
+
+
+async def leer_filas(request: Request, formato: str) -> AsyncIterator[Tuple[int, Any]]:
+    """Convierte el cuerpo en (número de fila, dict); las filas ilegibles llegan como excepción"""
+    numero = 0
+
+    if formato == "ndjson":
+        async for linea in leer_lineas(request):
+            if not linea.strip():
+                continue
+            numero += 1
+            try:
+                yield numero, json.loads(linea)
+            except json.JSONDecodeError as e:
+                yield numero, e
+        return
+
+    encabezado: Optional[List[str]] = None
+    pendiente = ""
+    async for linea in leer_lineas(request):
+        # Un campo entre comillas puede contener saltos de línea
+        pendiente = f"{pendiente}\n{linea}" if pendiente else linea
+        if pendiente.count('"') % 2:
+            continue
+        registro, pendiente = pendiente, ""
+        if not registro.strip():
+            continue
+
+        valores = next(csv.reader([registro]))
+        if encabezado is None:
+            encabezado = [valor.strip() for valor in valores]
+            continue
+
+        numero += 1
+        if len(valores) != len(encabezado):
+            yield numero, ValueError(f"se esperaban {len(encabezado)} columnas y llegaron {len(valores)}")
+            continue
+        # En CSV una celda vacía equivale a un campo ausente
+        yield numero, {campo: valor for campo, valor in zip(encabezado, valores) if valor != ""}
+
+    if pendiente:
+        numero += 1
+        yield numero, ValueError("comillas sin cerrar al final del archivo")
+
+
+def describir_error(error: Exception) -> List[Dict[str, str]]:
+    if isinstance(error, ValidationError):
+        return [
+            {"campo": ".".join(str(parte) for parte in detalle["loc"]), "mensaje": detalle["msg"]}
+            for detalle in error.errors()
+        ]
+    return [{"campo": "", "mensaje": str(error)}]
+
+
+async def ingestar(
+    request: Request,
+    formato: Optional[str],
+    modelo: type,
+    guardar_lote: Callable[[List[Dict[str, Any]]], None],
+    tamaño_lote: int = LOTE_INGESTA,
+) -> Dict[str, Any]:
+    """Valida cada fila con el modelo Pydantic e inserta en lotes; mientras un lote se guarda se lee el siguiente"""
+    formato = detectar_formato(request, formato)
+    inicio = time.monotonic()
+
+    insertadas = 0
+    rechazadas = 0
+    errores: List[Dict[str, Any]] = []
+    lote: List[Dict[str, Any]] = []
+    guardando: Optional[asyncio.Future] = None
+
+    async def esperar_guardado():
+        nonlocal insertadas, guardando
+        if guardando is not None:
+            insertadas += await guardando
+            guardando = None
+
+    async def enviar(filas: List[Dict[str, Any]]):
+        nonlocal guardando
+        await esperar_guardado()
+        guardando = asyncio.ensure_future(run_in_threadpool(_guardar, guardar_lote, filas))
+
+    try:
+        async for numero, fila in leer_filas(request, formato):
+            try:
+                if isinstance(fila, Exception):
+                    raise fila
+                if not isinstance(fila, dict):
+                    raise ValueError("cada fila debe ser un objeto")
+                lote.append(modelo(**fila).dict())
+            except (ValidationError, ValueError, TypeError) as e:
+                rechazadas += 1
+                if len(errores) < MAX_ERRORES_REPORTADOS:
+                    errores.append({"fila": numero, "errores": describir_error(e)})
+                continue
+
+            if len(lote) >= tamaño_lote:
+                await enviar(lote)
+                lote = []
+
+        if lote:
+            await enviar(lote)
+        await esperar_guardado()
+    finally:
+        if guardando is not None:
+            # Si el cliente cortó el envío, el lote en curso igual termina su transacción
+            await asyncio.wait([guardando])
+
+    segundos = time.monotonic() - inicio
+    logger.info("Ingesta", extra={
+        "modelo": modelo.__name__,
+        "insertadas": insertadas,
+        "rechazadas": rechazadas,
+        "segundos": round(segundos, 3),
+    })
+    return {
+        "insertadas": insertadas,
+        "rechazadas": rechazadas,
+        "errores": errores,
+        "errores_truncados": rechazadas > len(errores),
+        "segundos": round(segundos, 3),
+        "filas_por_segundo": round((insertadas + rechazadas) / segundos) if segundos > 0 else None,
+    }
+
+
+def _guardar(guardar_lote: Callable[[List[Dict[str, Any]]], None], filas: List[Dict[str, Any]]) -> int:
+    guardar_lote(filas)
+    return len(filas)
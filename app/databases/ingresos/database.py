@@ -1,25 +1,103 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float
+from collections import defaultdict
+from sqlalchemy import Column, Integer, String, Float, Index, func, select, insert, delete
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./ingresos.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+from ..metricas import instrumentar_sesiones
+from ..motor import crear_motor, url_servicio
+
+SQLALCHEMY_DATABASE_URL = url_servicio("ingresos", "ingresos.db")
+engine = crear_motor(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrumentar_sesiones(SessionLocal, "ingresos")
 Base = declarative_base()
 
 class Ingreso(Base):
     __tablename__ = "ingresos"
+    __table_args__ = (
+        Index("ix_ingresos_anio_mes", "año", "mes"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     año = Column(Integer, nullable=False)
     mes = Column(Integer, nullable=False)
     monto = Column(Float, nullable=False)
 
+class IngresoMensual(Base):
+    """Total de los ingresos por (año, mes), mantenido al ingresar cada ingreso"""
+    __tablename__ = "ingresos_mensuales"
+    
+    año = Column(Integer, primary_key=True)
+    mes = Column(Integer, primary_key=True)
+    total = Column(Float, nullable=False, default=0)
+
 Base.metadata.create_all(bind=engine)
 
+# create_all no agrega índices a tablas que ya existen
+for index in Ingreso.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+def acumular_ingreso(db, año: int, mes: int, monto: float):
+    """Suma el monto al resumen mensual dentro de la transacción de la sesión"""
+    dialecto = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    tabla = IngresoMensual.__table__
+    stmt = dialecto.insert(tabla).values(año=año, mes=mes, total=monto)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tabla.c.año, tabla.c.mes],
+        set_={"total": tabla.c.total + stmt.excluded.total}
+    )
+    db.execute(stmt)
+
+def reconstruir_resumen(db):
+    """Recalcula el resumen mensual completo a partir de los ingresos"""
+    db.execute(delete(IngresoMensual))
+    db.execute(
+        insert(IngresoMensual).from_select(
+            ["año", "mes", "total"],
+            select(Ingreso.año, Ingreso.mes, func.sum(Ingreso.monto))
+            .group_by(Ingreso.año, Ingreso.mes)
+        )
+    )
+    db.commit()
+
+def inicializar_resumen():
+    """Construye el resumen si la base ya tenía registros de antes de existir la tabla"""
+    db = SessionLocal()
+    try:
+        if db.query(IngresoMensual).first() is None and db.query(Ingreso).first() is not None:
+            reconstruir_resumen(db)
+    finally:
+        db.close()
+
+inicializar_resumen()
+
+def ingresar_lote(filas):
+    """Inserta un lote de ingresos y actualiza el resumen mensual en una sola transacción"""
+    db = SessionLocal()
+    try:
+        db.execute(insert(Ingreso), filas)
+        totales = defaultdict(float)
+        for fila in filas:
+            totales[(fila["año"], fila["mes"])] += fila["monto"]
+        for (año, mes), monto in totales.items():
+            acumular_ingreso(db, año, mes, monto)
+        db.commit()
+    finally:
+        db.close()
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+if __name__ == "__main__":
+    # python -m databases.ingresos.database (desde app/): reconstruye el resumen mensual desde los ingresos
+    db = SessionLocal()
+    try:
+        reconstruir_resumen(db)
+        print(f"Resumen reconstruido: {db.query(IngresoMensual).count()} filas")
+    finally:
+        db.close()
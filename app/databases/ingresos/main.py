@@ -1,9 +1,17 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
 
-from database import get_db, Ingreso
+from observability import configure_logging
+
+# Antes de importar la base: el motor registra su URL al crearse
+configure_logging()
+
+from .database import get_db, Ingreso, IngresoMensual, acumular_ingreso, reconstruir_resumen, ingresar_lote
+from ..ingesta import ingestar
+from ..metricas import respuesta_metricas
 
 class IngresoCreate(BaseModel):
     año: int
@@ -17,6 +25,7 @@ def ingresar_ingreso(ingreso: IngresoCreate, db: Session = Depends(get_db)):
     """Ingresar un ingreso"""
     db_ingreso = Ingreso(**ingreso.dict())
     db.add(db_ingreso)
+    acumular_ingreso(db, ingreso.año, ingreso.mes, ingreso.monto)
     db.commit()
     return {"ok": "ingreso ingresado"}
 
@@ -27,12 +36,40 @@ def obtener_ingresos(
     db: Session = Depends(get_db)
 ):
     """Obtener ingresos"""
-    query = db.query(Ingreso.monto)
+    query = db.query(func.coalesce(func.sum(IngresoMensual.total), 0))
     
     if año:
-        query = query.filter(Ingreso.año == año)
+        query = query.filter(IngresoMensual.año == año)
     if mes:
-        query = query.filter(Ingreso.mes == mes)
+        query = query.filter(IngresoMensual.mes == mes)
     
-    montos = [monto[0] for monto in query.all()]
-    return sum(montos)
\ No newline at end of file
+    return query.scalar()
+
+@app.get("/ingresosconsultar/mensual/")
+def obtener_ingresos_mensual(
+    año: int,
+    db: Session = Depends(get_db)
+):
+    """Obtener los ingresos de un año mes a mes en una sola consulta"""
+    totales = dict(
+        db.query(IngresoMensual.mes, IngresoMensual.total)
+        .filter(IngresoMensual.año == año)
+        .all()
+    )
+    return [{"mes": mes, "total": totales.get(mes, 0)} for mes in range(1, 13)]
+
+@app.post("/ingresosresumen/reconstruir/")
+def reconstruir_ingresos(db: Session = Depends(get_db)):
+    """Recalcular el resumen mensual desde los ingresos registrados"""
+    reconstruir_resumen(db)
+    return {"ok": "resumen reconstruido"}
+
+@app.post("/ingresosingresar/lote/")
+async def ingresar_ingresos_lote(request: Request, formato: Optional[str] = None):
+    """Ingresar muchos ingresos desde un CSV o NDJSON, con reporte de errores por fila"""
+    return await ingestar(request, formato, IngresoCreate, ingresar_lote)
+
+@app.get("/metrics", include_in_schema=False)
+def metricas():
+    """Métricas en formato de texto de Prometheus (tiempos de consulta a la base de datos)"""
+    return respuesta_metricas()
@@ -1,20 +1,122 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float
+from collections import defaultdict
+from sqlalchemy import Column, Integer, String, Float, Index, func, insert, delete
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./inventario.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+from ..metricas import instrumentar_sesiones
+from ..motor import crear_motor, url_servicio
+from .indice import IndiceProductos, normalizar_producto
+
+SQLALCHEMY_DATABASE_URL = url_servicio("inventario", "inventario.db")
+engine = crear_motor(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrumentar_sesiones(SessionLocal, "inventario")
 Base = declarative_base()
 
 class Inventario(Base):
     __tablename__ = "inventario"
+    __table_args__ = (
+        Index("ix_inventario_producto", "producto"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     producto = Column(String, nullable=False)
     cantidad = Column(Integer, nullable=False)
+
+class InventarioStock(Base):
+    """Existencias actuales por producto normalizado, mantenidas al ingresar cada movimiento"""
+    __tablename__ = "inventario_stock"
+    
+    clave = Column(String, primary_key=True)
+    # Nombre tal como se ingresó la primera vez, para mostrarlo
+    producto = Column(String, nullable=False)
+    cantidad = Column(Integer, nullable=False, default=0)
+
 Base.metadata.create_all(bind=engine)
 
+# create_all no agrega índices a tablas que ya existen
+for index in Inventario.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+indice_productos = IndiceProductos()
+
+def acumular_stock(db, producto: str, cantidad: int) -> str:
+    """Suma la cantidad a las existencias del producto dentro de la transacción de la sesión"""
+    clave = normalizar_producto(producto)
+    dialecto = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    tabla = InventarioStock.__table__
+    stmt = dialecto.insert(tabla).values(clave=clave, producto=producto, cantidad=cantidad)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tabla.c.clave],
+        set_={"cantidad": tabla.c.cantidad + stmt.excluded.cantidad}
+    )
+    db.execute(stmt)
+    return clave
+
+def reconstruir_stock(db):
+    """Recalcula las existencias a partir de todos los movimientos de inventario"""
+    existencias = {}
+    filas = (
+        db.query(Inventario.producto, func.sum(Inventario.cantidad))
+        .group_by(Inventario.producto)
+        .order_by(Inventario.producto)
+        .all()
+    )
+    for producto, cantidad in filas:
+        clave = normalizar_producto(producto)
+        if clave in existencias:
+            existencias[clave]["cantidad"] += cantidad
+        else:
+            existencias[clave] = {"clave": clave, "producto": producto, "cantidad": cantidad}
+
+    db.execute(delete(InventarioStock))
+    if existencias:
+        db.execute(insert(InventarioStock), list(existencias.values()))
+    db.commit()
+    indice_productos.reemplazar(existencias)
+
+def inicializar_stock():
+    """Construye la tabla de existencias si hace falta y carga el índice de productos"""
+    db = SessionLocal()
+    try:
+        if db.query(InventarioStock).first() is None and db.query(Inventario).first() is not None:
+            reconstruir_stock(db)
+        indice_productos.cargar(clave for (clave,) in db.query(InventarioStock.clave))
+    finally:
+        db.close()
+
+inicializar_stock()
+
+def buscar_stock(db, producto: str):
+    """Resuelve el nombre con el índice y lee las existencias por clave primaria"""
+    coincidencia = indice_productos.buscar(producto)
+    if coincidencia is None:
+        return None
+    clave, similitud = coincidencia
+    stock = db.get(InventarioStock, clave)
+    if stock is None:
+        return None
+    return {"producto": stock.producto, "clave": clave, "cantidad": stock.cantidad, "similitud": round(similitud, 3)}
+
+def ingresar_lote(filas):
+    """Inserta un lote de registros de inventario y actualiza las existencias en una sola transacción"""
+    db = SessionLocal()
+    try:
+        db.execute(insert(Inventario), filas)
+        totales = defaultdict(int)
+        nombres = {}
+        for fila in filas:
+            clave = normalizar_producto(fila["producto"])
+            totales[clave] += fila["cantidad"]
+            nombres.setdefault(clave, fila["producto"])
+        for clave, cantidad in totales.items():
+            acumular_stock(db, nombres[clave], cantidad)
+        db.commit()
+    finally:
+        db.close()
+    indice_productos.cargar(totales)
+
 def get_db():
     db = SessionLocal()
     try:
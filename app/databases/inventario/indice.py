@@ -0,0 +1,115 @@
+#app/databases/inventario/indice.py
+import os
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+# Similitud mínima (Dice sobre trigramas) para aceptar una coincidencia aproximada
+INDICE_SIMILITUD_MINIMA = float(os.getenv("INDICE_SIMILITUD_MINIMA", "0.55"))
+
+
+def singular(palabra: str) -> str:
+    """Plural regular en español: 'semillas' -> 'semilla', 'aspersores' -> 'aspersor', 'cales' -> 'cal'"""
+    if len(palabra) <= 3 or not palabra.endswith("s"):
+        return palabra
+    if palabra.endswith("ces"):
+        return palabra[:-3] + "z"
+    if palabra.endswith("es") and palabra[-3] in "lrndj" and palabra[-4] in "aeiou":
+        return palabra[:-2]
+    return palabra[:-1]
+
+
+def normalizar_producto(nombre: str) -> str:
+    """Clave de búsqueda: sin tildes ni mayúsculas ni puntuación y con cada palabra en singular"""
+    texto = unicodedata.normalize("NFKD", nombre.casefold())
+    texto = "".join(char for char in texto if not unicodedata.combining(char))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(singular(palabra) for palabra in texto.split())
+
+
+def trigramas(clave: str) -> Set[str]:
+    texto = f"  {clave} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceProductos:
+    """Índice en memoria de claves de producto con búsqueda exacta, por palabras y aproximada por trigramas"""
+
+    def __init__(self):
+        self._claves: Set[str] = set()
+        self._por_trigrama: Dict[str, Set[str]] = defaultdict(set)
+        self._trigramas: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._claves)
+
+    def agregar(self, clave: str):
+        with self._lock:
+            if clave in self._claves:
+                return
+            self._claves.add(clave)
+            grams = trigramas(clave)
+            self._trigramas[clave] = grams
+            for gram in grams:
+                self._por_trigrama[gram].add(clave)
+
+    def cargar(self, claves: Iterable[str]):
+        for clave in claves:
+            self.agregar(clave)
+
+    def reemplazar(self, claves: Iterable[str]):
+        """Cambia todo el contenido de una vez: los productos que ya no existen dejan de resolverse"""
+        nuevas: Set[str] = set(claves)
+        por_trigrama: Dict[str, Set[str]] = defaultdict(set)
+        grams_por_clave = {clave: trigramas(clave) for clave in nuevas}
+        for clave, grams in grams_por_clave.items():
+            for gram in grams:
+                por_trigrama[gram].add(clave)
+        with self._lock:
+            self._claves = nuevas
+            self._por_trigrama = por_trigrama
+            self._trigramas = grams_por_clave
+
+    def buscar(self, producto: str) -> Optional[Tuple[str, float]]:
+        """Devuelve (clave, similitud) del producto más parecido, o None si ninguno se parece lo suficiente"""
+        consulta = normalizar_producto(producto)
+        if not consulta:
+            return None
+        if consulta in self._claves:
+            return consulta, 1.0
+
+        with self._lock:
+            # "abono npk" -> "abono": una clave cuyas palabras están todas en la consulta, o al revés
+            palabras = set(consulta.split())
+            por_palabras = [
+                clave for clave in self._claves
+                if set(clave.split()) <= palabras or palabras <= set(clave.split())
+            ]
+
+            grams = trigramas(consulta)
+            candidatos: Dict[str, int] = defaultdict(int)
+            for gram in grams:
+                for clave in self._por_trigrama.get(gram, ()):
+                    candidatos[clave] += 1
+
+            mejor: Optional[Tuple[bool, float, str]] = None
+            for clave, comunes in candidatos.items():
+                similitud = 2.0 * comunes / (len(grams) + len(self._trigramas[clave]))
+                # Las coincidencias por palabras completas ganan a las aproximadas
+                puntaje = (clave in por_palabras, similitud, clave)
+                if mejor is None or puntaje > mejor:
+                    mejor = puntaje
+
+        if mejor is None:
+            return None
+        completa, similitud, clave = mejor
+        if not completa and similitud < INDICE_SIMILITUD_MINIMA:
+            return None
+        return clave, similitud
+
+    def claves(self) -> List[str]:
+        return sorted(self._claves)
@@ -1,9 +1,20 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
 
-from database import get_db, Inventario
+from observability import configure_logging
+
+# Antes de importar la base: el motor registra su URL al crearse
+configure_logging()
+
+from .database import (
+    get_db, Inventario, InventarioStock, acumular_stock, buscar_stock,
+    indice_productos, ingresar_lote, reconstruir_stock
+)
+from ..ingesta import ingestar
+from ..metricas import respuesta_metricas
 
 class InventarioCreate(BaseModel):
     producto: str
@@ -15,7 +26,9 @@ def ingresar_inventario(inventario: InventarioCreate, db: Session = Depends(get_
     """Ingresar un inventario"""
     db_inventario = Inventario(**inventario.dict())
     db.add(db_inventario)
+    clave = acumular_stock(db, inventario.producto, inventario.cantidad)
     db.commit()
+    indice_productos.agregar(clave)
     return {"ok": "inventario ingresado"}
 
 @app.get("/inventarioconsultar/")
@@ -23,11 +36,43 @@ def obtener_inventario(
     producto: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """Obtener inventario"""
-    query = db.query(Inventario.cantidad)
-    
+    """Obtener inventario; el nombre se resuelve sin importar tildes, mayúsculas, plurales o errores de tipeo"""
     if producto:
-        query = query.filter(Inventario.producto == producto)
+        stock = buscar_stock(db, producto)
+        return stock["cantidad"] if stock else 0
     
-    cantidadtotal = [cantidad[0] for cantidad in query.all()]
-    return sum(cantidadtotal)
\ No newline at end of file
+    return db.query(func.coalesce(func.sum(InventarioStock.cantidad), 0)).scalar()
+
+@app.get("/inventarioconsultar/buscar/")
+def buscar_inventario(producto: str, db: Session = Depends(get_db)):
+    """Mostrar a qué producto registrado corresponde el nombre consultado y sus existencias"""
+    stock = buscar_stock(db, producto)
+    if stock is None:
+        return {"producto": None, "cantidad": 0}
+    return stock
+
+@app.get("/inventarioconsultar/productos/")
+def obtener_inventario_por_producto(db: Session = Depends(get_db)):
+    """Obtener la cantidad disponible de cada producto en una sola consulta"""
+    filas = (
+        db.query(InventarioStock.producto, InventarioStock.cantidad)
+        .order_by(InventarioStock.clave)
+        .all()
+    )
+    return [{"producto": producto, "cantidad": cantidad} for producto, cantidad in filas]
+
+@app.post("/inventarioresumen/reconstruir/")
+def reconstruir_inventario(db: Session = Depends(get_db)):
+    """Recalcular las existencias desde los movimientos registrados"""
+    reconstruir_stock(db)
+    return {"ok": "existencias reconstruidas"}
+
+@app.post("/inventarioingresar/lote/")
+async def ingresar_inventario_lote(request: Request, formato: Optional[str] = None):
+    """Ingresar muchos registros de inventario desde un CSV o NDJSON, con reporte de errores por fila"""
+    return await ingestar(request, formato, InventarioCreate, ingresar_lote)
+
+@app.get("/metrics", include_in_schema=False)
+def metricas():
+    """Métricas en formato de texto de Prometheus (tiempos de consulta a la base de datos)"""
+    return respuesta_metricas()
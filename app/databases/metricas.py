@@ -0,0 +1,43 @@
+#app/databases/metricas.py
+import time
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+from sqlalchemy import event
+
+
+# En modo inprocess los cuatro servicios comparten el registro de la API: una sola métrica con etiqueta de servicio
+DB_QUERY_SECONDS = Histogram(
+    "caficulbot_db_query_seconds",
+    "Tiempo de ejecución de las consultas de cada servicio de registros",
+    ["service", "operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+def operacion(estado) -> str:
+    if estado.is_select:
+        return "select"
+    if estado.is_insert:
+        return "insert"
+    if estado.is_update:
+        return "update"
+    if estado.is_delete:
+        return "delete"
+    return "other"
+
+
+def instrumentar_sesiones(session_factory, servicio: str):
+    """Mide cada sentencia que pasa por las sesiones del servicio (consultas ORM, inserts por lote y upserts)"""
+
+    @event.listens_for(session_factory, "do_orm_execute")
+    def medir(estado):
+        inicio = time.perf_counter()
+        try:
+            return estado.invoke_statement()
+        finally:
+            DB_QUERY_SECONDS.labels(servicio, operacion(estado)).observe(time.perf_counter() - inicio)
+
+
+def respuesta_metricas() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,85 @@
+#app/databases/motor.py
+import os
+import threading
+from typing import Dict
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+from observability import get_logger
+
+
+# Una sola URL para todos los servicios (p. ej. el Postgres de docker-compose);
+# DATABASE_URL_<SERVICIO> tiene prioridad y vacío = SQLite junto a cada servicio
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+# NORMAL es seguro con WAL: solo se pueden perder las últimas transacciones ante un corte de energía
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Negativo = KiB
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "30"))
+DB_POOL_RECYCLE_S = int(os.getenv("DB_POOL_RECYCLE_S", "1800"))
+
+_motores: Dict[str, Engine] = {}
+_lock = threading.Lock()
+
+logger = get_logger("motor")
+
+
+def url_servicio(servicio: str, archivo: str) -> str:
+    """URL de la base de un servicio: DATABASE_URL_<SERVICIO>, luego DATABASE_URL, luego SQLite en su carpeta"""
+    url = os.getenv(f"DATABASE_URL_{servicio.upper()}") or DATABASE_URL
+    if url:
+        # SQLAlchemy 2 ya no acepta el alias postgres://
+        if url.startswith("postgres://"):
+            url = "postgresql://" + url[len("postgres://"):]
+        return url
+    return f"sqlite:///{os.path.join(os.path.dirname(os.path.abspath(__file__)), servicio, archivo)}"
+
+
+def _configurar_sqlite(conexion, _registro):
+    cursor = conexion.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def crear_motor(url: str) -> Engine:
+    """Devuelve el engine de la URL; los servicios que corren en el mismo proceso con la misma URL lo comparten"""
+    with _lock:
+        motor = _motores.get(url)
+        if motor is not None:
+            return motor
+
+        if url.startswith("sqlite"):
+            motor = create_engine(
+                url,
+                connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000.0},
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT_S,
+            )
+            event.listen(motor, "connect", _configurar_sqlite)
+        else:
+            motor = create_engine(
+                url,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT_S,
+                pool_recycle=DB_POOL_RECYCLE_S,
+                pool_pre_ping=True,
+            )
+
+        logger.info("Motor de base de datos", extra={"url": motor.url.render_as_string(hide_password=True)})
+        _motores[url] = motor
+        return motor
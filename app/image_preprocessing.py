@@ -0,0 +1,186 @@
+#app/image_preprocessing.py
+import asyncio
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Tuple
+
+from fastapi import UploadFile
+from PIL import Image, UnidentifiedImageError
+
+from observability import IMAGE_STAGE_SECONDS
+from tool_client import LatencyHistogram
+
+
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(15 * 1024 * 1024)))
+# Se revisa con el encabezado, antes de decodificar (una foto de 12 MP son ~12 millones)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "50000000"))
+# Resolución nativa del codificador de visión de Gemma 3n; el processor igual reescala a esto
+IMAGE_TARGET_SIZE = int(os.getenv("IMAGE_TARGET_SIZE", "768"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_FORMATS = {"JPEG", "MPO", "PNG", "WEBP", "BMP", "GIF", "TIFF"}
+
+STAGES = ("read", "header", "decode", "resize", "orient", "hash", "total")
+
+# Etiqueta EXIF Orientation -> transformación que deja la foto derecha
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def difference_hash(image: Image.Image) -> int:
+    """dHash de 64 bits: compara el brillo de píxeles vecinos en una miniatura de 9x8; resiste recompresión y reescalado"""
+    pixels = image.convert("L").resize((9, 8), Image.Resampling.BOX).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] < pixels[row * 9 + col + 1])
+    return value
+
+
+class ImageRejected(Exception):
+    """La imagen no se procesa: muy grande, formato no soportado o archivo dañado"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class PreprocessedImage:
+    image: Image.Image
+    original_size: Tuple[int, int]
+    format: str
+    dhash: int = 0
+    timings_ms: Dict[str, float] = field(default_factory=dict)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "format": self.format,
+            "original_size": list(self.original_size),
+            "size": list(self.image.size),
+            "dhash": f"{self.dhash:016x}",
+            "timings_ms": {stage: round(ms, 2) for stage, ms in self.timings_ms.items()},
+        }
+
+
+class ImagePreprocessor:
+    """Valida, decodifica y reduce las fotos en un pool de hilos propio, fuera del event loop y del hilo del modelo"""
+
+    def __init__(
+        self,
+        max_bytes: int = IMAGE_MAX_BYTES,
+        max_pixels: int = IMAGE_MAX_PIXELS,
+        target_size: int = IMAGE_TARGET_SIZE,
+        workers: int = IMAGE_WORKERS,
+    ):
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.target_size = target_size
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="image")
+        self.latency = {stage: LatencyHistogram() for stage in STAGES}
+        self.processed = 0
+        self.rejected = 0
+
+    def _process(self, data: bytes) -> PreprocessedImage:
+        timings: Dict[str, float] = {}
+        started = stage_started = time.perf_counter()
+
+        def mark(stage: str):
+            nonlocal stage_started
+            now = time.perf_counter()
+            timings[stage] = (now - stage_started) * 1000.0
+            stage_started = now
+
+        try:
+            image = Image.open(io.BytesIO(data))
+        except UnidentifiedImageError:
+            raise ImageRejected("El archivo no es una imagen válida", status_code=415)
+        except Image.DecompressionBombError:
+            raise ImageRejected("La imagen tiene demasiados píxeles", status_code=413)
+        source_format = image.format
+        if source_format not in IMAGE_FORMATS:
+            raise ImageRejected(f"Formato de imagen no soportado: {source_format}", status_code=415)
+
+        original_size = image.size
+        if original_size[0] * original_size[1] > self.max_pixels:
+            raise ImageRejected(
+                f"La imagen tiene demasiados píxeles ({original_size[0]}x{original_size[1]})", status_code=413
+            )
+        mark("header")
+
+        # En JPEG el decodificador reduce por 1/2, 1/4 u 1/8 sin decodificar la foto completa
+        if source_format in ("JPEG", "MPO"):
+            image.draft("RGB", (self.target_size, self.target_size))
+        try:
+            image.load()
+        except (OSError, SyntaxError, ValueError) as e:
+            raise ImageRejected(f"La imagen está dañada o incompleta: {e}")
+        mark("decode")
+
+        # El límite es cuadrado, así que se puede reducir antes de rotar y rotar la imagen ya pequeña
+        orientation = image.getexif().get(0x0112)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if max(image.size) > self.target_size:
+            image.thumbnail((self.target_size, self.target_size), Image.Resampling.BICUBIC, reducing_gap=2.0)
+        mark("resize")
+
+        method = EXIF_TRANSPOSE.get(orientation)
+        if method is not None:
+            image = image.transpose(method)
+        mark("orient")
+
+        dhash = difference_hash(image)
+        mark("hash")
+
+        timings["total"] = (time.perf_counter() - started) * 1000.0
+        return PreprocessedImage(
+            image=image, original_size=original_size, format=source_format, dhash=dhash, timings_ms=timings
+        )
+
+    async def process_upload(self, upload: UploadFile) -> PreprocessedImage:
+        started = time.perf_counter()
+        data = await upload.read(self.max_bytes + 1)
+        read_ms = (time.perf_counter() - started) * 1000.0
+        if not data:
+            self.rejected += 1
+            raise ImageRejected("La imagen está vacía")
+        if len(data) > self.max_bytes:
+            self.rejected += 1
+            raise ImageRejected(f"La imagen supera el máximo de {self.max_bytes // (1024 * 1024)} MB", status_code=413)
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, self._process, data)
+        except ImageRejected:
+            self.rejected += 1
+            raise
+
+        result.timings_ms = {"read": read_ms, **result.timings_ms}
+        result.timings_ms["total"] += read_ms
+        for stage, ms in result.timings_ms.items():
+            self.latency[stage].observe(ms / 1000.0)
+            IMAGE_STAGE_SECONDS.labels(stage).observe(ms / 1000.0)
+        self.processed += 1
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "max_bytes": self.max_bytes,
+            "max_pixels": self.max_pixels,
+            "target_size": self.target_size,
+            "stages": {stage: histogram.snapshot() for stage, histogram in self.latency.items()},
+        }
@@ -0,0 +1,700 @@
+#app/inference.py
+import copy
+import os
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+from transformers import (
+    AutoModelForImageTextToText,
+    AutoProcessor,
+    DynamicCache,
+    LogitsProcessor,
+    LogitsProcessorList,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
+from transformers.utils import is_accelerate_available
+
+from observability import get_logger, observe_generation
+from tool_calls import TOOL_CALL_CONSTRAINED, TOOL_CALL_HEAD, continuation, is_value_char
+
+
+# Marca para separar el prefijo de sistema del contenido del usuario en la plantilla
+PREFIX_SENTINEL = "<<PREGUNTA_USUARIO>>"
+
+
+MODEL_PATH = os.getenv("MODEL_PATH", "./models")
+
+# "auto" usa CUDA si está disponible; "cpu" permite correr en portátiles sin tarjeta NVIDIA
+INFERENCE_DEVICE = os.getenv("INFERENCE_DEVICE", "auto")
+# "auto": bfloat16 en GPU, float32 en CPU (las capas cuantizadas en int8 esperan activaciones float32)
+INFERENCE_DTYPE = os.getenv("INFERENCE_DTYPE", "auto")
+# "int8": cuantización dinámica de las capas lineales del decodificador en CPU; "none" la desactiva
+CPU_QUANTIZATION = os.getenv("CPU_QUANTIZATION", "int8")
+# Hilos intra-op en CPU; 0 usa un hilo por núcleo físico disponible
+CPU_THREADS = int(os.getenv("CPU_THREADS", "0"))
+# Carga los pesos directamente en el dispositivo desde los safetensors mapeados en memoria,
+# sin una copia intermedia completa en RAM (requiere accelerate)
+MODEL_MMAP = os.getenv("MODEL_MMAP", "0") == "1"
+
+DTYPES = {"bfloat16": torch.bfloat16, "float16": torch.float16, "float32": torch.float32}
+
+# Tokens de bytes de SentencePiece, p. ej. <0x0A>
+BYTE_PIECE = re.compile(r"^<0x([0-9A-Fa-f]{2})>$")
+
+# AltUp recorta .weight.data de estas capas en cada paso; una capa cuantizada no tiene ese atributo
+QUANTIZATION_SKIP = (".altup.",)
+
+logger = get_logger("inference")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def resolve_device(requested: str = INFERENCE_DEVICE) -> str:
+    if requested == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    if requested.startswith("cuda") and not torch.cuda.is_available():
+        logger.warning("No hay GPU CUDA; se usa CPU", extra={"requested_device": requested})
+        return "cpu"
+    return requested
+
+
+def resolve_dtype(device: str, requested: str = INFERENCE_DTYPE) -> torch.dtype:
+    if requested == "auto":
+        return torch.float32 if device == "cpu" else torch.bfloat16
+    if requested not in DTYPES:
+        raise ValueError(f"INFERENCE_DTYPE no soportado: {requested}")
+    return DTYPES[requested]
+
+
+def physical_cores() -> int:
+    """Núcleos físicos utilizables por el proceso; los hilos SMT no aceleran las multiplicaciones de matrices"""
+    if hasattr(os, "sched_getaffinity"):
+        available = len(os.sched_getaffinity(0))
+    else:
+        available = os.cpu_count() or 1
+    try:
+        import psutil
+        physical = psutil.cpu_count(logical=False)
+    except ImportError:
+        physical = None
+    return max(1, min(physical or available, available))
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if os.uname().sysname == "Darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+def cache_nbytes(cache: DynamicCache) -> int:
+    total = 0
+    for layer in cache.layers:
+        # Las capas que comparten KV con otra no guardan tensores propios
+        if layer.keys is not None:
+            total += layer.keys.numel() * layer.keys.element_size()
+            total += layer.values.numel() * layer.values.element_size()
+    return total
+
+
+def quantize_for_cpu(model: torch.nn.Module) -> int:
+    """Cuantiza en int8 dinámico las capas lineales del modelo de lenguaje y lm_head; devuelve cuántas"""
+    targets = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear)
+        and ("language_model" in name or name == "lm_head")
+        and not any(skip in f".{name}." for skip in QUANTIZATION_SKIP)
+    }
+    if targets:
+        torch.ao.quantization.quantize_dynamic(model, targets, dtype=torch.qint8, inplace=True)
+    return len(targets)
+
+
+class LoadProfile:
+    """Fase actual de la carga del modelo y cuánto tardó cada una; se escribe desde el worker y se lee desde /health"""
+
+    def __init__(self):
+        self.phase = "pending"
+        self.timings_ms: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    @contextmanager
+    def step(self, phase: str):
+        self.phase = phase
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings_ms[phase] = round((time.perf_counter() - started) * 1000.0, 1)
+
+    def ready(self):
+        self.phase = "ready"
+        self.finished = time.perf_counter()
+
+    def fail(self, error: Exception):
+        self.error = f"{self.phase}: {error}"
+        self.phase = "failed"
+        self.finished = time.perf_counter()
+
+    def snapshot(self) -> Dict[str, Any]:
+        end = self.finished or time.perf_counter()
+        return {
+            "phase": self.phase,
+            "timings_ms": dict(self.timings_ms),
+            "total_ms": round((end - self.started) * 1000.0, 1),
+            "error": self.error,
+        }
+
+
+class CancellationCriteria(StoppingCriteria):
+    """Detiene cada fila del lote cuando su solicitud fue cancelada; de paso marca cuándo salió el primer token"""
+
+    def __init__(self, cancel_events):
+        self.cancel_events = cancel_events
+        self.first_token_at: Optional[float] = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        return torch.tensor(
+            [event.is_set() for event in self.cancel_events],
+            dtype=torch.bool,
+            device=input_ids.device
+        )
+
+
+class MaxTokensCriteria(StoppingCriteria):
+    """Detiene cada fila en su propio max_tokens: el lote genera hasta el mayor de su grupo"""
+
+    def __init__(self, prompt_length: int, max_tokens: List[int]):
+        self.prompt_length = prompt_length
+        self.max_tokens = max_tokens
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids.shape[1] - self.prompt_length
+        return torch.tensor(
+            [generated >= limit for limit in self.max_tokens],
+            dtype=torch.bool,
+            device=input_ids.device
+        )
+
+
+class DeadlineStreamer(TextIteratorStreamer):
+    """TextIteratorStreamer que solo espera la siguiente pieza hasta el plazo de la solicitud"""
+
+    def __init__(self, tokenizer, deadline: Optional[float] = None, **kwargs):
+        super().__init__(tokenizer, **kwargs)
+        self.deadline = deadline
+
+    def __next__(self):
+        if self.deadline is not None:
+            self.timeout = max(self.deadline - time.monotonic(), 0.0)
+        return super().__next__()
+
+
+def piece_text(piece: Optional[str]) -> str:
+    """Texto que aporta una pieza de SentencePiece al decodificarla sola; "" si no es texto"""
+    if piece is None:
+        return ""
+    byte = BYTE_PIECE.match(piece)
+    if byte:
+        value = int(byte.group(1), 16)
+        # Los bytes UTF-8 de varios bytes no forman texto por sí solos
+        return chr(value) if value < 0x80 else ""
+    return piece.replace("▁", " ")
+
+
+class ToolCallVocabulary:
+    """Texto de cada token y máscaras de los tokens válidos en los valores de una llamada a herramienta.
+
+    Se construye una vez por tokenizador; las máscaras se crean por tamaño de logits y dispositivo.
+    """
+
+    def __init__(self, tokenizer):
+        pieces = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+        special = set(tokenizer.all_special_ids)
+        self.strings = ["" if token_id in special else piece_text(piece) for token_id, piece in enumerate(pieces)]
+        self.ids_by_string: Dict[str, List[int]] = defaultdict(list)
+        for token_id, text in enumerate(self.strings):
+            if text:
+                self.ids_by_string[text].append(token_id)
+        self._masks: Dict[Tuple[str, int, str], torch.Tensor] = {}
+
+    def literal_ids(self, literal: str) -> List[int]:
+        """Tokens que son un prefijo no vacío de `literal`"""
+        ids = []
+        for end in range(1, len(literal) + 1):
+            ids.extend(self.ids_by_string.get(literal[:end], ()))
+        return ids
+
+    def _selects(self, kind: str, text: str) -> bool:
+        if kind == "opening":
+            # Tokens que abren un objeto de otra forma que la plantilla, p. ej. "{\n" o "{'"
+            opening = text.lstrip()
+            return opening.startswith("{") and not TOOL_CALL_HEAD.startswith(opening)
+        return bool(text) and all(is_value_char(kind, char) for char in text)
+
+    def mask(self, kind: str, size: int, device: torch.device) -> torch.Tensor:
+        key = (kind, size, str(device))
+        if key not in self._masks:
+            selected = [self._selects(kind, text) for text in self.strings[:size]]
+            selected.extend([False] * (size - len(selected)))
+            self._masks[key] = torch.tensor(selected, dtype=torch.bool, device=device)
+        return self._masks[key]
+
+
+class ToolCallConstraint(LogitsProcessor):
+    """Si una fila empieza a responder con "{", restringe sus tokens al esquema de las herramientas conocidas.
+
+    Las filas que responden en texto no se tocan. Una llamada completa marca la fila como terminada
+    (ver ToolCallStoppingCriteria), así que no se decodifica hasta max_tokens después de cerrar el JSON.
+    """
+
+    def __init__(self, vocabulary: ToolCallVocabulary, prompt_length: int, batch_size: int):
+        self.vocabulary = vocabulary
+        self.prompt_length = prompt_length
+        self.texts = [""] * batch_size
+        # None: aún no se sabe; "tool": llamada en curso; "text": respuesta normal o JSON fuera de plantilla
+        self.modes: List[Optional[str]] = [None] * batch_size
+        self.done = [False] * batch_size
+        self.json_starts = [0] * batch_size
+        self._seen = 0
+
+    def update(self, input_ids: torch.Tensor):
+        """Incorpora los tokens generados desde la última llamada"""
+        generated = input_ids.shape[1] - self.prompt_length
+        if generated <= self._seen:
+            return
+        new_tokens = input_ids[:, self.prompt_length + self._seen:].tolist()
+        self._seen = generated
+        for row, tokens in enumerate(new_tokens):
+            if self.done[row] or self.modes[row] == "text":
+                continue
+            self.texts[row] += "".join(self.vocabulary.strings[token] for token in tokens if token < len(self.vocabulary.strings))
+            if self.modes[row] is None:
+                stripped = self.texts[row].lstrip()
+                if not stripped:
+                    continue
+                self.modes[row] = "tool" if stripped.startswith("{") else "text"
+                self.json_starts[row] = len(self.texts[row]) - len(stripped)
+            if self.modes[row] == "tool":
+                expected = continuation(self.texts[row][self.json_starts[row]:])
+                if expected is None:
+                    self.modes[row] = "text"
+                elif expected.complete:
+                    self.done[row] = True
+
+    def __call__(self, input_ids: torch.Tensor, scores: torch.Tensor) -> torch.Tensor:
+        self.update(input_ids)
+        size = scores.shape[-1]
+        for row, mode in enumerate(self.modes):
+            if self.done[row] or mode == "text":
+                continue
+            if mode is None:
+                # Todavía puede empezar una llamada: solo se permite abrirla como en la plantilla
+                scores[row] = scores[row].masked_fill(self.vocabulary.mask("opening", size, scores.device), float("-inf"))
+                continue
+
+            expected = continuation(self.texts[row][self.json_starts[row]:])
+            allowed = torch.zeros(size, dtype=torch.bool, device=scores.device)
+            for kind in expected.values:
+                allowed |= self.vocabulary.mask(kind, size, scores.device)
+            literal_ids = [token for literal in expected.literals for token in self.vocabulary.literal_ids(literal) if token < size]
+            if literal_ids:
+                allowed[literal_ids] = True
+            if not bool(allowed.any()):
+                # Ningún token del vocabulario continúa la plantilla: se deja de restringir la fila
+                self.modes[row] = "text"
+                continue
+            scores[row] = scores[row].masked_fill(~allowed, float("-inf"))
+        return scores
+
+    @property
+    def tool_calls(self) -> int:
+        return sum(self.done)
+
+
+class ToolCallStoppingCriteria(StoppingCriteria):
+    """Termina cada fila en cuanto cierra su llamada a herramienta"""
+
+    def __init__(self, constraint: ToolCallConstraint):
+        self.constraint = constraint
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.constraint.update(input_ids)
+        return torch.tensor(self.constraint.done, dtype=torch.bool, device=input_ids.device)
+
+
+class InferenceEngine:
+    """Dueño del modelo y el procesador; genera con caché KV y prefijos precalculados.
+
+    No es seguro entre hilos: se crea y se usa únicamente desde el InferenceWorker.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        device: Optional[str] = None,
+        dtype: Optional[torch.dtype] = None,
+        quantization: str = CPU_QUANTIZATION,
+        threads: int = CPU_THREADS,
+        mmap: bool = MODEL_MMAP,
+        profile: Optional[LoadProfile] = None,
+        tool_constraint: bool = TOOL_CALL_CONSTRAINED,
+    ):
+        self.profile = profile or LoadProfile()
+        self.device = device or resolve_device()
+        dtype = dtype or resolve_dtype(self.device)
+        self.threads = None
+        if self.device == "cpu":
+            # Se fija en el hilo del worker, que es el que ejecuta todas las operaciones del modelo
+            self.threads = threads or physical_cores()
+            torch.set_num_threads(self.threads)
+
+        with self.profile.step("processor"):
+            self.processor = AutoProcessor.from_pretrained(model_path, local_files_only=True)
+            # Decoder-only: el relleno de los lotes debe ir a la izquierda
+            self.processor.tokenizer.padding_side = "left"
+
+        if mmap and not is_accelerate_available():
+            logger.warning("MODEL_MMAP requiere accelerate; se carga de la forma habitual")
+            mmap = False
+        with self.profile.step("weights"):
+            self.model = AutoModelForImageTextToText.from_pretrained(
+                model_path,
+                torch_dtype=dtype,
+                local_files_only=True,
+                low_cpu_mem_usage=True,
+                device_map={"": self.device} if mmap else None
+            )
+            self.model.eval()
+
+        if not mmap:
+            with self.profile.step("device"):
+                self.model.to(self.device)
+                if self.device.startswith("cuda"):
+                    torch.cuda.synchronize()
+
+        self.quantized_layers = 0
+        if self.device == "cpu" and quantization == "int8":
+            if dtype == torch.float32:
+                with self.profile.step("quantize"):
+                    self.quantized_layers = quantize_for_cpu(self.model)
+            else:
+                logger.info("Cuantización int8 omitida: requiere float32", extra={"dtype": str(dtype)})
+        logger.info("Modelo cargado", extra={
+            "device": self.device,
+            "dtype": str(dtype),
+            "quantized_layers": self.quantized_layers,
+            "threads": self.threads,
+            "peak_rss_mb": peak_rss_mb(),
+        })
+
+        self.tool_vocabulary = None
+        if tool_constraint:
+            with self.profile.step("tool_vocabulary"):
+                self.tool_vocabulary = ToolCallVocabulary(self.processor.tokenizer)
+
+        self._prefixes: Dict[str, Tuple[torch.Tensor, DynamicCache]] = {}
+        self.prefix_hits = 0
+        self.prefix_misses = 0
+        self.generated_tokens = 0
+        self.generation_seconds = 0.0
+        self.session_hits = 0
+        self.session_misses = 0
+        self.tool_calls = 0
+        # Falso durante el warmup: las métricas solo reflejan tráfico real
+        self.observing = True
+
+    def _generation_controls(
+        self,
+        batch: List[Any],
+        inputs: Dict[str, torch.Tensor],
+        criteria: CancellationCriteria
+    ) -> Tuple[Dict[str, Any], Optional[ToolCallConstraint]]:
+        """Criterios de parada y procesadores de logits de una generación; las de texto pueden llamar herramientas"""
+        stopping = [criteria]
+        max_tokens = [request.max_tokens for request in batch]
+        if min(max_tokens) < max(max_tokens):
+            stopping.append(MaxTokensCriteria(inputs["input_ids"].shape[1], max_tokens))
+        processors = []
+        constraint = None
+        if self.tool_vocabulary is not None and batch[0].modality == "text":
+            constraint = ToolCallConstraint(self.tool_vocabulary, inputs["input_ids"].shape[1], len(batch))
+            processors.append(constraint)
+            stopping.append(ToolCallStoppingCriteria(constraint))
+        controls = {
+            "stopping_criteria": StoppingCriteriaList(stopping),
+            "logits_processor": LogitsProcessorList(processors),
+        }
+        return controls, constraint
+
+    def _record_generation(
+        self,
+        batch: List[Any],
+        inputs: Dict[str, torch.Tensor],
+        tokens: int,
+        started: float,
+        criteria: CancellationCriteria,
+        constraint: Optional[ToolCallConstraint] = None
+    ):
+        finished = time.monotonic()
+        self.generated_tokens += tokens
+        self.generation_seconds += finished - started
+        if constraint is not None:
+            self.tool_calls += constraint.tool_calls
+        if not self.observing:
+            return
+        # La velocidad de decodificación se mide desde el primer token, sin el prefill
+        first_token_at = criteria.first_token_at
+        observe_generation(
+            batch[0].modality,
+            inputs["attention_mask"].sum(dim=1).tolist(),
+            tokens,
+            finished - (first_token_at or started),
+            first_token_at,
+            [request.enqueued_at for request in batch]
+        )
+
+    def warmup(self, runs: List[Tuple[List[Any], Dict[str, Any]]]):
+        """Genera unos pocos tokens por cada (lote, parámetros) para inicializar kernels y cachés antes del primer usuario"""
+        self.observing = False
+        try:
+            for batch, generation_kwargs in runs:
+                self.generate_batch(batch, **generation_kwargs)
+            if self.device.startswith("cuda"):
+                torch.cuda.synchronize()
+        finally:
+            self.observing = True
+        # Las estadísticas solo reflejan tráfico real
+        self.generated_tokens = 0
+        self.generation_seconds = 0.0
+        self.prefix_hits = 0
+        self.prefix_misses = 0
+        self.tool_calls = 0
+
+    def build_prefix_cache(self, name: str, system_prompt: str):
+        """Codifica una sola vez el prompt de sistema y guarda sus estados clave/valor"""
+        messages = [
+            {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
+            {"role": "user", "content": [{"type": "text", "text": PREFIX_SENTINEL}]}
+        ]
+        rendered = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        prefix_text = rendered.split(PREFIX_SENTINEL)[0]
+
+        prefix_ids = self.processor.tokenizer(
+            prefix_text,
+            add_special_tokens=False,
+            return_tensors="pt"
+        ).input_ids.to(self.device)
+
+        cache = DynamicCache()
+        with torch.inference_mode():
+            self.model(input_ids=prefix_ids, past_key_values=cache, use_cache=True, logits_to_keep=1)
+
+        self._prefixes[name] = (prefix_ids[0], cache)
+
+    def _prefix_cache_for(self, name: Optional[str], input_ids: torch.Tensor) -> Optional[DynamicCache]:
+        if name is None or name not in self._prefixes:
+            return None
+
+        prefix_ids, cache = self._prefixes[name]
+        length = prefix_ids.shape[0]
+        # Debe quedar al menos un token sin caché para que generate tenga entrada
+        if input_ids.shape[0] <= length or not torch.equal(input_ids[:length], prefix_ids):
+            self.prefix_misses += 1
+            return None
+
+        self.prefix_hits += 1
+        return copy.deepcopy(cache)
+
+    def _encode_session(self, session: Any, request: Any) -> Dict[str, torch.Tensor]:
+        """Codifica historial + pregunta; si no cabe en el contexto de la sesión descarta los turnos más viejos"""
+        inputs = self.encode([request])
+        while inputs["input_ids"].shape[1] + request.max_tokens > session.max_tokens and session.turns:
+            # messages = [system, (user, assistant)*, user]
+            session.turns.pop(0)
+            session.trimmed_turns += 1
+            request.messages = request.messages[:1] + request.messages[3:]
+            inputs = self.encode([request])
+        return inputs
+
+    def _session_cache_for(self, session: Any, input_ids: torch.Tensor) -> DynamicCache:
+        """Caché de la conversación recortada a lo que coincide con la nueva entrada; solo se codifica el resto"""
+        if session.cache is not None:
+            # Debe quedar al menos un token sin caché para que generate tenga entrada
+            length = min(session.token_ids.shape[0], input_ids.shape[0] - 1)
+            matches = (session.token_ids[:length] == input_ids[:length]).long()
+            common = int(matches.cumprod(dim=0).sum())
+            if common > 0:
+                # La respuesta vuelve en el historial retokenizada o como texto final de la herramienta:
+                # desde la primera diferencia se codifica de nuevo
+                session.cache.crop(common)
+                session.reused_tokens += common
+                self.session_hits += 1
+                return session.cache
+
+        self.session_misses += 1
+        return self._prefix_cache_for("text", input_ids) or DynamicCache()
+
+    def _finish_session(self, session: Any, cache: DynamicCache, sequence: torch.Tensor):
+        session.cache = cache
+        session.token_ids = sequence
+        session.kv_bytes = cache_nbytes(cache)
+
+    def generate_session(self, session: Any, request: Any, **generation_kwargs) -> str:
+        """Genera el siguiente turno de una conversación reutilizando su caché KV"""
+        inputs = self._encode_session(session, request)
+        cache = self._session_cache_for(session, inputs["input_ids"][0])
+
+        criteria = CancellationCriteria([request.cancel_event])
+        controls, constraint = self._generation_controls([request], inputs, criteria)
+        started = time.monotonic()
+        try:
+            with torch.inference_mode():
+                output = self.model.generate(
+                    **inputs,
+                    max_new_tokens=request.max_tokens,
+                    past_key_values=cache,
+                    use_cache=True,
+                    do_sample=True,
+                    **controls,
+                    **generation_kwargs
+                )
+        except Exception:
+            session.drop_cache()
+            raise
+
+        generated = output[0, inputs["input_ids"].shape[1]:]
+        self._record_generation([request], inputs, int(generated.shape[0]), started, criteria, constraint)
+        self._finish_session(session, cache, output[0])
+        return self.processor.decode(generated, skip_special_tokens=True).strip()
+
+    def encode(self, batch: List[Any]) -> Dict[str, torch.Tensor]:
+        texts = [
+            self.processor.apply_chat_template(request.messages, tokenize=False, add_generation_prompt=True)
+            for request in batch
+        ]
+        images = None
+        if batch[0].image is not None:
+            images = [[request.image] for request in batch]
+
+        inputs = self.processor(
+            text=texts,
+            images=images,
+            padding=True,
+            add_special_tokens=False,
+            return_tensors="pt"
+        )
+        return inputs.to(self.device, dtype=self.model.dtype)
+
+    def generate_batch(self, batch: List[Any], prefix: Optional[str] = None, **generation_kwargs) -> List[str]:
+        """Genera respuestas para un lote; el prefijo en caché solo aplica a lotes de uno y do_sample=False decodifica sin muestreo"""
+        inputs = self.encode(batch)
+
+        past_key_values = None
+        if len(batch) == 1:
+            past_key_values = self._prefix_cache_for(prefix, inputs["input_ids"][0])
+
+        criteria = CancellationCriteria([request.cancel_event for request in batch])
+        controls, constraint = self._generation_controls(batch, inputs, criteria)
+        started = time.monotonic()
+        with torch.inference_mode():
+            output = self.model.generate(
+                **inputs,
+                max_new_tokens=max(request.max_tokens for request in batch),
+                past_key_values=past_key_values,
+                use_cache=True,
+                **controls,
+                **{"do_sample": True, **generation_kwargs}
+            )
+
+        generated = output[:, inputs["input_ids"].shape[1]:]
+        pad_token_id = self.processor.tokenizer.pad_token_id
+        self._record_generation(batch, inputs, int((generated != pad_token_id).sum()), started, criteria, constraint)
+        return [text.strip() for text in self.processor.batch_decode(generated, skip_special_tokens=True)]
+
+    def prepare_stream(
+        self,
+        request: Any,
+        prefix: Optional[str] = None,
+        session: Any = None,
+        deadline: Optional[float] = None,
+        **generation_kwargs
+    ) -> Tuple[TextIteratorStreamer, Callable[[], None]]:
+        """Devuelve el streamer a consumir y el trabajo que debe ejecutarse en el worker; con session continúa la conversación.
+
+        Con deadline (time.monotonic()), esperar la siguiente pieza más allá de ese instante lanza queue.Empty.
+        """
+        streamer = DeadlineStreamer(
+            self.processor.tokenizer,
+            deadline=deadline,
+            skip_prompt=True,
+            skip_special_tokens=True
+        )
+
+        def job():
+            try:
+                if session is not None:
+                    inputs = self._encode_session(session, request)
+                    past_key_values = self._session_cache_for(session, inputs["input_ids"][0])
+                else:
+                    inputs = self.encode([request])
+                    past_key_values = self._prefix_cache_for(prefix, inputs["input_ids"][0])
+                criteria = CancellationCriteria([request.cancel_event])
+                controls, constraint = self._generation_controls([request], inputs, criteria)
+                started = time.monotonic()
+                with torch.inference_mode():
+                    output = self.model.generate(
+                        **inputs,
+                        max_new_tokens=request.max_tokens,
+                        past_key_values=past_key_values,
+                        use_cache=True,
+                        do_sample=True,
+                        streamer=streamer,
+                        **controls,
+                        **generation_kwargs
+                    )
+                tokens = output.shape[1] - inputs["input_ids"].shape[1]
+                self._record_generation([request], inputs, tokens, started, criteria, constraint)
+                if session is not None:
+                    self._finish_session(session, past_key_values, output[0])
+            except Exception:
+                if session is not None:
+                    session.drop_cache()
+                streamer.end()
+                raise
+
+        return streamer, job
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "device": str(self.device),
+            "dtype": str(self.model.dtype).replace("torch.", ""),
+            "threads": self.threads,
+            "quantized_layers": self.quantized_layers,
+            "generated_tokens": self.generated_tokens,
+            "tokens_per_second": round(self.generated_tokens / self.generation_seconds, 2) if self.generation_seconds else None,
+            "peak_rss_mb": peak_rss_mb(),
+            "load": self.profile.snapshot(),
+            "prefix_caches": {name: int(ids.shape[0]) for name, (ids, _) in self._prefixes.items()},
+            "prefix_hits": self.prefix_hits,
+            "prefix_misses": self.prefix_misses,
+            "session_hits": self.session_hits,
+            "session_misses": self.session_misses,
+            "tool_calls": self.tool_calls,
+        }
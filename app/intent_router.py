@@ -0,0 +1,334 @@
+#app/intent_router.py
+import csv
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import date
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+from answer_cache import normalize_question
+from databases.inventario.indice import normalizar_producto
+
+
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "1") == "1"
+# CSV o JSONL del dataset de function calling (columnas pregunta/query y function/tool)
+INTENT_DATASET_PATH = os.getenv("INTENT_DATASET_PATH", "")
+# CSV o JSONL con preguntas que NO usan herramientas (p. ej. preguntas.csv)
+INTENT_NEGATIVES_PATH = os.getenv("INTENT_NEGATIVES_PATH", "")
+# Las reglas solo responden sin el modelo si el clasificador también está seguro de la herramienta
+INTENT_MIN_PROBABILITY = float(os.getenv("INTENT_MIN_PROBABILITY", "0.8"))
+INTENT_CLASSIFIER_THRESHOLD = float(os.getenv("INTENT_CLASSIFIER_THRESHOLD", "0.9"))
+# Cada cuánto se relee la lista de productos registrados en inventario
+INTENT_PRODUCTS_REFRESH_S = float(os.getenv("INTENT_PRODUCTS_REFRESH_S", "60"))
+
+NO_TOOL = "ninguna"
+ROUTED_TOOLS = ("inventario_consulta", "gastos_consulta")
+
+MONTHS = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
+    "julio": 7, "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10,
+    "noviembre": 11, "diciembre": 12,
+}
+
+# Productos usados al generar el dataset de function calling
+KNOWN_PRODUCTS = (
+    "fertilizante", "semillas", "pesticidas", "abono", "combustible", "sacos", "cajas",
+    "herbicidas", "fungicidas", "cal", "azufre", "alambre", "postes", "mangueras",
+    "aspersores", "guantes", "botas",
+)
+
+# Categorías de gasto usadas al generar el dataset, en singular: el servicio las filtra con ILIKE
+EXPENSE_CATEGORIES = (
+    "herramienta", "transporte", "insumo", "fertilizante", "semilla", "mano de obra", "maquinaria",
+    "servicio", "combustible", "mantenimiento", "agua", "electricidad", "impuesto", "seguro", "alquiler",
+)
+# Lo que puede seguir a "gastamos en ..." sin ser una categoría
+PERIOD_WORDS = frozenset(("mes", "meses", "ano", "este", "esta", "total", "todo", "lo", "que", "promedio", *MONTHS))
+CATEGORY_SLOT = re.compile(r"\b(?:gast\w*\s+(?:de|en|por)|en|por)\s+(?:(?:el|la|los|las)\s+)?(?P<palabra>[a-zñ]+)")
+
+QUANTITY_WORDS = r"(?:cuant[oa]s?|cantidad|inventario|existencias?|stock)"
+STOCK_WORDS = r"\b(?:hay|tenemos|tengo|tiene|queda|quedan|quedo|sobra|disponibles?|inventario|existencias?|stock|bodega)\b"
+# Preguntas agronómicas del tipo "¿cuánto fertilizante debo aplicar?" no son de inventario
+ADVICE_WORDS = r"\b(?:debo|debe|deben|aplicar|aplico|necesita|necesito|recomienda|recomendable|sembrar|por planta|por hectarea)\b"
+EXPENSE_WORDS = r"\bgast(?:o|os|amos|e|aste|ado|ados|aron)\b"
+
+PRODUCT_PATTERN = re.compile(
+    QUANTITY_WORDS + r"\s+(?:(?:hay|tenemos|queda|quedan)\s+)?(?:de\s+|del\s+)?(?:el\s+|la\s+|los\s+|las\s+)?"
+    r"(?P<producto>[a-z0-9ñ ]+?)"
+    r"(?:\s+(?:hay|tenemos|tengo|tiene|queda|quedan|nos|en|disponibles?|existen)\b|$)"
+)
+
+# Nombre de la herramienta en la columna function: "{'name': 'gastos_consulta', 'arguments': ...}"
+FUNCTION_NAME = re.compile(r"""['"]?(?:name|tool)['"]?\s*:\s*['"](\w+)['"]""")
+
+SEED_EXAMPLES = [
+    ("cuanto fertilizante tenemos", "inventario_consulta"),
+    ("que cantidad de abono hay en bodega", "inventario_consulta"),
+    ("cuantos sacos nos quedan", "inventario_consulta"),
+    ("cuanto hay de fungicida en el inventario", "inventario_consulta"),
+    ("revisa el inventario de guantes", "inventario_consulta"),
+    ("cuantas botas hay disponibles", "inventario_consulta"),
+    ("cuantos guantes tenemos", "inventario_consulta"),
+    ("cuantas mangueras quedan", "inventario_consulta"),
+    ("cuanta cal queda en bodega", "inventario_consulta"),
+    ("cuantos postes hay en bodega", "inventario_consulta"),
+    ("cuantas cajas tenemos en el inventario", "inventario_consulta"),
+    ("que cantidad de semillas nos queda", "inventario_consulta"),
+    ("cuanto gastamos en enero de 2024", "gastos_consulta"),
+    ("cual fue el gasto de marzo 2023", "gastos_consulta"),
+    ("cuanto se gasto en julio del 2022", "gastos_consulta"),
+    ("dime los gastos de diciembre 2024", "gastos_consulta"),
+    ("total de gastos en febrero de 2025", "gastos_consulta"),
+    ("cuanto gastamos en transporte en marzo de 2024", "gastos_consulta"),
+    ("como controlar la roya", NO_TOOL),
+    ("como debe ser el secado del cafe", NO_TOOL),
+    ("cuanto fertilizante debo aplicar por planta", NO_TOOL),
+    ("que enfermedad tiene esta planta", NO_TOOL),
+    ("hola buenos dias", NO_TOOL),
+    ("cuando se debe hacer la poda del cafe", NO_TOOL),
+    ("como se controla la broca", NO_TOOL),
+    ("que variedades de cafe son resistentes a la roya", NO_TOOL),
+    ("cuantas variedades de cafe hay en colombia", NO_TOOL),
+    ("cuantas plagas hay en el cafe", NO_TOOL),
+    ("cuantos kilos de cafe hay en una arroba", NO_TOOL),
+    ("cuantos granos de cafe hay en una libra", NO_TOOL),
+]
+
+
+@dataclass
+class IntentMatch:
+    tool: str
+    argumentos: Dict[str, str]
+    confidence: float
+    source: str
+
+
+def tokenize(text: str) -> List[str]:
+    words = text.split()
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+
+class NaiveBayesClassifier:
+    """Naive Bayes multinomial sobre unigramas y bigramas; suficiente y rápido en CPU"""
+
+    def __init__(self, alpha: float = 1.0):
+        self.alpha = alpha
+        self.class_counts: Counter = Counter()
+        self.token_counts: Dict[str, Counter] = defaultdict(Counter)
+        self.token_totals: Counter = Counter()
+        self.vocabulary = set()
+
+    def fit(self, examples: Iterable[Tuple[str, str]]) -> "NaiveBayesClassifier":
+        for text, label in examples:
+            tokens = tokenize(normalize_question(text))
+            self.class_counts[label] += 1
+            self.token_counts[label].update(tokens)
+            self.token_totals[label] += len(tokens)
+            self.vocabulary.update(tokens)
+        return self
+
+    @property
+    def trained(self) -> bool:
+        return len(self.class_counts) > 1
+
+    def predict_proba(self, normalized_text: str) -> Dict[str, float]:
+        tokens = [token for token in tokenize(normalized_text) if token in self.vocabulary]
+        total = sum(self.class_counts.values())
+        vocabulary_size = len(self.vocabulary)
+
+        scores = {}
+        for label, count in self.class_counts.items():
+            denominator = self.token_totals[label] + self.alpha * vocabulary_size
+            score = math.log(count / total)
+            for token in tokens:
+                score += math.log((self.token_counts[label][token] + self.alpha) / denominator)
+            scores[label] = score
+
+        top = max(scores.values())
+        exp_scores = {label: math.exp(score - top) for label, score in scores.items()}
+        norm = sum(exp_scores.values())
+        return {label: value / norm for label, value in exp_scores.items()}
+
+
+def read_rows(path: str) -> Iterable[Dict[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def first_value(row: Dict[str, str], names: Tuple[str, ...]) -> Optional[str]:
+    for name in names:
+        if row.get(name):
+            return str(row[name])
+    return None
+
+
+def load_function_calling_examples(path: str) -> List[Tuple[str, str]]:
+    """Lee pares (pregunta, herramienta) del dataset de function calling"""
+    examples = []
+    for row in read_rows(path):
+        question = first_value(row, ("query", "question", "pregunta", "Query"))
+        function = first_value(row, ("function", "tool", "Function", "label"))
+        if not question or not function:
+            continue
+        name = FUNCTION_NAME.search(function)
+        examples.append((question, name.group(1) if name else function.strip()))
+    return examples
+
+
+def load_negative_examples(path: str) -> List[Tuple[str, str]]:
+    examples = []
+    for row in read_rows(path):
+        question = first_value(row, ("preguntas", "pregunta", "question", "query"))
+        if question:
+            examples.append((question, NO_TOOL))
+    return examples
+
+
+def extract_period(text: str, today: date) -> Tuple[Optional[int], Optional[int]]:
+    """Extrae (mes, año) de nombres de mes, números o expresiones como 'este mes'"""
+    month, year = None, None
+    if re.search(r"\beste mes\b", text):
+        month, year = today.month, today.year
+    elif re.search(r"\bmes pasado\b", text):
+        month, year = (12, today.year - 1) if today.month == 1 else (today.month - 1, today.year)
+
+    for name, number in MONTHS.items():
+        if re.search(rf"\b{name}\b", text):
+            month = number
+            break
+    if month is None:
+        numeric = re.search(r"\bmes\s+(?:de\s+)?(\d{1,2})\b", text) or re.search(r"\b(\d{1,2})\s+(?:19|20)\d{2}\b", text)
+        if numeric and 1 <= int(numeric.group(1)) <= 12:
+            month = int(numeric.group(1))
+
+    explicit_year = re.search(r"\b((?:19|20)\d{2})\b", text)
+    if explicit_year:
+        year = int(explicit_year.group(1))
+    elif re.search(r"\beste ano\b", text):
+        year = today.year
+    elif re.search(r"\bano pasado\b", text):
+        year = today.year - 1
+
+    return month, year
+
+
+def extract_product(text: str, products: Collection[str] = ()) -> Optional[str]:
+    """Producto conocido o registrado en inventario; cualquier otra frase ("variedades de cafe") va al modelo"""
+    # Primero el nombre registrado completo: "abono organico" antes que "abono"
+    match = PRODUCT_PATTERN.search(text)
+    if match:
+        product = match.group("producto").strip()
+        if product and normalizar_producto(product) in products:
+            return product
+
+    for product in KNOWN_PRODUCTS:
+        singular = product[:-1] if product.endswith("s") else product
+        if re.search(rf"\b{singular}(?:e?s)?\b", text):
+            return product
+    return None
+
+
+def extract_category(text: str) -> Optional[str]:
+    """Categoría de gasto de la pregunta, "" si no nombra ninguna y None si nombra algo que no es una categoría conocida"""
+    category = ""
+    for name in EXPENSE_CATEGORIES:
+        if re.search(rf"\b{name}(?:e?s)?\b", text):
+            category = name
+            break
+    # "cuanto gastamos en la finca en enero": el total del mes sería una respuesta equivocada
+    for match in CATEGORY_SLOT.finditer(text):
+        word = match.group("palabra")
+        if word in PERIOD_WORDS:
+            continue
+        if not any(re.fullmatch(rf"{name.split()[0]}(?:e?s)?", word) for name in EXPENSE_CATEGORIES):
+            return None
+    return category
+
+
+class IntentRouter:
+    """Detecta consultas de inventario y gastos sin invocar al modelo"""
+
+    def __init__(self, classifier: Optional[NaiveBayesClassifier] = None):
+        self.classifier = classifier
+        # Claves normalizadas de los productos registrados en inventario
+        self.products: frozenset = frozenset()
+        self.routed = 0
+        self.passed = 0
+
+    @classmethod
+    def from_env(cls) -> "IntentRouter":
+        examples = list(SEED_EXAMPLES)
+        if INTENT_DATASET_PATH and os.path.exists(INTENT_DATASET_PATH):
+            examples += load_function_calling_examples(INTENT_DATASET_PATH)
+        if INTENT_NEGATIVES_PATH and os.path.exists(INTENT_NEGATIVES_PATH):
+            examples += load_negative_examples(INTENT_NEGATIVES_PATH)
+        return cls(NaiveBayesClassifier().fit(examples))
+
+    def update_products(self, names: Iterable[str]):
+        self.products = frozenset(normalizar_producto(name) for name in names)
+
+    def _rule_label(self, text: str) -> Optional[str]:
+        if re.search(EXPENSE_WORDS, text):
+            return "gastos_consulta"
+        if re.search(rf"\b{QUANTITY_WORDS}\b", text) and re.search(STOCK_WORDS, text) and not re.search(ADVICE_WORDS, text):
+            return "inventario_consulta"
+        return None
+
+    def _arguments(self, tool: str, text: str, today: date) -> Optional[Dict[str, str]]:
+        if tool == "inventario_consulta":
+            product = extract_product(text, self.products)
+            return {"producto": product} if product else None
+        if tool == "gastos_consulta":
+            month, year = extract_period(text, today)
+            category = extract_category(text)
+            if month is None or year is None or category is None:
+                return None
+            argumentos = {"mes": str(month), "año": str(year)}
+            if category:
+                argumentos["categoria"] = category
+            return argumentos
+        return None
+
+    def route(self, question: str, today: Optional[date] = None) -> Optional[IntentMatch]:
+        text = normalize_question(question)
+        today = today or date.today()
+
+        probabilities = {}
+        if self.classifier is not None and self.classifier.trained:
+            probabilities = self.classifier.predict_proba(text)
+
+        tool = self._rule_label(text)
+        source = "rules"
+        if tool is None and probabilities:
+            best = max(probabilities, key=probabilities.get)
+            if best in ROUTED_TOOLS and probabilities[best] >= INTENT_CLASSIFIER_THRESHOLD:
+                tool, source = best, "classifier"
+
+        confidence = probabilities.get(tool, 1.0) if probabilities else 1.0
+        if tool is None or confidence < INTENT_MIN_PROBABILITY:
+            self.passed += 1
+            return None
+
+        argumentos = self._arguments(tool, text, today)
+        if argumentos is None:
+            self.passed += 1
+            return None
+
+        self.routed += 1
+        return IntentMatch(tool=tool, argumentos=argumentos, confidence=confidence, source=source)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "routed": self.routed,
+            "passed_to_model": self.passed,
+            "registered_products": len(self.products),
+            "classifier_examples": sum(self.classifier.class_counts.values()) if self.classifier else 0,
+        }
@@ -0,0 +1,130 @@
+#app/observability.py
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# "text": legible en consola; "json": una línea JSON por evento, para agregadores de logs
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+RATE_BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+
+REQUEST_SECONDS = Histogram(
+    "caficulbot_request_seconds", "Latencia de las solicitudes HTTP hasta enviar los encabezados",
+    ["method", "route", "status"], buckets=SECONDS_BUCKETS
+)
+IMAGE_STAGE_SECONDS = Histogram(
+    "caficulbot_image_stage_seconds", "Tiempo por etapa del preprocesamiento de imágenes",
+    ["stage"], buckets=SECONDS_BUCKETS
+)
+PROMPT_TOKENS = Histogram(
+    "caficulbot_prompt_tokens", "Tokens de entrada por solicitud", ["modality"], buckets=TOKEN_BUCKETS
+)
+GENERATED_TOKENS = Counter(
+    "caficulbot_generated_tokens_total", "Tokens generados por el modelo", ["modality"]
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "caficulbot_time_to_first_token_seconds", "Desde que la solicitud entra a la cola hasta el primer token",
+    ["modality"], buckets=SECONDS_BUCKETS
+)
+TOKENS_PER_SECOND = Histogram(
+    "caficulbot_generation_tokens_per_second", "Velocidad de decodificación de cada generación",
+    ["modality"], buckets=RATE_BUCKETS
+)
+TOOL_CALL_SECONDS = Histogram(
+    "caficulbot_tool_call_seconds", "Latencia de las llamadas a herramientas, con reintentos",
+    ["service", "outcome"], buckets=SECONDS_BUCKETS
+)
+QUEUE_DEPTH = Gauge("caficulbot_queue_depth", "Solicitudes esperando o en el lote en curso")
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "caficulbot_admission_queue_depth", "Solicitudes esperando cupo en el control de admisión", ["class"]
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "caficulbot_admission_wait_seconds", "Espera en el control de admisión hasta recibir cupo",
+    ["class"], buckets=SECONDS_BUCKETS
+)
+ADMISSION_REJECTED = Counter(
+    "caficulbot_admission_rejected_total", "Solicitudes rechazadas con 429 por el control de admisión",
+    ["class", "reason"]
+)
+MODEL_MEMORY_BYTES = Gauge("caficulbot_model_memory_bytes", "Memoria del proceso y del modelo", ["kind"])
+
+# Atributos propios de LogRecord; todo lo demás llegó por extra= y es un campo del evento
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def record_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        event = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **record_fields(record),
+        }
+        if record.exc_info:
+            event["exc"] = self.formatException(record.exc_info)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Mensaje legible seguido de los campos como clave=valor"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = " ".join(f"{key}={value!r}" for key, value in record_fields(record).items())
+        return f"{line} {fields}" if fields else line
+
+
+def configure_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT):
+    """Un único handler en stderr para el logger "caficulbot"; idempotente (Streamlit reejecuta el script)"""
+    logger = logging.getLogger("caficulbot")
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"caficulbot.{name}")
+
+
+def observe_generation(
+    modality: str,
+    prompt_tokens: Iterable[int],
+    generated_tokens: int,
+    seconds: float,
+    first_token_at: Optional[float] = None,
+    enqueued_at: Iterable[float] = (),
+):
+    """Registra una generación (un lote o un stream); los tiempos son de time.monotonic"""
+    for tokens in prompt_tokens:
+        PROMPT_TOKENS.labels(modality).observe(tokens)
+    GENERATED_TOKENS.labels(modality).inc(generated_tokens)
+    if seconds > 0 and generated_tokens:
+        TOKENS_PER_SECOND.labels(modality).observe(generated_tokens / seconds)
+    if first_token_at is not None:
+        for started in enqueued_at:
+            TIME_TO_FIRST_TOKEN.labels(modality).observe(max(0.0, first_token_at - started))
+
+
+def observe_tool_call(service: str, started: float, ok: bool):
+    TOOL_CALL_SECONDS.labels(service, "ok" if ok else "error").observe(time.monotonic() - started)
@@ -0,0 +1,105 @@
+#app/prompts.py
+"""Prompts de sistema, parámetros de generación y lectura de respuestas del modelo.
+
+Sin efectos al importarse: lo usan tanto la API como batch_eval.py.
+"""
+import json
+from typing import Any, Dict, List, Optional, Union
+
+
+#For the MVP we will use only two tools: inventory and expenses
+SYSTEM_PROMPT = """Eres un experto en café de Colombia con amplio conocimiento sobre cultivo, procesamiento, variedades, manejo de plagas y enfermedades.
+Vas a responder preguntas sobre café de manera natural y directa, sin usar formato JSON, a menos que se indique lo contrario.
+
+INSTRUCCIONES CRÍTICAS:
+- Por defecto, SIEMPRE responde en lenguaje natural, NO en formato JSON
+- SOLO usa herramientas en estos casos específicos:
+  * Si preguntan "¿cuánto hay de X?" o "¿qué cantidad tenemos de X?" → usa inventario_consulta
+  * Si preguntan "¿cuánto gastamos en mes/año?" → usa gastos_consulta
+- Para TODAS las demás preguntas (saludos, enfermedades, plagas, consejos, análisis de imágenes, etc.) responde DIRECTAMENTE sin usar herramientas
+
+Ejemplos de cuando NO usar herramientas:
+- Cuando te saluden
+- "¿Cómo tratar la roya?" → Responde directamente
+
+Ejemplos de cuando SÍ usar herramientas:
+- "¿Cuánto fertilizante tenemos?" → {"tool": "inventario_consulta", "argumentos": "producto=fertilizante"}
+- "¿Cuánto gastamos en enero 2024?" → {"tool": "gastos_consulta", "argumentos": "mes=1,año=2024"}
+"""
+
+SYSTEM_PROMPT_IMAGE = """Eres un experto en café de Colombia con amplio conocimiento sobre cultivo, procesamiento, variedades, 
+manejo de plagas y enfermedades, y todas las prácticas agrícolas relacionadas con el café colombiano.
+
+Analiza la imagen proporcionada y responde de manera natural y directa en español. NO uses formato JSON ni herramientas.
+Proporciona un análisis detallado de lo que observas en la imagen, identificando posibles problemas, enfermedades, 
+estado de la planta o cualquier aspecto relevante relacionado con el café."""
+
+GENERATION_PARAMS = {
+    "text": {"temperature": 0.7, "repetition_penalty": 1.1, "top_p": 0.95},
+    "image": {"temperature": 0.8, "repetition_penalty": 1.2, "top_p": 0.95},
+}
+
+EMPTY_ANSWERS = {
+    "text": "No pude generar una respuesta.",
+    "image": "No pude generar una respuesta para la imagen.",
+}
+
+
+def extract_content_from_response(raw_response: Union[str, List, Dict]) -> str:
+    """Extract text content from various response formats"""
+    
+    if isinstance(raw_response, str):
+        return raw_response
+    
+    if isinstance(raw_response, list):
+        for item in raw_response:
+            if isinstance(item, str):
+                return item
+            elif isinstance(item, dict) and "text" in item:
+                return item["text"]
+        return str(raw_response)
+    
+    if isinstance(raw_response, dict):
+        for key in ["text", "content", "response", "answer"]:
+            if key in raw_response:
+                return extract_content_from_response(raw_response[key])
+        return str(raw_response)
+    
+    return str(raw_response)
+
+
+def extract_response_content(answer: Union[str, List, Dict]) -> str:
+    """Extrae el contenido de respuesta si viene en formato JSON o estructurado"""
+    
+    text_content = extract_content_from_response(answer)
+    
+    try:
+        response_json = json.loads(text_content.strip())
+        if isinstance(response_json, dict) and "respuesta" in response_json:
+            return response_json["respuesta"]
+        return text_content
+    except (json.JSONDecodeError, ValueError, AttributeError):
+        return text_content
+
+
+def image_question(question: str) -> str:
+    return f"Sobre esta imagen de café: {question}"
+
+
+def build_messages(
+    question: str,
+    is_image_request: bool,
+    history: Optional[List[Dict[str, Any]]] = None
+) -> List[Dict[str, Any]]:
+    if is_image_request:
+        return [
+            {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT_IMAGE}]},
+            {"role": "user", "content": [{"type": "image"}, {"type": "text", "text": image_question(question)}]}
+        ]
+
+    # Con historial, el prompt de sistema sigue primero: la caché de prefijo y la de la sesión coinciden
+    return [
+        {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT}]},
+        *(history or []),
+        {"role": "user", "content": [{"type": "text", "text": question}]}
+    ]
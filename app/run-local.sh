@@ -50,35 +50,42 @@ mkdir -p $LOG_DIR
 
 rm -f $LOG_DIR/*.log
 
-echo -e "${GREEN}Iniciando servicios de base de datos...${NC}"
+TOOLS_MODE=${TOOLS_MODE:-http}
+export TOOLS_MODE
 
-echo -e "${YELLOW}  → Iniciando servicio de Inventario en puerto 8001...${NC}"
-cd databases/inventario
-python -m uvicorn main:app --host 0.0.0.0 --port 8001 --reload > ../../$LOG_DIR/inventario.log 2>&1 &
-INVENTORY_PID=$!
-cd ../..
-sleep 2
-
-echo -e "${YELLOW}  → Iniciando servicio de Gastos en puerto 8002...${NC}"
-cd databases/gastos
-python -m uvicorn main:app --host 0.0.0.0 --port 8002 --reload > ../../$LOG_DIR/gastos.log 2>&1 &
-EXPENSES_PID=$!
-cd ../..
-sleep 2
-
-echo -e "${YELLOW}  → Iniciando servicio de Cosecha en puerto 8003...${NC}"
-cd databases/cosecha
-python -m uvicorn main:app --host 0.0.0.0 --port 8003 --reload > ../../$LOG_DIR/cosecha.log 2>&1 &
-PRODUCTION_PID=$!
-cd ../..
-sleep 2
-
-echo -e "${YELLOW}  → Iniciando servicio de Ingresos en puerto 8004...${NC}"
-cd databases/ingresos
-python -m uvicorn main:app --host 0.0.0.0 --port 8004 --reload > ../../$LOG_DIR/ingresos.log 2>&1 &
-INCOME_PID=$!
-cd ../..
-sleep 2
+if [ "$TOOLS_MODE" = "inprocess" ]; then
+    echo -e "${GREEN}Modo inprocess: los servicios de base de datos corren dentro de la API principal${NC}"
+else
+    echo -e "${GREEN}Iniciando servicios de base de datos...${NC}"
+
+    echo -e "${YELLOW}  → Iniciando servicio de Inventario en puerto 8001...${NC}"
+    cd databases/inventario
+    python -m uvicorn databases.inventario.main:app --app-dir ../.. --host 0.0.0.0 --port 8001 --reload > ../../$LOG_DIR/inventario.log 2>&1 &
+    INVENTORY_PID=$!
+    cd ../..
+    sleep 2
+
+    echo -e "${YELLOW}  → Iniciando servicio de Gastos en puerto 8002...${NC}"
+    cd databases/gastos
+    python -m uvicorn databases.gastos.main:app --app-dir ../.. --host 0.0.0.0 --port 8002 --reload > ../../$LOG_DIR/gastos.log 2>&1 &
+    EXPENSES_PID=$!
+    cd ../..
+    sleep 2
+
+    echo -e "${YELLOW}  → Iniciando servicio de Cosecha en puerto 8003...${NC}"
+    cd databases/cosecha
+    python -m uvicorn databases.cosecha.main:app --app-dir ../.. --host 0.0.0.0 --port 8003 --reload > ../../$LOG_DIR/cosecha.log 2>&1 &
+    PRODUCTION_PID=$!
+    cd ../..
+    sleep 2
+
+    echo -e "${YELLOW}  → Iniciando servicio de Ingresos en puerto 8004...${NC}"
+    cd databases/ingresos
+    python -m uvicorn databases.ingresos.main:app --app-dir ../.. --host 0.0.0.0 --port 8004 --reload > ../../$LOG_DIR/ingresos.log 2>&1 &
+    INCOME_PID=$!
+    cd ../..
+    sleep 2
+fi
 
 echo -e "${YELLOW}  → Iniciando API principal en puerto 8000...${NC}"
 python -m uvicorn api:app --host 0.0.0.0 --port 8000 --reload > $LOG_DIR/api.log 2>&1 &
@@ -107,10 +114,12 @@ check_service() {
 sleep 2
 
 ALL_GOOD=true
-check_service 8001 "Servicio Inventario" || ALL_GOOD=false
-check_service 8002 "Servicio Gastos" || ALL_GOOD=false
-check_service 8003 "Servicio Cosecha" || ALL_GOOD=false
-check_service 8004 "Servicio Ingresos" || ALL_GOOD=false
+if [ "$TOOLS_MODE" != "inprocess" ]; then
+    check_service 8001 "Servicio Inventario" || ALL_GOOD=false
+    check_service 8002 "Servicio Gastos" || ALL_GOOD=false
+    check_service 8003 "Servicio Cosecha" || ALL_GOOD=false
+    check_service 8004 "Servicio Ingresos" || ALL_GOOD=false
+fi
 check_service 8000 "API Principal" || ALL_GOOD=false
 check_service 8501 "Interfaz Web" || ALL_GOOD=false
 
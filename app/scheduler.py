@@ -0,0 +1,178 @@
+#app/scheduler.py
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "4"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "25"))
+BATCH_TOKEN_BUCKET = int(os.getenv("BATCH_TOKEN_BUCKET", "64"))
+
+
+@dataclass
+class InferenceRequest:
+    """Una solicitud de generación en espera de ser agrupada"""
+    modality: str
+    messages: List[Dict[str, Any]]
+    max_tokens: int
+    image: Any = None
+    # Turno de una conversación: se genera solo, sobre la caché KV de su sesión
+    session: Any = None
+    # Respuesta en streaming: el trabajo ya preparado por el motor, que escribe en su streamer
+    job: Optional[Callable[[], None]] = None
+    future: Optional[asyncio.Future] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class BatchScheduler:
+    """Agrupa solicitudes compatibles (misma modalidad, max_tokens similar) en lotes"""
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[InferenceRequest]], List[Any]],
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_wait_ms: float = BATCH_MAX_WAIT_MS,
+        token_bucket: int = BATCH_TOKEN_BUCKET,
+        executor: Optional[Executor] = None,
+    ):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.token_bucket = max(1, token_bucket)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Dict[Tuple[str, int], List[InferenceRequest]] = {}
+        self._in_flight = 0
+        self._task: Optional[asyncio.Task] = None
+
+        self.batches_run = 0
+        self.requests_served = 0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def group_key(self, request: InferenceRequest) -> Tuple[str, int]:
+        if request.session is not None:
+            return "session", id(request)
+        if request.job is not None:
+            return "stream", id(request)
+        bucket = (max(request.max_tokens, 1) - 1) // self.token_bucket
+        return request.modality, bucket
+
+    async def submit(self, modality: str, messages, max_tokens: int, image=None, cancel_event=None, session=None, job=None):
+        """Encola una solicitud y espera el resultado de su lote"""
+        if self._queue is None:
+            raise RuntimeError("El planificador no está iniciado")
+
+        request = InferenceRequest(
+            modality=modality,
+            messages=messages,
+            max_tokens=max_tokens,
+            image=image,
+            session=session,
+            job=job,
+            future=asyncio.get_running_loop().create_future(),
+            cancel_event=cancel_event or threading.Event(),
+        )
+        await self._queue.put(request)
+        return await request.future
+
+    @property
+    def queue_depth(self) -> int:
+        queued = self._queue.qsize() if self._queue is not None else 0
+        pending = sum(len(group) for group in self._pending.values())
+        return queued + pending + self._in_flight
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth,
+            "in_flight": self._in_flight,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches_run": self.batches_run,
+            "requests_served": self.requests_served,
+        }
+
+    def _add(self, request: InferenceRequest):
+        if request.future.done() or request.cancel_event.is_set():
+            return
+        self._pending.setdefault(self.group_key(request), []).append(request)
+
+    def _drain_nowait(self):
+        while True:
+            try:
+                self._add(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return
+
+    def _oldest_group(self) -> Tuple[str, int]:
+        return min(self._pending, key=lambda key: self._pending[key][0].enqueued_at)
+
+    async def _loop(self):
+        while True:
+            if not self._pending:
+                self._add(await self._queue.get())
+                continue
+
+            self._drain_nowait()
+            key = self._oldest_group()
+            group = self._pending[key]
+            # Un turno de conversación o un stream no se agrupa con nada: no tiene sentido esperar compañeros
+            limit = 1 if key[0] in ("session", "stream") else self.max_batch_size
+
+            while len(group) < limit:
+                remaining = group[0].enqueued_at + self.max_wait - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                self._add(request)
+
+            batch = group[:limit]
+            del group[:limit]
+            if not group:
+                del self._pending[key]
+
+            batch = [
+                request for request in batch
+                if not request.future.done() and not request.cancel_event.is_set()
+            ]
+            if batch:
+                await self._execute(batch)
+
+    async def _execute(self, batch: List[InferenceRequest]):
+        self._in_flight += len(batch)
+        try:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self.executor, self.run_batch, batch)
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+        else:
+            for request, result in zip(batch, results):
+                if not request.future.done():
+                    request.future.set_result(result)
+            self.batches_run += 1
+            self.requests_served += len(batch)
+        finally:
+            self._in_flight -= len(batch)
@@ -0,0 +1,167 @@
+#app/sessions.py
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+
+SESSIONS_ENABLED = os.getenv("SESSIONS_ENABLED", "1") == "1"
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "64"))
+# Conversaciones sin actividad durante este tiempo se descartan por completo
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", str(30 * 60)))
+# Tokens de contexto por conversación (prompt + respuesta); los turnos más viejos se recortan
+SESSION_MAX_TOKENS = int(os.getenv("SESSION_MAX_TOKENS", "2048"))
+# Memoria total para cachés KV; al superarla se liberan las de las conversaciones menos recientes
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SESSION_MEMORY_BUDGET_MB", "1024"))
+SESSION_ID_MAX_LENGTH = 128
+
+
+@dataclass
+class ConversationSession:
+    """Historial de una conversación y la caché KV de todo lo ya codificado.
+
+    cache y token_ids solo los escribe el hilo del worker; la caché se puede soltar
+    en cualquier momento y el siguiente turno vuelve a codificar el historial.
+    """
+    session_id: str
+    max_tokens: int = SESSION_MAX_TOKENS
+    turns: List[Dict[str, str]] = field(default_factory=list)
+    cache: Any = None
+    token_ids: Any = None
+    kv_bytes: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    reused_tokens: int = 0
+    trimmed_turns: int = 0
+
+    @property
+    def token_count(self) -> int:
+        return 0 if self.token_ids is None else int(self.token_ids.shape[0])
+
+    def history(self) -> List[Dict[str, Any]]:
+        """Turnos anteriores en el formato de mensajes de la plantilla de chat"""
+        messages = []
+        for turn in self.turns:
+            messages.append({"role": "user", "content": [{"type": "text", "text": turn["question"]}]})
+            messages.append({"role": "assistant", "content": [{"type": "text", "text": turn["answer"]}]})
+        return messages
+
+    def add_turn(self, question: str, answer: str):
+        self.turns.append({"question": question, "answer": answer})
+        self.last_used = time.monotonic()
+
+    def drop_cache(self):
+        self.cache = None
+        self.token_ids = None
+        self.kv_bytes = 0
+
+
+class SessionStore:
+    """Conversaciones por session_id con LRU, vencimiento por inactividad y un presupuesto de memoria para las cachés KV"""
+
+    def __init__(
+        self,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        ttl_s: float = SESSION_TTL_S,
+        max_tokens: int = SESSION_MAX_TOKENS,
+        memory_budget_mb: float = SESSION_MEMORY_BUDGET_MB,
+    ):
+        self.max_sessions = max(1, max_sessions)
+        self.ttl_s = ttl_s
+        self.max_tokens = max(1, max_tokens)
+        self.budget_bytes = int(memory_budget_mb * 1024 * 1024)
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.caches_released = 0
+
+    def _expire(self):
+        if self.ttl_s <= 0:
+            return
+        now = time.monotonic()
+        # El orden es el de uso: las inactivas están al principio
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.ttl_s:
+                break
+            self._sessions.popitem(last=False)
+            self.expired += 1
+
+    def get(self, session_id: str) -> ConversationSession:
+        """Devuelve la conversación (o una nueva) y la marca como la más reciente"""
+        if not session_id or len(session_id) > SESSION_ID_MAX_LENGTH:
+            raise ValueError(f"session_id debe tener entre 1 y {SESSION_ID_MAX_LENGTH} caracteres")
+
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = ConversationSession(session_id=session_id, max_tokens=self.max_tokens)
+                self._sessions[session_id] = session
+                self.created += 1
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evicted += 1
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def drop(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def kv_bytes(self) -> int:
+        return sum(session.kv_bytes for session in self._sessions.values())
+
+    def enforce_budget(self):
+        """Suelta cachés KV, de la menos a la más reciente, hasta entrar en el presupuesto; el historial se conserva"""
+        with self._lock:
+            total = self.kv_bytes()
+            for session in list(self._sessions.values()):
+                if total <= self.budget_bytes:
+                    break
+                # Una conversación generando ahora mismo todavía usa su caché
+                if session.cache is None or session.lock.locked():
+                    continue
+                total -= session.kv_bytes
+                session.drop_cache()
+                self.caches_released += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            "sessions": len(sessions),
+            "cached_sessions": sum(1 for session in sessions if session.cache is not None),
+            "max_sessions": self.max_sessions,
+            "ttl_s": self.ttl_s,
+            "max_tokens": self.max_tokens,
+            "kv_mb": round(sum(session.kv_bytes for session in sessions) / (1024 * 1024), 2),
+            "budget_mb": round(self.budget_bytes / (1024 * 1024), 2),
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "caches_released": self.caches_released,
+            "reused_tokens": sum(session.reused_tokens for session in sessions),
+            "trimmed_turns": sum(session.trimmed_turns for session in sessions),
+        }
+
+    def describe(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        return {
+            "session_id": session.session_id,
+            "turns": len(session.turns),
+            "tokens": session.token_count,
+            "cached": session.cache is not None,
+            "kv_mb": round(session.kv_bytes / (1024 * 1024), 2),
+            "idle_s": round(time.monotonic() - session.last_used, 1),
+        }
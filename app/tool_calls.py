@@ -0,0 +1,217 @@
+#app/tool_calls.py
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from observability import get_logger
+
+
+# Restringe la decodificación al esquema de las herramientas en cuanto la respuesta empieza con "{"
+TOOL_CALL_CONSTRAINED = os.getenv("TOOL_CALL_CONSTRAINED", "1") == "1"
+
+# Herramientas que el modelo puede llamar y sus argumentos, en el orden del prompt de sistema
+TOOL_SCHEMAS: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "inventario_consulta": (("producto", "text"),),
+    "gastos_consulta": (("mes", "digits"), ("año", "digits")),
+}
+
+TOOL_CALL_HEAD = '{"tool": "'
+TOOL_CALL_TAIL = '"}'
+
+# Caracteres que no pueden aparecer en un valor: cerrarían el string JSON o romperían "clave=valor,..."
+FORBIDDEN_VALUE_CHARS = frozenset('"\\,={}<>\n\r\t')
+VALUE_MAX_CHARS = {"text": 60, "digits": 4}
+
+logger = get_logger("tool_calls")
+
+
+def is_value_char(kind: str, char: str) -> bool:
+    if kind == "digits":
+        return "0" <= char <= "9"
+    return char not in FORBIDDEN_VALUE_CHARS
+
+
+def tool_call_template(tool: str) -> List[Tuple[str, str]]:
+    """Partes ("literal", texto) y ("value", tipo) de la única forma válida de llamar a la herramienta"""
+    parts = [("literal", f'{TOOL_CALL_HEAD}{tool}", "argumentos": "')]
+    for i, (key, kind) in enumerate(TOOL_SCHEMAS[tool]):
+        parts.append(("literal", f"{',' if i else ''}{key}="))
+        parts.append(("value", kind))
+    parts.append(("literal", TOOL_CALL_TAIL))
+    return parts
+
+
+TEMPLATES = {tool: tool_call_template(tool) for tool in TOOL_SCHEMAS}
+
+
+@dataclass
+class Continuation:
+    """Lo que puede seguir a una llamada parcial: el resto de algún literal o más caracteres de un valor"""
+    literals: Tuple[str, ...] = ()
+    values: Tuple[str, ...] = ()
+    complete: bool = False
+
+
+def _continue_template(parts: List[Tuple[str, str]], text: str) -> Optional[Continuation]:
+    pos = 0
+    for i, (part, content) in enumerate(parts):
+        remaining = text[pos:]
+        if part == "literal":
+            if remaining.startswith(content):
+                pos += len(content)
+                continue
+            if content.startswith(remaining):
+                return Continuation(literals=(content[len(remaining):],))
+            return None
+
+        # Todo valor va seguido de un literal
+        end = pos
+        while end < len(text) and is_value_char(content, text[end]):
+            end += 1
+        length = end - pos
+        if end == len(text):
+            values = (content,) if length < VALUE_MAX_CHARS[content] else ()
+            literals = (parts[i + 1][1],) if length else ()
+            return Continuation(literals=literals, values=values)
+        if not length:
+            return None
+        pos = end
+    return Continuation(complete=True)
+
+
+def continuation(text: str) -> Optional[Continuation]:
+    """Une las continuaciones válidas de `text` (el JSON generado hasta ahora) para todas las herramientas; None si ninguna encaja"""
+    literals: List[str] = []
+    values: List[str] = []
+    for parts in TEMPLATES.values():
+        result = _continue_template(parts, text)
+        if result is None:
+            continue
+        if result.complete:
+            return result
+        literals.extend(literal for literal in result.literals if literal not in literals)
+        values.extend(value for value in result.values if value not in values)
+    if not literals and not values:
+        return None
+    return Continuation(literals=tuple(literals), values=tuple(values))
+
+
+def parse_argumentos(argumentos_raw: Any) -> Optional[Dict[str, Any]]:
+    """'mes=1,año=2024' o un objeto -> dict; un valor suelto se toma como producto"""
+    if argumentos_raw is None:
+        return None
+    if isinstance(argumentos_raw, dict):
+        return argumentos_raw
+    if isinstance(argumentos_raw, str):
+        argumentos = {}
+        for arg in argumentos_raw.split(","):
+            if "=" in arg:
+                key, value = arg.strip().split("=", 1)
+                argumentos[key.strip()] = value.strip()
+            else:
+                argumentos["producto"] = arg.strip()
+        return argumentos
+    return {"producto": str(argumentos_raw)}
+
+
+class ToolCallParser:
+    """Lee una respuesta a medida que llega y reconoce la llamada a herramienta sin esperar al texto completo.
+
+    Solo mira el primer objeto JSON: lo que venga después de cerrarlo se ignora. Una llamada cortada
+    por max_tokens o con argumentos vacíos no se ejecuta; `rejected` dice por qué.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.is_tool_call: Optional[bool] = None
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        self.rejected: Optional[str] = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._scanned = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, chunk: str) -> "ToolCallParser":
+        self.text += chunk
+        if self.is_tool_call is None:
+            stripped = self.text.lstrip()
+            if not stripped:
+                return self
+            self.is_tool_call = stripped.startswith("{")
+            self.start = self._scanned = len(self.text) - len(stripped)
+        if self.is_tool_call and self.end is None:
+            self._scan()
+        return self
+
+    def _scan(self):
+        for index in range(self._scanned, len(self.text)):
+            char = self.text[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = index + 1
+                    break
+        self._scanned = len(self.text) if self.end is None else self.end
+
+    def json_text(self) -> Optional[str]:
+        """El objeto JSON tal como llegó, o cerrado a la fuerza si quedó incompleto"""
+        if not self.is_tool_call:
+            return None
+        if self.complete:
+            return self.text[self.start:self.end]
+        body = self.text[self.start:]
+        if self._escaped:
+            body = body[:-1]
+        if self._in_string:
+            body += '"'
+        return body + "}" * self._depth
+
+    def result(self) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        body = self.json_text()
+        if body is None:
+            return None, None
+        try:
+            response_json = json.loads(body)
+        except ValueError as e:
+            logger.debug("Llamada a herramienta ilegible", extra={"error": str(e), "response": self.text})
+            return None, None
+        if not isinstance(response_json, dict):
+            return None, None
+        argumentos = parse_argumentos(response_json.get("argumentos"))
+        if argumentos is None:
+            return None, None
+        tool = response_json.get("tool")
+        # Cerrada a la fuerza: "producto=" podría ser "producto=fertilizante" sin cortar
+        if not self.complete:
+            return self._reject("truncated", tool)
+        missing = [key for key, _ in TOOL_SCHEMAS.get(tool, ()) if not str(argumentos.get(key, "")).strip()]
+        if missing:
+            return self._reject("missing_argument", tool, missing)
+        return tool, argumentos
+
+    def _reject(self, reason: str, tool: Any, missing: Optional[List[str]] = None) -> Tuple[None, None]:
+        self.rejected = reason
+        logger.info("Llamada a herramienta descartada", extra={"reason": reason, "tool": tool, "missing": missing})
+        return None, None
+
+
+def parse_tool_call(response: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """(herramienta, argumentos) si la respuesta es una llamada a herramienta; (None, None) si es texto"""
+    return ToolCallParser().feed(response).result()
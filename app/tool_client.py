@@ -0,0 +1,201 @@
+#app/tool_client.py
+import asyncio
+import bisect
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import httpx
+
+from observability import observe_tool_call
+
+
+TOOL_ATTEMPT_TIMEOUT_S = float(os.getenv("TOOL_ATTEMPT_TIMEOUT_S", "1.0"))
+TOOL_DEADLINE_S = float(os.getenv("TOOL_DEADLINE_S", "3.0"))
+TOOL_RETRIES = int(os.getenv("TOOL_RETRIES", "2"))
+TOOL_BACKOFF_S = float(os.getenv("TOOL_BACKOFF_S", "0.05"))
+TOOL_MAX_CONNECTIONS = int(os.getenv("TOOL_MAX_CONNECTIONS", "32"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_S = float(os.getenv("BREAKER_RESET_S", "30"))
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class ToolError(Exception):
+    """Falla definitiva al consultar un microservicio"""
+
+
+class CircuitBreaker:
+    """Tras varios fallos seguidos corta las llamadas y deja pasar una de prueba pasado el tiempo de reinicio"""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, reset_timeout_s: float = BREAKER_RESET_S):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout_s:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def end_trial(self):
+        """Libera la prueba aunque no haya terminado (cancelada o con un error inesperado); la siguiente llamada prueba de nuevo"""
+        self.trial_in_flight = False
+
+
+class LatencyHistogram:
+    """Histograma de latencias en milisegundos con percentiles sobre las muestras recientes"""
+
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS, window: int = 1024):
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000.0
+        self.counts[bisect.bisect_left(self.buckets_ms, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.recent.append(ms)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{bound}ms" for bound in self.buckets_ms] + ["le_inf"]
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else None,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class ToolClient:
+    """Cliente HTTP asíncrono compartido para los microservicios de inventario, gastos, cosecha e ingresos"""
+
+    def __init__(self, services: Dict[str, str]):
+        self.services = services
+        self.breakers = {name: CircuitBreaker() for name in services}
+        self.latency = {name: LatencyHistogram() for name in services}
+        self.errors = {name: 0 for name in services}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=TOOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=TOOL_MAX_CONNECTIONS,
+                    keepalive_expiry=60.0
+                ),
+                timeout=TOOL_ATTEMPT_TIMEOUT_S
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_json(self, service: str, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """GET con plazo total, reintentos acotados con backoff y circuit breaker por servicio"""
+        if self._client is None:
+            await self.start()
+
+        breaker = self.breakers[service]
+        trial = breaker.state == "half_open"
+        if not breaker.allow():
+            raise ToolError(f"servicio {service} no disponible (circuito abierto)")
+        try:
+            return await self._get_with_retries(service, path, params, breaker)
+        finally:
+            if trial:
+                breaker.end_trial()
+
+    async def _get_with_retries(
+        self, service: str, path: str, params: Optional[Dict[str, Any]], breaker: CircuitBreaker
+    ) -> Any:
+        call_started = time.monotonic()
+        deadline = call_started + TOOL_DEADLINE_S
+        last_error: Optional[Exception] = None
+
+        for attempt in range(TOOL_RETRIES + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            started = time.monotonic()
+            try:
+                response = await self._client.get(
+                    f"{self.services[service]}{path}",
+                    params=params,
+                    timeout=min(TOOL_ATTEMPT_TIMEOUT_S, remaining)
+                )
+                self.latency[service].observe(time.monotonic() - started)
+
+                if response.status_code < 500:
+                    breaker.record_success()
+                    observe_tool_call(service, call_started, ok=response.status_code < 400)
+                    response.raise_for_status()
+                    return response.json()
+                last_error = ToolError(f"{service} respondió {response.status_code}")
+
+            except httpx.HTTPStatusError as e:
+                raise ToolError(f"{service} respondió {e.response.status_code}") from e
+            except httpx.TransportError as e:
+                self.latency[service].observe(time.monotonic() - started)
+                last_error = e
+
+            if attempt < TOOL_RETRIES:
+                backoff = TOOL_BACKOFF_S * (2 ** attempt) * (0.5 + random.random())
+                await asyncio.sleep(min(backoff, max(0.0, deadline - time.monotonic())))
+
+        self.errors[service] += 1
+        breaker.record_failure()
+        observe_tool_call(service, call_started, ok=False)
+        raise ToolError(f"{service} no respondió: {last_error}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "url": url,
+                "circuit": self.breakers[name].state,
+                "errors": self.errors[name],
+                "latency": self.latency[name].snapshot(),
+            }
+            for name, url in self.services.items()
+        }
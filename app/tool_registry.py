@@ -0,0 +1,106 @@
+#app/tool_registry.py
+import importlib
+import inspect
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+
+from observability import get_logger, observe_tool_call
+from tool_client import LatencyHistogram, ToolError
+
+
+# "http": microservicios separados (run-local.sh, docker-compose); "inprocess": todo en el proceso de la API
+TOOLS_MODE = os.getenv("TOOLS_MODE", "http")
+
+# Servicio -> paquete dentro de app/databases
+SERVICE_MODULES = {
+    "inventario": "databases.inventario",
+    "gastos": "databases.gastos",
+    "cosecha": "databases.cosecha",
+    "ingresos": "databases.ingresos",
+}
+
+logger = get_logger("tools")
+
+
+def _with_session(endpoint: Callable[..., Any], session_factory) -> Callable[..., Any]:
+    """Abre y cierra la sesión que normalmente inyecta Depends(get_db)"""
+    if "db" not in inspect.signature(endpoint).parameters:
+        return endpoint
+
+    def handler(**params):
+        db = session_factory()
+        try:
+            return endpoint(db=db, **params)
+        finally:
+            db.close()
+
+    return handler
+
+
+class InProcessToolClient:
+    """Misma interfaz que ToolClient, pero llama directamente a los endpoints GET de los servicios cargados en este proceso"""
+
+    def __init__(self):
+        self.handlers: Dict[Tuple[str, str], Callable[..., Any]] = {}
+        self.latency: Dict[str, LatencyHistogram] = {}
+        self.errors: Dict[str, int] = {}
+
+    def register_service(self, service: str, service_app: FastAPI, session_factory):
+        for route in service_app.routes:
+            if isinstance(route, APIRoute) and "GET" in route.methods and route.include_in_schema:
+                self.handlers[(service, route.path)] = _with_session(route.endpoint, session_factory)
+        self.latency.setdefault(service, LatencyHistogram())
+        self.errors.setdefault(service, 0)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_json(self, service: str, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        handler = self.handlers.get((service, path))
+        if handler is None:
+            raise ToolError(f"{service} no tiene el endpoint {path}")
+
+        started = time.monotonic()
+        try:
+            # Los endpoints de los servicios son síncronos (SQLAlchemy); no bloquean el event loop
+            result = await run_in_threadpool(handler, **(params or {}))
+        except Exception as e:
+            self.errors[service] += 1
+            observe_tool_call(service, started, ok=False)
+            raise ToolError(f"{service} falló: {e}") from e
+        finally:
+            self.latency[service].observe(time.monotonic() - started)
+        observe_tool_call(service, started, ok=True)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "mode": "inprocess",
+                "endpoints": sorted(path for service, path in self.handlers if service == name),
+                "errors": self.errors[name],
+                "latency": self.latency[name].snapshot(),
+            }
+            for name in self.latency
+        }
+
+
+def build_inprocess_client(app: FastAPI) -> InProcessToolClient:
+    """Carga los servicios en este proceso, los monta bajo /<servicio> y registra sus endpoints como herramientas"""
+    client = InProcessToolClient()
+    for service, package in SERVICE_MODULES.items():
+        service_main = importlib.import_module(f"{package}.main")
+        service_database = importlib.import_module(f"{package}.database")
+        # Las rutas siguen disponibles por HTTP (ingesta por lotes, Swagger) en el mismo puerto de la API
+        app.mount(f"/{service}", service_main.app)
+        client.register_service(service, service_main.app, service_database.SessionLocal)
+        logger.info("Servicio cargado en el proceso de la API", extra={"service": service})
+    return client
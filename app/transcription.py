@@ -0,0 +1,169 @@
+#app/transcription.py
+import asyncio
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from observability import get_logger
+from tool_client import LatencyHistogram
+
+
+TRANSCRIPTION_ENABLED = os.getenv("TRANSCRIPTION_ENABLED", "1") == "1"
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "cpu")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_BEAM_SIZE = int(os.getenv("WHISPER_BEAM_SIZE", "5"))
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE", "es")
+WHISPER_VAD = os.getenv("WHISPER_VAD", "1") == "1"
+WHISPER_VAD_MIN_SILENCE_MS = int(os.getenv("WHISPER_VAD_MIN_SILENCE_MS", "500"))
+# Transcripciones simultáneas; cada una usa su propio worker de CTranslate2
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", "2"))
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", "0"))
+# Solicitudes en espera además de las que se están transcribiendo; las demás reciben 503
+WHISPER_MAX_QUEUE = int(os.getenv("WHISPER_MAX_QUEUE", "8"))
+AUDIO_MAX_BYTES = int(os.getenv("AUDIO_MAX_BYTES", str(10 * 1024 * 1024)))
+
+SAMPLING_RATE = 16000
+
+logger = get_logger("transcription")
+
+
+class TranscriptionError(Exception):
+    """No se pudo transcribir el audio; status_code indica cómo responder"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Transcriber:
+    """Un solo modelo Whisper compartido por todas las interfaces, con un pool acotado de transcripciones"""
+
+    def __init__(
+        self,
+        model_name: str = WHISPER_MODEL,
+        device: str = WHISPER_DEVICE,
+        compute_type: str = WHISPER_COMPUTE_TYPE,
+        workers: int = WHISPER_WORKERS,
+        max_queue: int = WHISPER_MAX_QUEUE,
+    ):
+        self.model_name = model_name
+        self.device = device
+        self.compute_type = compute_type
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="whisper")
+        self.model = None
+        self.load_error: Optional[str] = None
+        self._capacity = self.workers + max(0, max_queue)
+        self._active = 0
+
+        self.latency = {stage: LatencyHistogram() for stage in ("decode", "transcribe", "total")}
+        self.transcribed = 0
+        self.rejected = 0
+        self.audio_seconds = 0.0
+        self.speech_seconds = 0.0
+
+    def load(self):
+        """Carga el modelo; se llama una vez en un hilo al iniciar la API"""
+        try:
+            from faster_whisper import WhisperModel
+            self.model = WhisperModel(
+                self.model_name,
+                device=self.device,
+                compute_type=self.compute_type,
+                cpu_threads=WHISPER_CPU_THREADS,
+                num_workers=self.workers,
+            )
+            logger.info("Whisper cargado", extra={
+                "model": self.model_name, "device": self.device, "compute_type": self.compute_type
+            })
+        except Exception as e:
+            self.load_error = str(e)
+            logger.error("No se pudo cargar Whisper", extra={"error": str(e)})
+
+    def _transcribe(self, data: bytes, language: Optional[str], beam_size: int) -> Dict[str, Any]:
+        from faster_whisper.audio import decode_audio
+
+        started = time.perf_counter()
+        try:
+            # PyAV decodifica desde memoria: sin archivos temporales
+            audio = decode_audio(io.BytesIO(data), sampling_rate=SAMPLING_RATE)
+        except Exception as e:
+            raise TranscriptionError(f"No se pudo leer el audio: {e}", status_code=415)
+        decoded = time.perf_counter()
+
+        segments, info = self.model.transcribe(
+            audio,
+            beam_size=beam_size,
+            language=language or None,
+            vad_filter=WHISPER_VAD,
+            vad_parameters={"min_silence_duration_ms": WHISPER_VAD_MIN_SILENCE_MS},
+        )
+        # Los segmentos son un generador: la transcripción ocurre al recorrerlos
+        text = " ".join(segment.text.strip() for segment in segments).strip()
+        finished = time.perf_counter()
+
+        duration = len(audio) / SAMPLING_RATE
+        speech = getattr(info, "duration_after_vad", None) or duration
+        return {
+            "text": text,
+            "language": info.language,
+            "duration_s": round(duration, 2),
+            "speech_s": round(speech, 2),
+            "timings_ms": {
+                "decode": round((decoded - started) * 1000.0, 2),
+                "transcribe": round((finished - decoded) * 1000.0, 2),
+                "total": round((finished - started) * 1000.0, 2),
+            },
+        }
+
+    async def transcribe(
+        self,
+        data: bytes,
+        language: Optional[str] = WHISPER_LANGUAGE,
+        beam_size: int = WHISPER_BEAM_SIZE,
+    ) -> Dict[str, Any]:
+        if self.model is None:
+            raise TranscriptionError(self.load_error or "Modelo de transcripción aún cargando", status_code=503)
+        if not data:
+            raise TranscriptionError("El audio está vacío")
+        if len(data) > AUDIO_MAX_BYTES:
+            raise TranscriptionError(f"El audio supera el máximo de {AUDIO_MAX_BYTES // (1024 * 1024)} MB", status_code=413)
+        if self._active >= self._capacity:
+            self.rejected += 1
+            raise TranscriptionError("Demasiadas transcripciones en curso, intenta de nuevo", status_code=503)
+
+        self._active += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, self._transcribe, data, language, max(1, beam_size))
+        finally:
+            self._active -= 1
+
+        for stage, ms in result["timings_ms"].items():
+            self.latency[stage].observe(ms / 1000.0)
+        self.transcribed += 1
+        self.audio_seconds += result["duration_s"]
+        self.speech_seconds += result["speech_s"]
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "loaded": self.model is not None,
+            "load_error": self.load_error,
+            "device": self.device,
+            "compute_type": self.compute_type,
+            "workers": self.workers,
+            "active": self._active,
+            "transcribed": self.transcribed,
+            "rejected": self.rejected,
+            "audio_seconds": round(self.audio_seconds, 2),
+            "speech_seconds": round(self.speech_seconds, 2),
+            "latency": {stage: histogram.snapshot() for stage, histogram in self.latency.items()},
+        }
@@ -1,13 +1,20 @@
 #app/web.py
 import streamlit as st
-import tempfile
+import hashlib
 import time
 from audio_recorder_streamlit import audio_recorder
 import requests
 import io
 import os
-from faster_whisper import WhisperModel
-from PIL import Image
+import json
+import uuid
+from PIL import Image, ImageOps
+
+from chat_history import CHAT_PAGE_SIZE, CHAT_RECENT_MESSAGES, ChatHistory
+from observability import configure_logging, get_logger
+
+configure_logging()
+logger = get_logger("web")
 
 st.set_page_config(
     page_title="CaficulBot",
@@ -15,50 +22,75 @@ st.set_page_config(
 )
 
 API_URL = "http://localhost:8000"
-
-@st.cache_resource
-def load_whisper_model():
-    """Cargar modelo Whisper una sola vez"""
-    return WhisperModel("small", device="cpu", compute_type="int8")
-
-whisper_model = load_whisper_model()
+# Espera estimada a partir de la cual se avisa al usuario antes de enviar la pregunta
+QUEUE_NOTICE_S = 3
+# La API reduce las fotos a 768 px: se envían ya reducidas y recomprimidas, no la foto original
+UPLOAD_MAX_SIDE = int(os.getenv("UPLOAD_MAX_SIDE", "768"))
+UPLOAD_JPEG_QUALITY = int(os.getenv("UPLOAD_JPEG_QUALITY", "85"))
+THUMBNAIL_SIDE = 200
 
 def transcribe_audio(audio_bytes):
-    """Transcribe audio usando Whisper local"""
+    """Transcribe audio con el modelo Whisper compartido de la API"""
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            tmp_file.write(audio_bytes)
-            tmp_file_path = tmp_file.name
-        
-        segments, info = whisper_model.transcribe(
-            tmp_file_path, 
-            beam_size=5,
-            language="es"
+        response = requests.post(
+            f"{API_URL}/transcribe",
+            files={"audio": ("audio.wav", audio_bytes, "audio/wav")},
+            timeout=120
         )
+        if response.status_code != 200:
+            try:
+                detail = response.json().get("detail", response.text)
+            except ValueError:
+                detail = response.text
+            return f"Error al transcribir: {detail}"
         
-        transcript = " ".join([segment.text.strip() for segment in segments])
+        transcript = response.json().get("text", "")
         
-        print(f"[DEBUG] Audio transcrito: '{transcript}'")
-        
-        os.unlink(tmp_file_path)
+        logger.debug("Audio transcrito", extra={"text": transcript})
         
         if not transcript or transcript.isspace():
             return "No se pudo transcribir el audio. Por favor, intenta de nuevo."
         
         return transcript
     except Exception as e:
-        if 'tmp_file_path' in locals() and os.path.exists(tmp_file_path):
-            os.unlink(tmp_file_path)
         return f"Error al transcribir: {str(e)}"
 
+def transcribe_once(audio_bytes):
+    """Cada rerun de Streamlit vuelve a entregar la misma grabación: se transcribe una sola vez"""
+    audio_hash = hashlib.sha1(audio_bytes).hexdigest()
+    cached = st.session_state.get("last_transcription")
+    if cached and cached[0] == audio_hash:
+        return cached[1]
+    transcript = transcribe_audio(audio_bytes)
+    if not transcript.startswith("Error"):
+        st.session_state.last_transcription = (audio_hash, transcript)
+    return transcript
+
+def iter_sse_events(response):
+    """Recorre los eventos Server-Sent Events de una respuesta en streaming"""
+    event, data = None, []
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if event is not None:
+                yield event, json.loads("\n".join(data)) if data else {}
+            event, data = None, []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
 def query_api(question, image=None, max_tokens=200):
-    """Consultar la API de FastAPI"""
+    """Consultar la API de FastAPI y entregar la respuesta a medida que se genera"""
     try:
-        print(f"[DEBUG] Enviando pregunta a la API: '{question}'")
+        logger.debug("Enviando pregunta a la API", extra={"question": question})
         
         data = {
             "question": question,
-            "max_tokens": max_tokens
+            "max_tokens": max_tokens,
+            # La API guarda el historial y la caché de la conversación: solo se envía la pregunta nueva
+            "session_id": st.session_state.session_id
         }
         
         files = None
@@ -69,31 +101,110 @@ def query_api(question, image=None, max_tokens=200):
             else:
                 image_bytes = image
             
-            print(f"[DEBUG] Tamaño de imagen a enviar: {len(image_bytes)} bytes")
+            logger.debug("Imagen a enviar", extra={"bytes": len(image_bytes)})
             
             files = {
                 "image": ("image.jpg", io.BytesIO(image_bytes), "image/jpeg")
             }
         
-        response = requests.post(
-            f"{API_URL}/ask",
-            data=data,
-            files=files
-        )
-        
-        print(f"[DEBUG] Respuesta status: {response.status_code}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            answer = result["answer"]
-            print(f"[DEBUG] Respuesta del modelo: '{answer[:100]}...'")
-            print(f"[DEBUG] Imagen procesada: {result.get('has_image', False)}")
-            return answer
-        else:
-            return f"Error en la API: {response.status_code} - {response.text}"
+        with requests.post(f"{API_URL}/ask/stream", data=data, files=files, stream=True) as response:
+            logger.debug("Respuesta de la API", extra={"status": response.status_code})
             
+            if response.status_code == 429:
+                # Servidor saturado: la API indica en cuánto tiempo reintentar
+                yield response.json().get("answer", "El servidor está ocupado. Intenta de nuevo en unos segundos.")
+                return
+            if response.status_code != 200:
+                yield f"Error en la API: {response.status_code} - {response.text}"
+                return
+            
+            response.encoding = "utf-8"
+            streamed = False
+            for event, payload in iter_sse_events(response):
+                if event == "token":
+                    streamed = True
+                    yield payload["text"]
+                elif event == "tool":
+                    yield ("\n\n" if streamed else "") + payload["answer"]
+                    streamed = True
+                elif event == "done":
+                    logger.info("Respuesta del modelo", extra={
+                        "answer": payload["answer"][:100],
+                        "has_image": payload.get("has_image", False),
+                        "cached": payload.get("cached", False)
+                    })
+                    if not streamed:
+                        yield payload["answer"]
+                elif event == "error":
+                    yield payload.get("answer", "Error en la API")
+            
+    except Exception as e:
+        yield f"Error al conectar con la API: {str(e)}"
+
+def queue_notice(kind):
+    """Aviso de espera si hay cola para este tipo de pregunta; None si se atiende enseguida"""
+    try:
+        response = requests.get(
+            f"{API_URL}/ask/queue",
+            params={"session_id": st.session_state.session_id},
+            timeout=2
+        )
+        status = response.json()
+    except (requests.RequestException, ValueError):
+        return None
+    wait = status.get("estimated_wait_s", {}).get(kind, 0)
+    if wait < QUEUE_NOTICE_S:
+        return None
+    return f"⏳ Hay {status['waiting'][kind]} preguntas en espera; tiempo estimado ~{round(wait)} s."
+
+def stream_answer(container, question, image_bytes=None, thumbnail=None):
+    """Muestra la pregunta y la respuesta en el chat mientras llega; devuelve el texto completo"""
+    with container:
+        with st.chat_message("user"):
+            if image_bytes is not None:
+                st.write(f"📷 Foto enviada con pregunta: {question}")
+                if thumbnail is not None:
+                    st.image(thumbnail, width=THUMBNAIL_SIDE)
+            else:
+                st.write(question)
+        with st.chat_message("assistant"):
+            notice = queue_notice("image" if image_bytes is not None else "text")
+            if notice:
+                st.caption(notice)
+            response = st.write_stream(query_api(question, image_bytes))
+    return response if isinstance(response, str) else "".join(str(part) for part in response)
+
+def compress_for_upload(image_bytes):
+    """Reduce la foto al tamaño que usa el modelo y la recomprime en JPEG; si no se puede leer, se envía tal cual"""
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        # En JPEG el decodificador reduce por 1/2, 1/4 u 1/8 sin decodificar la foto completa
+        image.draft("RGB", (UPLOAD_MAX_SIDE, UPLOAD_MAX_SIDE))
+        # Al recomprimir se pierde el EXIF: la orientación se aplica a los píxeles
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((UPLOAD_MAX_SIDE, UPLOAD_MAX_SIDE), Image.Resampling.BICUBIC, reducing_gap=2.0)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=UPLOAD_JPEG_QUALITY, optimize=True)
     except Exception as e:
-        return f"Error al conectar con la API: {str(e)}"
+        logger.warning("No se pudo comprimir la imagen", extra={"error": str(e)})
+        return image_bytes
+    compressed = buffer.getvalue()
+    logger.debug("Imagen comprimida", extra={"bytes": len(image_bytes), "compressed_bytes": len(compressed)})
+    return compressed
+
+def make_thumbnail(image_bytes):
+    """Miniatura JPEG de unos pocos KB para el historial del chat"""
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft("RGB", (THUMBNAIL_SIDE, THUMBNAIL_SIDE))
+        image = image.convert("RGB")
+        image.thumbnail((THUMBNAIL_SIDE, THUMBNAIL_SIDE), Image.Resampling.BICUBIC)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=70)
+        return buffer.getvalue()
+    except Exception as e:
+        logger.warning("No se pudo crear la miniatura", extra={"error": str(e)})
+        return None
 
 def get_image_bytes(image_object):
     """Convierte de manera segura un objeto de imagen a bytes"""
@@ -108,17 +219,61 @@ def get_image_bytes(image_object):
     else:
         return bytes(image_object)
 
+@st.cache_resource
+def get_chat_history():
+    return ChatHistory()
+
+def remember(message):
+    """Guarda el mensaje en disco y deja en memoria solo los más recientes"""
+    message["seq"] = get_chat_history().append(st.session_state.session_id, message)
+    st.session_state.messages.append(message)
+    del st.session_state.messages[:-CHAT_RECENT_MESSAGES]
+
+def render_message(message):
+    if message["role"] == "user":
+        with st.chat_message("user"):
+            if message.get("type") == "image":
+                st.write(f"📷 Foto enviada con pregunta: {message.get('question') or 'Análisis de imagen'}")
+                if message.get("thumbnail"):
+                    st.image(message["thumbnail"], width=THUMBNAIL_SIDE)
+            else:
+                st.write(message["content"])
+    else:
+        with st.chat_message("assistant"):
+            st.write(message["content"])
+
+def pending_image_bytes():
+    return st.session_state.pending_image_bytes or st.session_state.pending_camera_image_bytes
+
+def clear_pending_image():
+    st.session_state.pending_image_bytes = None
+    st.session_state.pending_camera_image_bytes = None
+
+def send_question(container, question):
+    """Envía la pregunta, con la foto pendiente si la hay, y guarda la pregunta y la respuesta"""
+    image_bytes = pending_image_bytes()
+    if image_bytes is not None:
+        thumbnail = make_thumbnail(image_bytes)
+        remember({"role": "user", "type": "image", "question": question, "thumbnail": thumbnail})
+        response = stream_answer(container, question, image_bytes, thumbnail)
+        clear_pending_image()
+    else:
+        remember({"role": "user", "content": question})
+        response = stream_answer(container, question)
+    remember({"role": "assistant", "content": response})
+
 if "messages" not in st.session_state:
+    # Solo los últimos CHAT_RECENT_MESSAGES; el resto se lee del disco por páginas
     st.session_state.messages = []
 
-if "camera_active" not in st.session_state:
-    st.session_state.camera_active = False
+if "history_pages" not in st.session_state:
+    st.session_state.history_pages = 0
 
-if "pending_image" not in st.session_state:
-    st.session_state.pending_image = None
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
-if "pending_camera_image" not in st.session_state:
-    st.session_state.pending_camera_image = None
+if "camera_active" not in st.session_state:
+    st.session_state.camera_active = False
 
 if "pending_image_bytes" not in st.session_state:
     st.session_state.pending_image_bytes = None
@@ -135,19 +290,19 @@ with col1:
     
     message_container = st.container(height=400)
     with message_container:
-        for message in st.session_state.messages:
-            if message["role"] == "user":
-                if message.get("type") == "image":
-                    with st.chat_message("user"):
-                        st.write(f"📷 Foto enviada con pregunta: {message.get('question', 'Análisis de imagen')}")
-                        if isinstance(message["content"], bytes):
-                            st.image(message["content"], width=200)
-                else:
-                    with st.chat_message("user"):
-                        st.write(message['content'])
-            else:
-                with st.chat_message("assistant"):
-                    st.write(message['content'])
+        recent = st.session_state.messages
+        # Los números de orden empiezan en 0 y no tienen huecos: el primero reciente es cuántos hay antes
+        older = recent[0]["seq"] if recent else 0
+        shown = min(older, st.session_state.history_pages * CHAT_PAGE_SIZE)
+        if shown < older:
+            if st.button(f"⬆️ Ver mensajes anteriores ({older - shown})", use_container_width=True):
+                st.session_state.history_pages += 1
+                st.rerun()
+        if shown:
+            for message in get_chat_history().page(st.session_state.session_id, before=older, limit=shown):
+                render_message(message)
+        for message in recent:
+            render_message(message)
     
     st.markdown("### 💬 Enviar mensaje")
     
@@ -167,31 +322,7 @@ with col1:
             submit_button = st.form_submit_button("Enviar", use_container_width=True, type="primary")
             
             if submit_button and user_input:
-                if st.session_state.pending_image_bytes is not None or st.session_state.pending_camera_image_bytes is not None:
-                    image_bytes = st.session_state.pending_image_bytes or st.session_state.pending_camera_image_bytes
-                    
-                    st.session_state.messages.append({
-                        "role": "user", 
-                        "content": image_bytes,
-                        "type": "image",
-                        "question": user_input
-                    })
-                    
-                    with st.spinner("Analizando imagen..."):
-                        response = query_api(user_input, image_bytes)
-                    
-                    st.session_state.pending_image = None
-                    st.session_state.pending_camera_image = None
-                    st.session_state.pending_image_bytes = None
-                    st.session_state.pending_camera_image_bytes = None
-                else:
-                    st.session_state.messages.append({"role": "user", "content": user_input})
-                    
-                    with st.spinner("Consultando..."):
-                        response = query_api(user_input)
-                
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                
+                send_question(message_container, user_input)
                 st.rerun()
     
     with tab2:
@@ -206,50 +337,27 @@ with col1:
         )
         
         if audio_bytes:
-            print(f"[DEBUG] Tamaño del audio grabado: {len(audio_bytes)} bytes")
+            logger.debug("Audio grabado", extra={"bytes": len(audio_bytes)})
             
             st.audio(audio_bytes, format="audio/wav")
             
+            transcribed_text = None
             if len(audio_bytes) < 1000:
                 st.warning("El audio grabado parece estar vacío. Por favor, intenta grabar de nuevo.")
             else:
                 with st.spinner("Transcribiendo audio..."):
-                    transcribed_text = transcribe_audio(audio_bytes)
+                    transcribed_text = transcribe_once(audio_bytes)
             
             if transcribed_text and not transcribed_text.startswith("Error"):
                 st.success(f"📝 **Transcripción:** {transcribed_text}")
                 
                 if st.button("📤 Enviar pregunta", use_container_width=True, type="primary"):
                     if transcribed_text and not transcribed_text.isspace():
-                        if st.session_state.pending_image_bytes is not None or st.session_state.pending_camera_image_bytes is not None:
-                            image_bytes = st.session_state.pending_image_bytes or st.session_state.pending_camera_image_bytes
-                            
-                            st.session_state.messages.append({
-                                "role": "user", 
-                                "content": image_bytes,
-                                "type": "image",
-                                "question": transcribed_text
-                            })
-                            
-                            with st.spinner("Analizando imagen..."):
-                                response = query_api(transcribed_text, image_bytes)
-                            
-                            st.session_state.pending_image = None
-                            st.session_state.pending_camera_image = None
-                            st.session_state.pending_image_bytes = None
-                            st.session_state.pending_camera_image_bytes = None
-                        else:
-                            st.session_state.messages.append({"role": "user", "content": transcribed_text})
-                            
-                            with st.spinner(f"Consultando sobre: '{transcribed_text}'"):
-                                response = query_api(transcribed_text)
-                        
-                        st.session_state.messages.append({"role": "assistant", "content": response})
-                        
+                        send_question(message_container, transcribed_text)
                         st.rerun()
                     else:
                         st.error("La transcripción está vacía. Por favor, graba tu pregunta de nuevo.")
-            else:
+            elif transcribed_text:
                 st.error(transcribed_text)
 
 with col2:
@@ -264,8 +372,7 @@ with col2:
         if picture is not None:
             if st.button("✅ Usar esta foto", use_container_width=True, type="primary"):
                 picture.seek(0)
-                st.session_state.pending_camera_image_bytes = picture.read()
-                st.session_state.pending_camera_image = picture
+                st.session_state.pending_camera_image_bytes = compress_for_upload(picture.read())
                 st.session_state.camera_active = False
                 st.rerun()
         
@@ -282,14 +389,21 @@ with col2:
     if uploaded_file is not None:
         if st.button("📤 Cargar imagen", use_container_width=True, type="primary"):
             uploaded_file.seek(0)
-            st.session_state.pending_image_bytes = uploaded_file.read()
-            st.session_state.pending_image = uploaded_file
+            st.session_state.pending_image_bytes = compress_for_upload(uploaded_file.read())
             st.rerun()
     
     if st.session_state.pending_image_bytes is not None or st.session_state.pending_camera_image_bytes is not None:
         if st.button("🗑️ Quitar imagen", use_container_width=True):
-            st.session_state.pending_image = None
-            st.session_state.pending_camera_image = None
-            st.session_state.pending_image_bytes = None
-            st.session_state.pending_camera_image_bytes = None
-            st.rerun()
\ No newline at end of file
+            clear_pending_image()
+            st.rerun()    
+    st.markdown("---")
+    if st.button("🆕 Nueva conversación", use_container_width=True):
+        try:
+            requests.delete(f"{API_URL}/sessions/{st.session_state.session_id}", timeout=5)
+        except requests.RequestException as e:
+            logger.warning("No se pudo cerrar la sesión", extra={"error": str(e)})
+        get_chat_history().clear(st.session_state.session_id)
+        st.session_state.session_id = uuid.uuid4().hex
+        st.session_state.messages = []
+        st.session_state.history_pages = 0
+        st.rerun()
@@ -0,0 +1,53 @@
+#app/worker.py
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from fastapi import Request
+
+
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "180"))
+DISCONNECT_POLL_S = 0.5
+
+
+class ClientDisconnected(Exception):
+    """El cliente cerró la conexión antes de recibir la respuesta"""
+
+
+class InferenceWorker:
+    """Hilo dedicado dueño del modelo: toda carga y generación se ejecuta aquí, fuera del event loop"""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+    def run(self, fn: Callable[..., Any], *args, **kwargs) -> "asyncio.Future":
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def watch_disconnect(request: Request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_S)
+
+
+async def await_inference(request: Request, awaitable, cancel_event, timeout: float = REQUEST_TIMEOUT_S):
+    """Espera un resultado del worker con límite de tiempo; lo cancela si el cliente se va"""
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.create_task(watch_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({task, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return task.result()
+
+        cancel_event.set()
+        task.cancel()
+        if watcher in done:
+            raise ClientDisconnected()
+        raise asyncio.TimeoutError()
+    finally:
+        watcher.cancel()